@@ -16,6 +16,7 @@ import signal  # To catch interrupts that need to stop the application.
 import sys  # Give the correct exit code.'
 
 import kek.application
+import kek.music_metadata
 import kek.storage
 
 if __name__ == "__main__":
@@ -29,6 +30,8 @@ if __name__ == "__main__":
 		handlers=[file_handler, console_handler]
 	)
 
+	kek.music_metadata.migrate()  # Before anything uses the database.
+
 	signal.signal(signal.SIGINT, signal.SIG_DFL)  # Python is not handling SIGINT, so let the kernel do that.
 	app = kek.application.Application(sys.argv)
 	sys.exit(app.exec())
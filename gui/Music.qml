@@ -237,10 +237,13 @@ Item {
 			anchors {
 				horizontalCenter: parent.horizontalCenter
 			}
-			width: 500
+			width: Kek.MusicPlayer.cover_size
 			height: width
 
 			source: Kek.MusicPlayer.current_cover
+			sourceSize.width: width
+			sourceSize.height: height
+			asynchronous: true
 		}
 
 		Text {
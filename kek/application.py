@@ -15,11 +15,16 @@ import PySide6.QtGui  # To remove the cursor.
 import PySide6.QtQml  # To register types with the QML engine, and create the engine.
 import PySide6.QtWidgets  # This is an application.
 import subprocess  # To call on Git to update the source code automatically.
+import threading  # To clean up the cache in the background.
 import typing
 
+import kek.cover_provider  # Providing cover images to QML.
 import kek.map  # Registering map Qt objects.
+import kek.music_metadata  # To store the music metadata when closing, and clean up its cache.
+import kek.music_browse  # Registering music Qt objects.
 import kek.music_directory  # Registering music Qt objects.
 import kek.music_player  # Registering music Qt objects.
+import kek.music_search  # Registering music Qt objects.
 import kek.playlist  # Registering music Qt objects.
 import kek.video_directory  # Registering video Qt objects.
 import kek.video_player  # Registering video Qt objects.
@@ -61,18 +66,25 @@ class Application(PySide6.QtWidgets.QApplication):
 		PySide6.QtQml.qmlRegisterSingletonInstance(kek.music_player.MusicPlayer, "Kek", 1, 0, "MusicPlayer", kek.music_player.MusicPlayer.get_instance())
 		PySide6.QtQml.qmlRegisterSingletonInstance(kek.playlist.Playlist, "Kek", 1, 0, "Playlist", kek.playlist.Playlist.get_instance())
 		PySide6.QtQml.qmlRegisterType(kek.music_directory.MusicDirectory, "Kek", 1, 0, "MusicDirectory")
+		PySide6.QtQml.qmlRegisterType(kek.music_search.MusicSearch, "Kek", 1, 0, "MusicSearch")
+		PySide6.QtQml.qmlRegisterType(kek.music_browse.MusicBrowse, "Kek", 1, 0, "MusicBrowse")
 		PySide6.QtQml.qmlRegisterSingletonInstance(kek.video_player.VideoPlayer, "Kek", 1, 0, "VideoPlayer", kek.video_player.VideoPlayer.get_instance())
 		PySide6.QtQml.qmlRegisterType(kek.video_directory.VideoDirectory, "Kek", 1, 0, "VideoDirectory")
 
 		logging.debug("Loading QML engine.")
 		self.engine = PySide6.QtQml.QQmlApplicationEngine()
 		self.engine.quit.connect(self.quit)
+		self.engine.addImageProvider("cover", kek.cover_provider.CoverProvider())
+		self.aboutToQuit.connect(kek.music_metadata.store_on_exit)  # Write the last changes to the metadata before closing.
 		logging.debug("Creating main window.")
 		self.engine.load("gui/MainWindow.qml")
 		self.setOverrideCursor(PySide6.QtGui.QCursor(PySide6.QtCore.Qt.BlankCursor))
 
 		logging.info("Start-up complete.")
 
+		# Clean up cover images that are no longer used.
+		threading.Thread(target=kek.music_metadata.collect_covers, daemon=True).start()
+
 		# Update my own source code.
 		source_directory = os.path.dirname(__file__)
 		os.chdir(source_directory)
@@ -0,0 +1,316 @@
+# Desktop environment for a domotics hub.
+# Copyright (C) 2026 Ghostkeeper
+# This application is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# This application is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for details.
+# You should have received a copy of the GNU Affero General Public License along with this application. If not, see <https://gnu.org/licenses/>.
+
+"""
+Defines the destinations that the playback engine can send audio to.
+
+Normally that is the audio device, but the audio can also be discarded or written to a file. That allows running the
+playback engine on a machine without an audio device, for instance to measure its performance.
+"""
+
+import abc  # The outputs implement a common interface.
+import logging
+import threading  # The file and null outputs consume audio on their own thread.
+import time  # To consume audio in real time.
+import typing
+import wave  # To write audio to a file.
+
+import kek.playback_stats  # To count when the audio device runs out of audio.
+
+Pull = typing.Callable[[int, bool], bytes]
+"""
+A function that an output calls to get the next audio to play.
+
+It gets the number of frames to get, and whether to pad the result with silence if there is not enough audio available.
+It returns the interleaved bytes of those frames.
+"""
+
+
+class AudioOutput(abc.ABC):
+	"""
+	A destination for audio, which takes the audio from the playback engine at its own pace.
+
+	The output is opened with a certain format. While it is started, it repeatedly pulls audio from the playback engine.
+	"""
+
+	frames_per_pull = 512
+	"""
+	The number of frames that the output requests at once.
+	"""
+
+	realtime = True
+	"""
+	Whether the output consumes audio at the speed that it is played at.
+
+	If not, the playback engine should produce audio as fast as it can.
+	"""
+
+	@abc.abstractmethod
+	def open(self, sample_width: int, frame_rate: int, channels: int, pull: Pull) -> None:
+		"""
+		Prepare the output to receive audio in a certain format, and start consuming audio.
+		:param sample_width: The number of bytes per sample.
+		:param frame_rate: The number of frames per second (Hz).
+		:param channels: The number of channels in each frame.
+		:param pull: The function to call to get audio.
+		"""
+		pass
+
+	@abc.abstractmethod
+	def close(self) -> None:
+		"""
+		Stop consuming audio and release the resources of the output.
+
+		If the output is not open, this does nothing.
+		"""
+		pass
+
+	@abc.abstractmethod
+	def start(self) -> None:
+		"""
+		Resume consuming audio after it was stopped.
+		"""
+		pass
+
+	@abc.abstractmethod
+	def stop(self) -> None:
+		"""
+		Stop consuming audio for a while, waiting until the audio that was already consumed has been played.
+		"""
+		pass
+
+	def latency(self) -> float:
+		"""
+		Get how long it takes for audio that the output consumed to be heard.
+		:return: The latency of the output, in seconds.
+		"""
+		return 0.0
+
+
+class PyAudioOutput(AudioOutput):
+	"""
+	Plays audio through the audio device of the operating system, using PyAudio.
+
+	The audio device requests audio through a callback, on a thread of its own.
+	"""
+
+	def __init__(self) -> None:
+		"""
+		Prepare to play audio through the audio device.
+
+		The audio device is not accessed until the output is opened.
+		"""
+		self.audio_server = None
+		self.stream = None
+
+	def open(self, sample_width: int, frame_rate: int, channels: int, pull: Pull) -> None:
+		"""
+		Open a stream to the audio device with a certain format, and start playing.
+		:param sample_width: The number of bytes per sample.
+		:param frame_rate: The number of frames per second (Hz).
+		:param channels: The number of channels in each frame.
+		:param pull: The function to call to get audio.
+		"""
+		import pyaudio  # Only import when used, so that the other outputs work without an audio device.
+		self.close()
+		self.audio_server = pyaudio.PyAudio()
+		xrun_flags = pyaudio.paOutputUnderflow | pyaudio.paOutputOverflow
+
+		def callback(in_data: typing.Optional[bytes], frame_count: int, time_info: dict, status: int) -> tuple[bytes, int]:
+			if status & xrun_flags:  # The device ran out of audio before this callback, or got it too late.
+				kek.playback_stats.record_device_xrun()
+			return pull(frame_count, True), pyaudio.paContinue
+		self.stream = self.audio_server.open(format=self.audio_server.get_format_from_width(sample_width), rate=frame_rate, channels=channels, output=True, frames_per_buffer=self.frames_per_pull, stream_callback=callback)
+
+	def close(self) -> None:
+		"""
+		Close the stream to the audio device, and release PortAudio.
+		"""
+		if self.stream is not None:
+			self.stream.stop_stream()
+			self.stream.close()
+			self.stream = None
+		if self.audio_server is not None:
+			self.audio_server.terminate()
+			self.audio_server = None
+
+	def start(self) -> None:
+		"""
+		Resume playing audio after it was stopped.
+		"""
+		self.stream.start_stream()
+
+	def stop(self) -> None:
+		"""
+		Stop playing audio for a while, waiting until the audio that the device already received has been played.
+		"""
+		self.stream.stop_stream()
+
+	def latency(self) -> float:
+		"""
+		Get how long it takes for audio that the audio device requested to be heard.
+		:return: The output latency of the audio device, in seconds.
+		"""
+		if self.stream is None:
+			return 0.0
+		return self.stream.get_output_latency()
+
+
+class NullOutput(AudioOutput):
+	"""
+	Consumes audio without playing it.
+
+	The audio can be consumed in real time, simulating an audio device, or as fast as the playback engine can produce it.
+	"""
+
+	def __init__(self, realtime: bool=True) -> None:
+		"""
+		Prepare to consume audio.
+		:param realtime: Whether to consume the audio at the speed that it would be played at. If ``False``, the audio
+		is consumed as fast as it is produced.
+		"""
+		self.realtime = realtime
+		self.frame_size = 1
+		self.frame_rate = 44100
+		self.pull: typing.Optional[Pull] = None
+		self.thread: typing.Optional[threading.Thread] = None
+		self.running = threading.Event()  # Set while the output should consume audio.
+		self.closing = False  # Set to make the thread end.
+		self.frames_consumed = 0  # The total number of frames consumed since the output was opened.
+
+	def open(self, sample_width: int, frame_rate: int, channels: int, pull: Pull) -> None:
+		"""
+		Start consuming audio in a certain format.
+		:param sample_width: The number of bytes per sample.
+		:param frame_rate: The number of frames per second (Hz).
+		:param channels: The number of channels in each frame.
+		:param pull: The function to call to get audio.
+		"""
+		self.close()
+		self.start_consuming(sample_width, frame_rate, channels, pull)
+
+	def start_consuming(self, sample_width: int, frame_rate: int, channels: int, pull: Pull) -> None:
+		"""
+		Start the thread that consumes audio.
+		:param sample_width: The number of bytes per sample.
+		:param frame_rate: The number of frames per second (Hz).
+		:param channels: The number of channels in each frame.
+		:param pull: The function to call to get audio.
+		"""
+		self.frame_size = sample_width * channels
+		self.frame_rate = frame_rate
+		self.pull = pull
+		self.frames_consumed = 0
+		self.closing = False
+		self.running.set()
+		self.thread = threading.Thread(target=self.consume_loop, daemon=True)
+		self.thread.start()
+
+	def close(self) -> None:
+		"""
+		Stop consuming audio.
+		"""
+		if self.thread is None:
+			return
+		self.closing = True
+		self.running.set()  # Wake the thread up if it was stopped, so that it can end.
+		self.thread.join()
+		self.thread = None
+
+	def start(self) -> None:
+		"""
+		Resume consuming audio after it was stopped.
+		"""
+		self.running.set()
+
+	def stop(self) -> None:
+		"""
+		Stop consuming audio for a while.
+		"""
+		self.running.clear()
+
+	def consume_loop(self) -> None:
+		"""
+		Repeatedly pull audio from the playback engine.
+
+		This runs on its own thread while the output is open.
+		"""
+		next_time = time.perf_counter()
+		while not self.closing:
+			if not self.running.is_set():
+				self.running.wait()
+				next_time = time.perf_counter()
+				continue
+			data = self.pull(self.frames_per_pull, self.realtime)
+			if len(data) > 0:
+				self.consume(data)
+				self.frames_consumed += len(data) // self.frame_size
+			if self.realtime:
+				# Schedule by absolute time, so that delays don't accumulate.
+				next_time += self.frames_per_pull / self.frame_rate
+				time.sleep(max(0.0, next_time - time.perf_counter()))
+			elif len(data) == 0:
+				time.sleep(0.001)  # Nothing available yet. Give the playback engine a moment to produce more.
+
+	def consume(self, data: bytes) -> None:
+		"""
+		Do something with the audio that was pulled from the playback engine.
+
+		The null output does nothing with it.
+		:param data: The interleaved bytes of the audio.
+		"""
+		pass
+
+
+class WaveFileOutput(NullOutput):
+	"""
+	Writes audio to a WAV file.
+
+	If the output is re-opened, for instance because the format of the audio changed, the file is overwritten.
+	"""
+
+	def __init__(self, filepath: str, realtime: bool=False) -> None:
+		"""
+		Prepare to write audio to a file.
+		:param filepath: The path to the file to write to.
+		:param realtime: Whether to consume the audio at the speed that it would be played at. If ``False``, the audio
+		is written as fast as it is produced.
+		"""
+		super().__init__(realtime)
+		self.filepath = filepath
+		self.file: typing.Optional[wave.Wave_write] = None
+
+	def open(self, sample_width: int, frame_rate: int, channels: int, pull: Pull) -> None:
+		"""
+		Start writing audio in a certain format to the file.
+		:param sample_width: The number of bytes per sample.
+		:param frame_rate: The number of frames per second (Hz).
+		:param channels: The number of channels in each frame.
+		:param pull: The function to call to get audio.
+		"""
+		self.close()
+		logging.info(f"Writing audio to file: {self.filepath}")
+		self.file = wave.open(self.filepath, "wb")
+		self.file.setsampwidth(sample_width)
+		self.file.setframerate(frame_rate)
+		self.file.setnchannels(channels)
+		self.start_consuming(sample_width, frame_rate, channels, pull)
+
+	def close(self) -> None:
+		"""
+		Stop writing audio and close the file.
+		"""
+		super().close()
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+	def consume(self, data: bytes) -> None:
+		"""
+		Write audio to the file.
+		:param data: The interleaved bytes of the audio.
+		"""
+		self.file.writeframesraw(data)
@@ -0,0 +1,151 @@
+# Desktop environment for a domotics hub.
+# Copyright (C) 2026 Ghostkeeper
+# This application is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# This application is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for details.
+# You should have received a copy of the GNU Affero General Public License along with this application. If not, see <https://gnu.org/licenses/>.
+
+"""
+Provides cover images to QML, scaled down to the size they are displayed at.
+
+Cover images embedded in music files are often much larger than they are displayed. Decoding them at full size takes a
+long time and a lot of memory. This scales them down while decoding, and keeps the scaled-down versions in memory, so
+that showing the cover of a track again is instant. Covers can be prepared in the background before they are shown.
+
+In QML, the covers are available as ``image://cover/`` followed by the URL-encoded path to the image file.
+"""
+
+import collections  # For the least-recently-used ordering of the cache.
+import concurrent.futures  # To prepare thumbnails in the background.
+import logging
+import PySide6.QtCore  # For the size of images.
+import PySide6.QtGui  # To scale and decode images.
+import PySide6.QtQuick  # To provide images to QML.
+import threading  # The cache is accessed from multiple threads.
+import urllib.parse  # To encode the path to the image in a URL.
+
+thumbnail_size = 500
+"""
+The size to scale cover images down to, in pixels, if QML doesn't request a specific size, and to prepare them at.
+
+The image is scaled to fit in a square of this size, keeping its aspect ratio. This is also the size that the cover of
+the current track is shown at, so that the thumbnails prepared in advance are the ones that QML requests.
+"""
+
+memory_budget = 32 * 1024 * 1024
+"""
+The maximum total size of the thumbnails kept in memory, in bytes.
+"""
+
+memory_cache: collections.OrderedDict[tuple[str, int, int], PySide6.QtGui.QImage] = collections.OrderedDict()
+"""
+The thumbnails in memory, by the path to the original image and the size they were scaled to fit in.
+
+The least recently used thumbnails come first.
+"""
+
+memory_size = 0
+"""
+The total size of the thumbnails in the memory cache, in bytes.
+"""
+
+cache_lock = threading.Lock()
+"""
+While the memory cache is modified, this lock has to be obtained.
+"""
+
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+"""
+Prepares thumbnails in the background, one at a time.
+"""
+
+
+def url(path: str) -> str:
+	"""
+	Get the URL to show a cover image in QML.
+	:param path: The path to the image file.
+	:return: A URL for the image provider. If there is no image, this is an empty string.
+	"""
+	if path == "":
+		return ""
+	return "image://cover/" + urllib.parse.quote(path)
+
+
+def thumbnail(path: str, width: int, height: int) -> PySide6.QtGui.QImage:
+	"""
+	Get a scaled-down version of an image.
+
+	If the thumbnail is in the memory cache, it is taken from there. Otherwise the image is decoded and scaled down, and
+	the result is stored in the cache.
+	:param path: The path to the image file.
+	:param width: The maximum width of the thumbnail.
+	:param height: The maximum height of the thumbnail.
+	:return: The thumbnail. If the image could not be read, the result is a null image.
+	"""
+	global memory_size
+	key = (path, width, height)
+	with cache_lock:
+		if key in memory_cache:
+			memory_cache.move_to_end(key)
+			return memory_cache[key]
+
+	reader = PySide6.QtGui.QImageReader(path)
+	original_size = reader.size()
+	if original_size.isValid() and (original_size.width() > width or original_size.height() > height):
+		# Scaling while decoding is much faster than decoding at full size, especially for JPEG.
+		reader.setScaledSize(original_size.scaled(width, height, PySide6.QtCore.Qt.KeepAspectRatio))
+	image = reader.read()
+	if image.isNull():
+		logging.warning(f"Unable to read cover image {path}: {reader.errorString()}")
+		return image
+
+	with cache_lock:
+		if key not in memory_cache:
+			memory_cache[key] = image
+			memory_size += image.sizeInBytes()
+		while memory_size > memory_budget and len(memory_cache) > 1:
+			_, evicted = memory_cache.popitem(last=False)
+			memory_size -= evicted.sizeInBytes()
+	return image
+
+
+def prepare(path: str) -> None:
+	"""
+	Start preparing the thumbnail of an image in the background, so that it can be shown right away later.
+	:param path: The path to the image file. If this is an empty string, nothing is prepared.
+	"""
+	if path == "":
+		return
+	executor.submit(thumbnail, path, thumbnail_size, thumbnail_size)
+
+
+class CoverProvider(PySide6.QtQuick.QQuickImageProvider):
+	"""
+	Provides scaled-down cover images to QML.
+
+	The images are loaded on a separate thread, so that decoding them doesn't freeze the GUI.
+	"""
+
+	def __init__(self) -> None:
+		"""
+		Construct the image provider.
+		"""
+		super().__init__(PySide6.QtQuick.QQuickImageProvider.ImageType.Image, PySide6.QtQuick.QQuickImageProvider.Flag.ForceAsynchronousImageLoading)
+
+	def requestImage(self, id: str, size: PySide6.QtCore.QSize, requested_size: PySide6.QtCore.QSize) -> PySide6.QtGui.QImage:
+		"""
+		Get the image for a URL.
+
+		This function is called by Qt when QML needs to show an image from this provider.
+		:param id: The part of the URL after ``image://cover/``, which is the URL-encoded path to the image file.
+		:param size: This is set to the size of the resulting image.
+		:param requested_size: The size that QML wants to show the image at. If not valid, the image is scaled down to
+		the default thumbnail size.
+		:return: The scaled-down image.
+		"""
+		width = requested_size.width() if requested_size.width() > 0 else thumbnail_size
+		height = requested_size.height() if requested_size.height() > 0 else thumbnail_size
+		image = thumbnail(urllib.parse.unquote(id), width, height)
+		if size is not None:
+			size.setWidth(image.width())
+			size.setHeight(image.height())
+		return image
@@ -0,0 +1,197 @@
+# Desktop environment for a domotics hub.
+# Copyright (C) 2026 Ghostkeeper
+# This application is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# This application is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for details.
+# You should have received a copy of the GNU Affero General Public License along with this application. If not, see <https://gnu.org/licenses/>.
+
+"""
+Converts audio from one format to another, so that audio in different formats can be played through the same stream.
+"""
+
+import math  # To compute how many frames are left at the end of the stream.
+import numpy  # For fast operations on wave data.
+import typing
+
+integer_types = {
+	2: numpy.int16,
+	4: numpy.int32,
+}
+"""
+The data type of the samples for each sample width that we can convert to.
+"""
+
+
+def low_pass(step: float) -> numpy.array:
+	"""
+	Create a low-pass filter that removes the frequencies that can't be represented after downsampling.
+
+	The filter is a windowed sinc. It cuts off a bit below the Nyquist frequency of the output, so that the transition
+	band of the filter doesn't fold back into the audible band.
+	:param step: How far the input advances for every output frame. Must be greater than 1.
+	:return: The coefficients of the filter, an odd number of them. They add up to 1.
+	"""
+	half_length = math.ceil(16 * step)
+	cutoff = 0.45 / step  # In cycles per input frame.
+	offsets = numpy.arange(-half_length, half_length + 1)
+	taps = numpy.sinc(2 * cutoff * offsets) * numpy.blackman(len(offsets))
+	return (taps / taps.sum()).astype(numpy.float32)
+
+
+def channel_mix(in_channels: int, out_channels: int) -> numpy.array:
+	"""
+	Create a matrix that maps audio from one number of channels to another.
+
+	When reducing the number of channels, each output channel gets the average of the input channels that map to it.
+	When increasing the number of channels, the input channels are repeated. This turns mono into equal stereo and
+	stereo into mono.
+	:param in_channels: The number of channels of the input audio.
+	:param out_channels: The number of channels of the output audio.
+	:return: A matrix with a row for each input channel and a column for each output channel, to multiply frames with.
+	"""
+	mix = numpy.zeros((in_channels, out_channels), dtype=numpy.float32)
+	if in_channels >= out_channels:
+		for in_channel in range(in_channels):
+			mix[in_channel, in_channel % out_channels] = 1
+		mix /= mix.sum(axis=0)  # Average the input channels that are combined.
+	else:
+		for out_channel in range(out_channels):
+			mix[out_channel % in_channels, out_channel] = 1
+	return mix
+
+
+class FormatConverter:
+	"""
+	Converts a stream of audio frames to a different sample width, frame rate and number of channels.
+
+	The audio is converted in chunks. The converter remembers where it was between chunks, so that the chunks connect
+	seamlessly. The frame rate is converted with linear interpolation. When downsampling, a low-pass filter first
+	removes the frequencies above the Nyquist frequency of the output, which would otherwise alias into the audible band.
+	At the end of the stream, ``flush`` gives the last output frames, which can't be produced until it's known that no
+	more input follows.
+	"""
+
+	def __init__(self, in_rate: int, in_channels: int, out_width: int, out_rate: int, out_channels: int) -> None:
+		"""
+		Prepare to convert audio.
+		:param in_rate: The frame rate of the input audio (Hz).
+		:param in_channels: The number of channels of the input audio.
+		:param out_width: The number of bytes per sample of the output audio.
+		:param out_rate: The frame rate of the output audio (Hz).
+		:param out_channels: The number of channels of the output audio.
+		"""
+		self.step = in_rate / out_rate  # How far to advance in the input for every output frame.
+		self.mix = channel_mix(in_channels, out_channels)
+		self.out_type = integer_types[out_width]
+		self.out_scale = 2 ** (out_width * 8 - 1)
+		self.phase = 0.0  # Where the next output frame is, relative to the first frame that will be interpolated from.
+		self.previous: numpy.array = numpy.empty((0, out_channels), dtype=numpy.float32)  # The last input frame of the previous chunk.
+
+		# When downsampling, the input is filtered first. The filter delays its output by half its length.
+		self.filter: typing.Optional[numpy.array] = low_pass(self.step) if self.step > 1 else None
+		self.delay = len(self.filter) // 2 if self.filter is not None else 0
+		self.history: numpy.array = numpy.zeros((2 * self.delay, out_channels), dtype=numpy.float32)  # The last input frames before the filter.
+		self.delay_left = self.delay  # How many frames of the filter output to drop, to compensate for its delay.
+		self.filtered_any = False  # Whether any input went through the filter since the last reset.
+
+	def reset(self) -> None:
+		"""
+		Forget where the converter was, for instance because the input jumped to a different position.
+		"""
+		self.phase = 0.0
+		self.previous = self.previous[0:0]
+		self.history[:] = 0
+		self.delay_left = self.delay
+		self.filtered_any = False
+
+	def flush_frame_count(self) -> int:
+		"""
+		Get the maximum number of frames that ``flush`` can give.
+		:return: A number of output frames.
+		"""
+		if self.step == 1:
+			return 0
+		return math.ceil((self.delay + 1) / self.step) + 1
+
+	def convert(self, frames: numpy.array) -> numpy.array:
+		"""
+		Convert the next chunk of audio.
+		:param frames: A two-dimensional array of input frames, each containing one sample for each channel. The samples
+		must be signed integers.
+		:return: A contiguous two-dimensional array of output frames.
+		"""
+		if len(frames) == 0:
+			return numpy.empty((0, self.mix.shape[1]), dtype=self.out_type)
+		in_scale = 2 ** (frames.itemsize * 8 - 1)
+		mixed = (frames.astype(numpy.float32) / in_scale) @ self.mix  # Convert to floats between -1 and 1 in the output channels.
+		if self.filter is not None:
+			mixed = self.apply_filter(mixed)
+		return self.quantise(self.resample(mixed))
+
+	def apply_filter(self, mixed: numpy.array) -> numpy.array:
+		"""
+		Filter the next chunk of audio with the low-pass filter.
+
+		The output of the filter lags behind its input. The first frames of the output, from before the start of the
+		stream, are dropped. So the output is shorter than the input at first, and catches up when the stream is flushed.
+		:param mixed: A two-dimensional array of frames, in the output channels.
+		:return: The filtered frames that are complete so far.
+		"""
+		extended = numpy.concatenate((self.history, mixed))
+		filtered = numpy.empty((len(mixed), mixed.shape[1]), dtype=numpy.float32)
+		for channel_num in range(mixed.shape[1]):
+			filtered[:, channel_num] = numpy.convolve(extended[:, channel_num], self.filter, mode="valid")
+		self.history = extended[len(extended) - len(self.history):]
+		self.filtered_any = True
+		dropped = min(self.delay_left, len(filtered))
+		self.delay_left -= dropped
+		return filtered[dropped:]
+
+	def resample(self, mixed: numpy.array) -> numpy.array:
+		"""
+		Convert the frame rate of the next chunk of audio.
+		:param mixed: A two-dimensional array of frames, in the output channels.
+		:return: The frames at the output frame rate, as floats.
+		"""
+		if len(mixed) == 0:  # For instance because the filter is still filling up.
+			return mixed
+		mixed = numpy.concatenate((self.previous, mixed))
+		if self.step != 1:
+			# Interpolate at all output positions that lie within this chunk, including the frame from the previous chunk.
+			positions = numpy.arange(self.phase, len(mixed) - 1, self.step)
+			source = numpy.arange(len(mixed))
+			resampled = numpy.empty((len(positions), mixed.shape[1]), dtype=numpy.float32)
+			for channel_num in range(mixed.shape[1]):
+				resampled[:, channel_num] = numpy.interp(positions, source, mixed[:, channel_num])
+			self.phase = self.phase + len(positions) * self.step - (len(mixed) - 1)
+			self.previous = mixed[-1:]
+			mixed = resampled
+		return mixed
+
+	def flush(self) -> numpy.array:
+		"""
+		Convert the end of the stream, after the last chunk of input.
+
+		The output frames between the last input frame and the end of the stream can't be interpolated, since there is no
+		next input frame. They repeat the last input frame instead. With that, the output has exactly as many frames as
+		fit in the duration of the input. If the input is filtered, the end of the input is first pushed through the filter,
+		by repeating the last input frame for the length of the delay of the filter. Afterwards, the converter is reset.
+		:return: A contiguous two-dimensional array with the remaining output frames. This may be empty. There are at
+		most ``flush_frame_count`` of them.
+		"""
+		tail = self.previous[0:0]
+		if self.filter is not None and self.filtered_any:
+			tail = self.resample(self.apply_filter(numpy.repeat(self.history[-1:], self.delay, axis=0)))
+		count = 0
+		if self.step != 1 and len(self.previous) > 0:
+			count = max(0, math.ceil((1 - self.phase) / self.step - 1e-6))  # With some tolerance for rounding errors in the phase.
+		remaining = numpy.concatenate((tail, numpy.repeat(self.previous, count, axis=0)))
+		self.reset()
+		return self.quantise(remaining)
+
+	def quantise(self, mixed: numpy.array) -> numpy.array:
+		"""
+		Convert frames from floats between -1 and 1 to the output sample width.
+		:param mixed: A two-dimensional array of frames, in the output channels.
+		:return: A contiguous two-dimensional array of output frames.
+		"""
+		return numpy.clip(numpy.round(mixed * self.out_scale), -self.out_scale, self.out_scale - 1).astype(self.out_type)
@@ -0,0 +1,205 @@
+# Desktop environment for a domotics hub.
+# Copyright (C) 2026 Ghostkeeper
+# This application is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# This application is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for details.
+# You should have received a copy of the GNU Affero General Public License along with this application. If not, see <https://gnu.org/licenses/>.
+
+"""
+Defines a Qt model that lists the music library by artist and album, rather than by directory.
+"""
+
+import logging
+import math  # To format durations.
+import PySide6.QtCore  # To expose this list to QML.
+import sqlite3  # To handle errors from the database.
+import typing
+
+import kek.music_metadata  # To get the artists, albums and tracks.
+
+
+class MusicBrowse(PySide6.QtCore.QAbstractListModel):
+	"""
+	A list of artists, of the albums of an artist, or of the tracks on an album.
+
+	Which of these is listed depends on the depth. At depth 0, all artists are listed. At depth 1, the albums of the
+	current artist are listed. At depth 2, the tracks on the current album are listed.
+
+	The artists and albums are summarised in the database as the metadata changes, so listing them doesn't need to go
+	through all tracks.
+	"""
+
+	def __init__(self, parent: typing.Optional[PySide6.QtCore.QObject]=None) -> None:
+		"""
+		Construct a new browsing model.
+		:param parent: The parent element to this QML element, if any.
+		"""
+		super().__init__(parent)
+
+		user_role = PySide6.QtCore.Qt.UserRole
+		self.role_to_field = {
+			user_role + 1: "name",
+			user_role + 2: "artist",
+			user_role + 3: "album",
+			user_role + 4: "path",
+			user_role + 5: "album_count",
+			user_role + 6: "track_count",
+			user_role + 7: "duration",
+		}
+
+		self.music: list[dict[str, typing.Any]] = []  # The actual data contained in this list.
+		self._depth = 0
+		self._artist = ""
+		self._album = ""
+		self.refresh()
+
+	@PySide6.QtCore.Slot()
+	def refresh(self) -> None:
+		"""
+		Read the list anew from the database.
+		"""
+		try:
+			if self._depth == 0:
+				new_music = [dict(entry, name=entry["artist"], album="", path="") for entry in kek.music_metadata.artists()]
+			elif self._depth == 1:
+				new_music = [dict(entry, name=entry["album"], album_count=1, path="") for entry in kek.music_metadata.albums(self._artist)]
+			else:
+				new_music = [{
+					"name": entry.title,
+					"artist": entry.artist,
+					"album": entry.album,
+					"path": entry.path,
+					"album_count": 1,
+					"track_count": 1,
+					"duration": entry.duration,
+				} for entry in kek.music_metadata.album_tracks(self._artist, self._album)]
+		except sqlite3.Error as e:
+			logging.error(f"Unable to read artists and albums from the music database: {e}")
+			new_music = []
+
+		self.beginResetModel()
+		self.music = new_music
+		self.endResetModel()
+		self.count_changed.emit()
+
+	count_changed = PySide6.QtCore.Signal()
+
+	@PySide6.QtCore.Property(int, notify=count_changed)
+	def count(self) -> int:
+		"""
+		Returns the number of items in the list.
+		:return: The number of artists, albums or tracks.
+		"""
+		return len(self.music)
+
+	def rowCount(self, parent: typing.Optional[PySide6.QtCore.QModelIndex]=PySide6.QtCore.QModelIndex()) -> int:
+		"""
+		Returns the number of items in the list.
+		:param parent: The parent element to display the child entries under. This is a plain list, so no parent should
+		be provided.
+		:return: The number of artists, albums or tracks.
+		"""
+		if parent.isValid():
+			return 0
+		return len(self.music)
+
+	def columnCount(self, parent: typing.Optional[PySide6.QtCore.QModelIndex]=PySide6.QtCore.QModelIndex()) -> int:
+		"""
+		Returns the number of columns in this list, which is always 1.
+		:param parent: The parent element to display the child entries under. This is a plain list, so no parent should
+		be provided.
+		:return: The number of columns in the list.
+		"""
+		if parent.isValid():
+			return 0
+		return 1
+
+	def roleNames(self) -> dict[int, bytes]:
+		"""
+		Gets the names of the roles as exposed to QML.
+
+		This function is called internally by Qt to match a model field in the QML code with the roles in this model.
+		:return: A mapping of roles to field names. The field names are bytes.
+		"""
+		return {role: field.encode("utf-8") for role, field in self.role_to_field.items()}
+
+	def data(self, index: PySide6.QtCore.QModelIndex, role: int=PySide6.QtCore.Qt.DisplayRole) -> typing.Any:
+		"""
+		Returns one field of the data in the list.
+		:param index: The row and column index of the cell to give the data from.
+		:param role: Which data to return for this cell. Defaults to the data displayed, which is the only data we
+		store for a cell.
+		:return: The data contained in that cell, as a string.
+		"""
+		if not index.isValid():
+			return None  # Only valid indices return data.
+		if role not in self.role_to_field:
+			return None
+		field = self.role_to_field[role]
+		value = self.music[index.row()][field]
+		if field == "duration":
+			if value < 0:
+				return ""
+			seconds = round(value)
+			if seconds >= 3600:
+				return str(math.floor(seconds / 3600)) + ":" + ("0" if (seconds // 60 % 60 < 10) else "") + str(seconds // 60 % 60) + ":" + ("0" if (seconds % 60 < 10) else "") + str(seconds % 60)
+			return str(math.floor(seconds / 60)) + ":" + ("0" if (seconds % 60 < 10) else "") + str(seconds % 60)
+		return str(value)  # Default, just convert to string.
+
+	def depth_set(self, new_depth: int) -> None:
+		"""
+		Change what kind of items are listed.
+		:param new_depth: 0 to list artists, 1 to list the albums of the current artist, or 2 to list the tracks on the
+		current album.
+		"""
+		new_depth = max(0, min(2, new_depth))
+		if new_depth == self._depth:  # Didn't actually change.
+			return
+		self._depth = new_depth
+		self.refresh()
+
+	@PySide6.QtCore.Property(int, fset=depth_set)
+	def depth(self) -> int:
+		"""
+		What kind of items are listed: 0 for artists, 1 for the albums of the current artist, 2 for the tracks on the
+		current album.
+		:return: The current depth.
+		"""
+		return self._depth
+
+	def artist_set(self, new_artist: str) -> None:
+		"""
+		Change the artist to list the albums of.
+		:param new_artist: The name of the artist.
+		"""
+		if new_artist == self._artist:  # Didn't actually change.
+			return
+		self._artist = new_artist
+		if self._depth > 0:
+			self.refresh()
+
+	@PySide6.QtCore.Property(str, fset=artist_set)
+	def artist(self) -> str:
+		"""
+		The artist to list the albums of, at depth 1 and 2.
+		:return: The name of the current artist.
+		"""
+		return self._artist
+
+	def album_set(self, new_album: str) -> None:
+		"""
+		Change the album to list the tracks of.
+		:param new_album: The name of the album.
+		"""
+		if new_album == self._album:  # Didn't actually change.
+			return
+		self._album = new_album
+		if self._depth > 1:
+			self.refresh()
+
+	@PySide6.QtCore.Property(str, fset=album_set)
+	def album(self) -> str:
+		"""
+		The album to list the tracks of, at depth 2.
+		:return: The name of the current album.
+		"""
+		return self._album
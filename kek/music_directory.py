@@ -12,7 +12,6 @@ import dirsync  # To sync music from the network in the background.
 import itertools  # To sort directories.
 import logging
 import math  # To format track duration.
-import mutagen  # To read metadata from music files.
 import os  # To find the music directory.
 import os.path  # To list files in the music directory.
 import PySide6.QtCore  # To expose this table to QML.
@@ -20,7 +19,9 @@ import re  # To implement human sorting.
 import threading  # To sync music from the network in the background.
 import typing
 
+import kek.music_indexer  # To keep the metadata of the whole library up to date.
 import kek.music_metadata  # To get the duration of files quickly.
+import kek.stat_cache  # To list directories quickly.
 
 
 supported_extensions = [".mp3", ".flac", ".ogg", ".opus", ".wav", ".m3u"]
@@ -34,9 +35,10 @@ def sort_directory(entries: list[str]) -> list[str]:
 	:param entries: The items in the directory. Provide full file paths, please!
 	:return: Those same items, but reordered in correct sort order.
 	"""
-	subdirectories = filter(os.path.isdir, entries)
-	subfiles = filter(os.path.isfile, entries)
-	submusic = filter(lambda x: os.path.splitext(x)[1] in supported_extensions, subfiles)
+	statuses = [kek.stat_cache.stat(entry) for entry in entries]
+	subdirectories = [status.path for status in statuses if status is not None and status.is_dir]
+	subfiles = [status.path for status in statuses if status is not None and status.is_file]
+	submusic = filter(lambda x: os.path.splitext(x)[1].lower() in supported_extensions, subfiles)
 
 	convert_numbers = lambda text: float(text) if text.replace(".", "", 1).isdigit() else text.lower()
 	human_sort = lambda key: [convert_numbers(t) for t in re.split(r"((?:[0-9]*[.])?[0-9]+)", key)]
@@ -57,8 +59,6 @@ class MusicDirectory(PySide6.QtCore.QAbstractListModel):
 		"""
 		super().__init__(parent)
 
-		kek.music_metadata.load()
-
 		user_role = PySide6.QtCore.Qt.UserRole
 		self.role_to_field = {
 			user_role + 1: "path",
@@ -71,7 +71,9 @@ class MusicDirectory(PySide6.QtCore.QAbstractListModel):
 
 		self.default_directory = os.getenv("XDG_MUSIC_DIR", default=os.path.expanduser("~/Music"))
 		self._directory = ""
+		self.directory_indexed.connect(self.on_directory_indexed)
 		self.directory_set(self.default_directory)
+		kek.music_indexer.start(self.default_directory)  # Keep the metadata of the whole library up to date in the background.
 
 		# In the background, synchronise from the cloud.
 		if len(os.listdir("/music")) > 0:
@@ -82,6 +84,13 @@ class MusicDirectory(PySide6.QtCore.QAbstractListModel):
 			logging.warning("Music disk is not properly mounted. Cannot sync!")
 
 
+	directory_indexed = PySide6.QtCore.Signal(str)
+	"""
+	Emitted by the indexer when it updated the metadata of a directory that was requested by this model.
+
+	It gets the directory that was indexed.
+	"""
+
 	def rowCount(self, parent: typing.Optional[PySide6.QtCore.QModelIndex]=PySide6.QtCore.QModelIndex()) -> int:
 		"""
 		Returns the number of music files and directories in this table.
@@ -145,10 +154,13 @@ class MusicDirectory(PySide6.QtCore.QAbstractListModel):
 			logging.warning(f"Trying to set music directory to non-existent path: {new_directory}")
 			return
 
-		kek.music_metadata.add_directory(new_directory)
+		kek.music_indexer.index_soon(new_directory, self.directory_indexed.emit)  # Shows what we know now, and updates when the files are read.
+		kek.music_metadata.load_directory(new_directory)
 
-		entries = [os.path.join(new_directory, f) for f in os.listdir(new_directory)]
+		entries = [entry.path for entry in kek.stat_cache.list_directory(new_directory).values()]
 		entries = [".."] + sort_directory(entries)
+		statuses = {filepath: kek.stat_cache.stat(filepath) for filepath in entries if filepath != ".."}
+		directory_totals = kek.music_metadata.directory_totals([filepath for filepath, status in statuses.items() if status is not None and status.is_dir])
 		new_music = []
 		for filepath in entries:
 			logging.debug(f"Listing directory entry: {filepath}")
@@ -161,16 +173,15 @@ class MusicDirectory(PySide6.QtCore.QAbstractListModel):
 						"duration": -1,
 					})
 				continue
-			if os.path.isdir(filepath):
-				duration = -1
+			status = statuses[filepath]
+			if status is None:
+				continue  # Removed in the meanwhile.
+			if status.is_dir:
+				duration = directory_totals.get(filepath, (0, -1))[1]  # The total duration of all tracks in it, if known.
 				filetype = "directory"
 			else:
-				try:
-					duration = kek.music_metadata.metadata.get(filepath)["duration"]
-				except mutagen.MutagenError as e:
-					logging.error(f"Unable to get metadata from {filepath}: {e}")
-					duration = -1
-				extension = os.path.splitext(filepath)[1]
+				duration = self.known_duration(filepath)
+				extension = os.path.splitext(filepath)[1].lower()
 				if extension in [".flac", ".wav"]:
 					filetype = "uncompressed"
 				else:
@@ -193,6 +204,34 @@ class MusicDirectory(PySide6.QtCore.QAbstractListModel):
 
 		self._directory = new_directory
 
+	@PySide6.QtCore.Slot(str)
+	def on_directory_indexed(self, directory: str) -> None:
+		"""
+		Show the durations of the files in a directory, now that their metadata is up to date.
+
+		This is called on the GUI thread. If a different directory is shown by now, nothing changes.
+		:param directory: The directory that was indexed.
+		"""
+		if directory != self._directory or len(self.music) == 0:
+			return
+		kek.music_metadata.load_directory(directory)
+		for track in self.music:
+			if track["type"] != "directory":
+				track["duration"] = self.known_duration(track["path"])
+		duration_role = [role for role, field in self.role_to_field.items() if field == "duration"]
+		self.dataChanged.emit(self.index(0), self.index(len(self.music) - 1), duration_role)
+
+	def known_duration(self, filepath: str) -> float:
+		"""
+		Get the duration of a file from the metadata that we have, without reading the file.
+		:param filepath: The file to get the duration of.
+		:return: The duration of the file, in seconds, or -1 if we don't know it (yet).
+		"""
+		entry = kek.music_metadata.metadata.get(filepath)
+		if entry is None:
+			return -1
+		return entry.duration
+
 	@PySide6.QtCore.Property(str, fset=directory_set)
 	def directory(self) -> str:
 		"""
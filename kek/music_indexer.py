@@ -0,0 +1,341 @@
+# Desktop environment for a domotics hub.
+# Copyright (C) 2026 Ghostkeeper
+# This application is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# This application is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for details.
+# You should have received a copy of the GNU Affero General Public License along with this application. If not, see <https://gnu.org/licenses/>.
+
+"""
+Keeps the music metadata up to date in the background, so that browsing the music library doesn't need to wait for it.
+
+The indexer reads the metadata of the whole music library once, on a low-priority thread. After that, it watches the
+library for changes with inotify, and updates the metadata of the directories that changed. If inotify is not available
+(or can't watch the whole library), the indexer periodically checks the whole library for changes instead.
+"""
+
+import concurrent.futures  # To read the metadata of multiple files at once, at low priority.
+import ctypes  # To use inotify from the C library.
+import ctypes.util  # To find the C library.
+import errno  # To recognise when the system can't watch any more directories.
+import logging
+import os  # To lower the priority of the indexer, and to read inotify events.
+import os.path  # To find the directories that changed.
+import queue  # To index the directories that the user is looking at first.
+import select  # To wait for inotify events.
+import struct  # To parse inotify events.
+import threading  # The indexer runs on a separate thread.
+import time  # To wait for changes to settle.
+import typing
+
+import kek.music_metadata  # To update the metadata.
+import kek.stat_cache  # To list the directories of the music library.
+
+poll_interval = 10 * 60
+"""
+How often to check the whole music library for changes, in seconds, if inotify can't be used.
+"""
+
+settle_time = 2.0
+"""
+How long to wait after a change before updating the metadata, in seconds.
+
+Changes that are made in the meanwhile (like the rest of an album being copied) are combined into the same update.
+"""
+
+priority = 19
+"""
+The niceness of the indexer thread, from 0 (normal) to 19 (lowest priority).
+"""
+
+index_thread: typing.Optional[threading.Thread] = None
+"""
+The thread that keeps the metadata up to date.
+"""
+
+requests: queue.Queue[tuple[str, typing.Optional[typing.Callable[[str], None]]]] = queue.Queue()
+"""
+The directories that the user is looking at, and that need to be indexed before anything else.
+
+Each directory comes with a function to call with the directory once it's indexed, if any.
+"""
+
+request_thread: typing.Optional[threading.Thread] = None
+"""
+The thread that indexes the requested directories.
+
+This is a different thread than the ``index_thread``, so that requests don't need to wait until the whole library is
+indexed. It also runs at normal priority, since the user is waiting for it.
+"""
+
+request_lock = threading.Lock()
+"""
+While the request thread is started, this lock has to be obtained.
+"""
+
+# Constants from the inotify API of Linux, see "man 7 inotify".
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+watch_mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+event_header = struct.Struct("iIII")  # The watch descriptor, the event mask, a cookie and the length of the file name.
+
+
+class Watcher:
+	"""
+	Watches directories for changes, using inotify.
+	"""
+
+	def __init__(self) -> None:
+		"""
+		Start an inotify instance.
+
+		If inotify is not available on this system, this raises an ``OSError``.
+		"""
+		self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+		self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if self.fd < 0:
+			error = ctypes.get_errno()
+			raise OSError(error, f"Unable to start inotify: {os.strerror(error)}")
+		self.directories: dict[int, str] = {}  # For each watch descriptor, the directory that it watches.
+		self.complete = True  # Whether all directories could be watched.
+
+	def watch(self, directory: str) -> None:
+		"""
+		Start watching a directory (but not its subdirectories).
+
+		If the system can't watch any more directories, this directory is not watched and ``complete`` becomes ``False``.
+		:param directory: The directory to watch.
+		"""
+		descriptor = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), watch_mask)
+		if descriptor < 0:
+			error = ctypes.get_errno()
+			if error == errno.ENOSPC and self.complete:
+				logging.warning("Unable to watch the whole music library for changes. Increase fs.inotify.max_user_watches to fix this. Checking for changes periodically instead.")
+				self.complete = False
+			elif error != errno.ENOSPC:
+				logging.warning(f"Unable to watch {directory} for changes: {os.strerror(error)}")
+			return
+		self.directories[descriptor] = directory
+
+	def unwatch(self, directory: str) -> None:
+		"""
+		Stop watching a directory and its subdirectories, for instance because they were moved.
+
+		If they were moved within the music library, they are watched again under their new path when indexing them.
+		:param directory: The directory to stop watching.
+		"""
+		prefix = directory.rstrip(os.sep) + os.sep
+		for descriptor, watched in list(self.directories.items()):
+			if watched == directory or watched.startswith(prefix):
+				self.libc.inotify_rm_watch(self.fd, descriptor)
+				del self.directories[descriptor]
+
+	def wait(self, timeout: typing.Optional[float]) -> typing.Optional[tuple[set[str], set[str], set[str]]]:
+		"""
+		Wait until something changes in the watched directories, and until the changes settle down.
+		:param timeout: How long to wait at most for the first change, in seconds, or ``None`` to wait indefinitely.
+		:return: The directories that were removed, the directories that were added and the directories of which the
+		files changed. If too many changes happened to keep track of, all three are ``None``. If nothing changed before
+		the timeout, the result is ``None``.
+		"""
+		removed = set()
+		added = set()
+		changed = set()
+		overflow = False
+		readable, _, _ = select.select([self.fd], [], [], timeout)
+		if not readable:
+			return None
+		while readable:
+			try:
+				data = os.read(self.fd, 64 * 1024)
+			except BlockingIOError:
+				data = b""
+			offset = 0
+			while offset < len(data):
+				descriptor, mask, _, name_length = event_header.unpack_from(data, offset)
+				name = os.fsdecode(data[offset + event_header.size:offset + event_header.size + name_length].rstrip(b"\0"))
+				offset += event_header.size + name_length
+				if mask & IN_Q_OVERFLOW:
+					overflow = True
+					continue
+				directory = self.directories.get(descriptor)
+				if mask & IN_IGNORED:  # The directory was removed, so it's no longer watched.
+					self.directories.pop(descriptor, None)
+					continue
+				if directory is None:
+					continue
+				path = os.path.join(directory, name)
+				if mask & IN_ISDIR:
+					if mask & IN_MOVED_FROM:
+						self.unwatch(path)  # Otherwise its events would still be reported under its old path.
+					if mask & (IN_DELETE | IN_MOVED_FROM):
+						removed.add(path)
+					if mask & (IN_CREATE | IN_MOVED_TO):
+						added.add(path)
+				changed.add(directory)
+			readable, _, _ = select.select([self.fd], [], [], settle_time)  # Wait for more changes.
+		if overflow:
+			return None, None, None
+		return removed, added, changed
+
+
+def start(root: str) -> None:
+	"""
+	Start keeping the metadata of a music library up to date, if not started yet.
+	:param root: The directory containing the music library.
+	"""
+	global index_thread
+	if index_thread is not None:
+		return
+	index_thread = threading.Thread(target=index_loop, args=(root, ), daemon=True)
+	index_thread.start()
+
+
+def index_soon(directory: str, on_done: typing.Optional[typing.Callable[[str], None]] = None) -> None:
+	"""
+	Update the metadata of the music files in a directory (not its subdirectories) in the background, right away.
+
+	This doesn't wait until the directory is indexed.
+	:param directory: The directory to index.
+	:param on_done: A function to call when the directory is indexed. It gets called on a different thread, with the
+	directory as parameter.
+	"""
+	global request_thread
+	requests.put((directory, on_done))
+	with request_lock:
+		if request_thread is None:
+			request_thread = threading.Thread(target=request_loop, daemon=True)
+			request_thread.start()
+
+
+def request_loop() -> None:
+	"""
+	Main loop of the thread that indexes requested directories.
+
+	This function runs indefinitely. It should be ran on a different thread than the main GUI thread.
+	"""
+	while True:
+		directory, on_done = requests.get()
+		index_directory(directory)
+		if on_done is not None:
+			on_done(directory)
+
+
+def lower_priority() -> None:
+	"""
+	Lower the priority of the current thread, so that indexing doesn't slow down the rest of the application.
+
+	Threads that this thread starts afterwards get the same priority. Threads that were started before keep their
+	priority.
+	"""
+	try:
+		os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), priority)  # On Linux, this applies to a single thread.
+	except (AttributeError, OSError) as e:
+		logging.warning(f"Unable to lower the priority of the music indexer: {e}")
+
+
+def index_loop(root: str) -> None:
+	"""
+	Main loop of the indexer.
+
+	This function runs indefinitely. It should be ran on a different thread than the main GUI thread.
+	:param root: The directory containing the music library.
+	"""
+	lower_priority()
+	try:
+		watcher = Watcher()
+	except (AttributeError, OSError) as e:
+		logging.warning(f"Unable to watch the music library for changes: {e}. Checking for changes periodically instead.")
+		watcher = None
+
+	logging.info(f"Indexing music library: {root}")
+	start_time = time.time()
+	with scan_threads() as executor:
+		index_tree(root, watcher, executor)
+	logging.info(f"Indexed music library in {time.time() - start_time:.1f}s.")
+
+	while True:
+		if watcher is None:
+			time.sleep(poll_interval)
+			changes = None
+		else:
+			changes = watcher.wait(poll_interval if not watcher.complete else None)
+		with scan_threads() as executor:
+			if changes is None:  # Polling, because not all directories are watched.
+				index_tree(root, watcher, executor)
+				continue
+			removed, added, changed = changes
+			if removed is None:
+				logging.warning("Too many changes in the music library to keep track of. Checking the whole library.")
+				index_tree(root, watcher, executor)
+				continue
+			for directory in removed:
+				kek.stat_cache.invalidate(directory)
+				kek.music_metadata.remove_directory(directory)
+			for directory in added:
+				index_tree(directory, watcher, executor)
+			for directory in changed - added:
+				kek.stat_cache.invalidate(directory)
+				if os.path.isdir(directory):
+					index_directory(directory, executor)
+
+
+def scan_threads() -> concurrent.futures.ThreadPoolExecutor:
+	"""
+	Create the threads that the indexer reads music files with, for one pass over the changes in the music library.
+
+	The threads are created anew for every pass, so that changes to the ``scan_concurrency`` take effect. This must be
+	called on the indexer thread, after lowering its priority, so that the threads get the same low priority. They are
+	only started once files are given to them.
+	:return: The threads to read music files with. Shut them down after the pass.
+	"""
+	return concurrent.futures.ThreadPoolExecutor(max_workers=kek.music_metadata.scan_concurrency)
+
+
+def index_tree(root: str, watcher: typing.Optional[Watcher], executor: concurrent.futures.Executor) -> None:
+	"""
+	Update the metadata of all music files in a directory and its subdirectories.
+	:param root: The directory to index.
+	:param watcher: If given, the directories are also watched for changes.
+	:param executor: The threads to read the music files with.
+	"""
+	try:
+		visited = {os.stat(root).st_ino}  # To prevent endless loops if links create cycles.
+	except OSError:
+		return  # Removed in the meanwhile.
+	to_visit = [root]
+	while to_visit:
+		directory = to_visit.pop()
+		if watcher is not None:
+			watcher.watch(directory)  # Before listing, so that changes during indexing are not missed.
+		kek.stat_cache.invalidate(directory)
+		try:
+			entries = kek.stat_cache.list_directory(directory)
+		except OSError as e:
+			logging.warning(f"Unable to list {directory}: {e}")
+			continue
+		for entry in entries.values():
+			if entry.is_dir and entry.inode not in visited:
+				visited.add(entry.inode)
+				to_visit.append(entry.path)
+		index_directory(directory, executor)
+
+
+def index_directory(directory: str, executor: typing.Optional[concurrent.futures.Executor] = None) -> None:
+	"""
+	Update the metadata of the music files in a directory (not its subdirectories).
+	:param directory: The directory to index.
+	:param executor: The threads to read the music files with. By default, the shared threads of the music metadata are
+	used.
+	"""
+	try:
+		kek.music_metadata.add_directory(directory, executor)
+	except OSError as e:
+		logging.warning(f"Unable to index {directory}: {e}")
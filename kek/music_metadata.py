@@ -8,129 +8,885 @@
 Defines a dictionary of metadata about music files, and some functions to edit it.
 """
 
+import base64  # To decode cover images in Vorbis comments.
+import collections  # For the least-recently-used ordering of the loaded directories.
+import collections.abc  # To make the metadata snapshots behave like a dictionary.
+import concurrent.futures  # To read metadata from multiple files at once.
+import hashlib  # To name cover images after their contents.
 import logging
 import mutagen  # To read metadata from music files.
-import mutagen.easyid3
 import mutagen.flac
 import mutagen.id3
-import mutagen.mp3
-import mutagen.ogg
-import mutagen.wave
+import mutagen.oggopus
+import os  # To delete cover images that are no longer used.
 import os.path  # To find the database file.
 import sqlite3  # To store metadata in a database.
-import time  # To store the database after a certain amount of time.
-import threading  # To store the database after a certain amount of time.
+import sys  # To share copies of strings.
+import time  # To wait a moment before storing the database, to combine multiple changes into one write.
+import threading  # To store the database on a separate thread.
+import types  # To share the metadata with readers without allowing them to change it.
 import typing
-import uuid  # To store the cover in a randomly named cache file.
 
+import kek.stat_cache  # To find the music files and when they were modified.
 import kek.storage  # To find the database file.
 
-metadata: dict[str, typing.Any] = {}
+class Entry:
+	"""
+	The metadata of one music file.
+
+	The fields can be read like attributes, or like the keys of a dictionary. This is much smaller in memory than a
+	dictionary, since it doesn't need to store the field names for every file. Artist and album names (and the paths to
+	covers) are often the same for many files, so only one copy of those is kept.
+	"""
+
+	__slots__ = ("path", "duration", "title", "artist", "album", "cover", "cachetime", "sample_rate", "channels", "bit_depth", "codec", "bitrate", "size", "inode")
+
+	def __init__(self, path: str, duration: float, title: str, artist: str, album: str, cover: str, cachetime: float, sample_rate: int=0, channels: int=0, bit_depth: int=0, codec: str="", bitrate: int=0, size: int=0, inode: int=0) -> None:
+		"""
+		Create a metadata entry.
+		:param path: The path to the music file.
+		:param duration: The duration of the track, in seconds, or -1 if unknown.
+		:param title: The title of the track.
+		:param artist: The artist that made the track.
+		:param album: The album that the track is on.
+		:param cover: The path to the cover image of the track, or an empty string if it has none.
+		:param cachetime: The modification time of the file when this metadata was read from it.
+		:param sample_rate: The sample rate of the audio stream, in Hz, or 0 if unknown.
+		:param channels: The number of channels in the audio stream, or 0 if unknown.
+		:param bit_depth: The number of bits per sample in the audio stream, or 0 if unknown or not applicable.
+		:param codec: The format of the file, such as ``mp3`` or ``flac``, or an empty string if unknown.
+		:param bitrate: The bit rate of the audio stream, in bits per second, or 0 if unknown.
+		:param size: The size of the file when this metadata was read from it, in bytes.
+		:param inode: The inode number of the file when this metadata was read from it.
+		"""
+		self.path = path
+		self.duration = duration
+		self.title = title
+		self.artist = sys.intern(artist)
+		self.album = sys.intern(album)
+		self.cover = sys.intern(cover)
+		self.cachetime = cachetime
+		self.sample_rate = sample_rate
+		self.channels = channels
+		self.bit_depth = bit_depth
+		self.codec = sys.intern(codec)
+		self.bitrate = bitrate
+		self.size = size
+		self.inode = inode
+
+	def __getitem__(self, field: str) -> typing.Any:
+		"""
+		Get a field of the metadata, like from a dictionary.
+		:param field: The name of the field.
+		:return: The value of that field.
+		"""
+		try:
+			return getattr(self, field)
+		except AttributeError:
+			raise KeyError(field)
+
+	def get(self, field: str, default: typing.Any=None) -> typing.Any:
+		"""
+		Get a field of the metadata, like from a dictionary, or a default value if there is no such field.
+		:param field: The name of the field.
+		:param default: The value to return if there is no such field.
+		:return: The value of that field.
+		"""
+		return getattr(self, field, default)
+
+	def __repr__(self) -> str:
+		"""
+		Get a representation of this entry, for debugging.
+		:return: The fields of the entry.
+		"""
+		return f"Entry({', '.join(repr(getattr(self, field)) for field in self.__slots__)})"
+
+
+class Snapshot(collections.abc.Mapping):
+	"""
+	A version of the metadata of the files in memory, by their paths, which never changes.
+
+	The entries are grouped by the directory that the files are in. To make a new version with some changed entries,
+	only the groups of the directories that changed need to be copied, rather than all entries.
+	"""
+
+	def __init__(self, directories: dict[str, dict[str, Entry]]) -> None:
+		"""
+		Create a snapshot of the metadata.
+		:param directories: For each directory, the metadata entries of the files in it, by their paths. These
+		dictionaries must not be modified afterwards.
+		"""
+		self.directories = directories
+		self.length = sum(len(entries) for entries in directories.values())
+
+	def __getitem__(self, path: str) -> Entry:
+		"""
+		Get the metadata entry of a file.
+		:param path: The path to the file.
+		:return: The metadata entry of that file.
+		"""
+		entries = self.directories.get(os.path.dirname(path))
+		if entries is None:
+			raise KeyError(path)
+		return entries[path]
+
+	def get(self, path: str, default: typing.Optional[Entry]=None) -> typing.Optional[Entry]:
+		"""
+		Get the metadata entry of a file, or a default value if it's not in memory.
+		:param path: The path to the file.
+		:param default: The value to return if the metadata of the file is not in memory.
+		:return: The metadata entry of that file.
+		"""
+		entries = self.directories.get(os.path.dirname(path))
+		if entries is None:
+			return default
+		return entries.get(path, default)
+
+	def __contains__(self, path: object) -> bool:
+		"""
+		Get whether the metadata of a file is in memory.
+		:param path: The path to the file.
+		:return: ``True`` if the metadata of that file is in this snapshot, or ``False`` if it isn't.
+		"""
+		return self.get(path) is not None
+
+	def __iter__(self) -> typing.Iterator[str]:
+		"""
+		Go through the paths of all files of which the metadata is in this snapshot.
+		:return: An iterator over the paths.
+		"""
+		for entries in self.directories.values():
+			yield from entries
+
+	def __len__(self) -> int:
+		"""
+		Get the number of files of which the metadata is in this snapshot.
+		:return: The number of metadata entries.
+		"""
+		return self.length
+
+	def directory(self, directory: str) -> typing.Mapping[str, Entry]:
+		"""
+		Get the metadata of the files in a directory (not its subdirectories).
+		:param directory: The path to the directory, as given by ``os.path.dirname`` for the files in it.
+		:return: The metadata entries of the files in that directory, by their paths.
+		"""
+		return types.MappingProxyType(self.directories.get(directory, {}))
+
+
+metadata: Snapshot = Snapshot({})
 """
 Cache for metadata about music files.
+
+This only contains the metadata of the directories that were used recently. Use ``get`` to get the metadata of a file,
+which reads it from the database or from the file if necessary.
+
+This is a read-only snapshot, which never changes. Changes to the metadata are published as a new snapshot, which then
+replaces this one as a whole. Readers therefore don't need to obtain any lock. To see a consistent state across multiple
+reads, keep a reference to the snapshot rather than reading this variable again.
+"""
+
+metadata_version = 0
+"""
+Incremented every time that a new snapshot of the metadata is published.
+
+This can be used to tell whether anything changed since the metadata was last read.
 """
 
 
 metadata_lock = threading.Lock()
 """
-While the metadata dictionary is modified or iterated over, this lock has to be obtained.
+While a new snapshot of the metadata is made and published, this lock has to be obtained.
+
+This makes sure that no changes get lost if multiple threads change the metadata at the same time. Readers of the
+metadata don't need it.
+"""
+
+
+dirty: set[str] = set()
 """
+The paths of the metadata entries that changed since the database was last stored.
 
+This is protected by the ``metadata_lock`` as well.
+"""
+
+
+scan_concurrency = 4
+"""
+The maximum number of files to read metadata from at the same time, when reading a whole directory.
 
-def load() -> None:
+Reading more files at once helps when the files are on a slow disk or network mount. It also takes processing time away
+from the rest of the application though, such as the audio playback.
+
+Changing this takes effect when the next directory is read.
+"""
+
+scan_executor: typing.Optional[concurrent.futures.ThreadPoolExecutor] = None
+"""
+Reads the metadata of the files in a directory, ``scan_concurrency`` files at a time.
+
+The same threads are used for every directory, so that indexing a big library doesn't start threads for each directory.
+They are started when the first directory is read. Use ``get_scan_executor`` to get them.
+"""
+
+scan_executor_concurrency = 0
+"""
+The number of threads that the ``scan_executor`` was started with.
+
+If this is different from the ``scan_concurrency``, the setting changed and the threads need to be replaced.
+"""
+
+scan_executor_lock = threading.Lock()
+"""
+While the ``scan_executor`` is started or replaced, this lock has to be obtained.
+"""
+
+scan_batch_size = 100
+"""
+The number of new metadata entries to add to the ``metadata`` at once, when reading a whole directory.
+
+Every batch publishes a new snapshot of the metadata.
+"""
+
+directory_cache_size = 100
+"""
+The maximum number of directories of which the metadata is kept in memory.
+
+The metadata is read from the database one directory at a time, when it's needed. To keep the memory usage independent
+of the size of the music library, the metadata of the least recently used directories is dropped from memory.
+"""
+
+loaded_directories: collections.OrderedDict[str, bool] = collections.OrderedDict()
+"""
+The directories of which the metadata is loaded in memory, in order of last use.
+
+For each directory, this indicates whether all of its metadata was read from the database. Directories that got only
+some new entries, for instance from tracks in a playlist, still have to be read.
+
+This is protected by the ``metadata_lock`` as well.
+"""
+
+
+def connect() -> sqlite3.Connection:
 	"""
-	Reads the metadata from the database file into memory.
+	Open a connection to the database file, creating the database if it doesn't exist yet.
+
+	The database is put in write-ahead logging mode, so that reading from it doesn't have to wait for writes to finish.
 
-	All of the metadata in the database file will get stored in the ``metadata`` dict.
+	The database must have been upgraded to the current version with ``migrate`` before.
+	:return: A connection to the database.
 	"""
 	db_file = os.path.join(kek.storage.cache(), "music.db")
-	logging.info(f"Reading music metadata from: {db_file}")
-	if not os.path.exists(db_file):
-		return  # No metadata to read.
 	connection = sqlite3.connect(db_file)
-	logging.debug("Reading metadata from music database.")
-
-	new_metadata = {}  # First store it in a local variable (faster). Merge afterwards.
-	for path, duration, title, artist, album, cover, cachetime in connection.execute("SELECT * FROM metadata"):
-		new_metadata[path] = {
-			"path": path,
-			"duration": duration,
-			"title": title,
-			"artist": artist,
-			"album": album,
-			"cover": cover,
-			"cachetime": cachetime,
-		}
-	with metadata_lock:
-		metadata.update(new_metadata)
+	connection.execute("PRAGMA journal_mode=WAL")
+	connection.execute("PRAGMA synchronous=NORMAL")  # In WAL mode, this is still safe against corruption.
+	return connection
 
 
-# When we change the database, save the database to disk after a short delay.
-# If there's multiple changes in short succession, those will be combined into a single write.
-def store_after() -> None:
+def migrate() -> None:
 	"""
-	Waits a certain amount of time, then stores the metadata to disk.
+	Create the database, or upgrade it if it was made by an older version of this application. See ``migrations``.
+
+	This should be called once at start-up, before the database is used.
 
-	This function should be run on a thread, so as to not freeze the application.
+	Each upgrade is a single transaction, including the new version number. The transaction takes the write lock right
+	away, and the version is read within the transaction. That way, if multiple connections upgrade the database at the
+	same time, each upgrade is only applied once. The version is never lowered, even if the database was made by a newer
+	version of this application.
 	"""
-	time.sleep(0.25)
-	store()
-	global store_thread
-	store_thread = None
+	connection = connect()
+	try:
+		while True:
+			with connection:
+				connection.execute("BEGIN IMMEDIATE")
+				version = connection.execute("PRAGMA user_version").fetchone()[0]
+				if version >= len(migrations):
+					break  # Up to date.
+				logging.info(f"Upgrading music database to version {version + 1}.")
+				migrations[version](connection)
+				connection.execute(f"PRAGMA user_version = {version + 1}")
+	finally:
+		connection.close()
 
 
-store_thread: typing.Optional[threading.Thread] = None
+def create_tables(connection: sqlite3.Connection) -> None:
+	"""
+	Create the tables of the first version of the database.
+
+	Next to the metadata table, the database has a full-text search index on the metadata, tables that summarise the
+	tracks of every artist and album, and a table that summarises the tracks in every directory.
+
+	Databases from before the version was tracked may have some of these tables already. Only the missing tables are
+	created.
+	:param connection: A connection to the database, in which to create the tables.
+	"""
+	connection.execute("""CREATE TABLE IF NOT EXISTS metadata(
+		path text PRIMARY KEY,
+		duration real,
+		title text,
+		artist text,
+		album text,
+		cover text,
+		cachetime real
+	)""")
+	tables = {name for name, in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+	if "metadata_search" not in tables:
+		create_search_index(connection)
+	if "albums" not in tables:
+		create_aggregates(connection)
+	if "directories" not in tables:
+		create_directory_totals(connection)
+
+
+def create_search_index(connection: sqlite3.Connection) -> None:
+	"""
+	Create the full-text search index on the metadata, and fill it with the current metadata.
+
+	Triggers keep this index up to date whenever the metadata table changes. This requires that rows in the metadata
+	table are updated in place, rather than replaced.
+	:param connection: A connection to the database, in which to create the index.
+	"""
+	connection.execute("""CREATE VIRTUAL TABLE metadata_search USING fts5(
+		title, artist, album, path,
+		content = 'metadata', content_rowid = 'rowid', tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3'
+	)""")
+	connection.execute("""CREATE TRIGGER metadata_search_insert AFTER INSERT ON metadata BEGIN
+		INSERT INTO metadata_search (rowid, title, artist, album, path) VALUES (new.rowid, new.title, new.artist, new.album, new.path);
+	END""")
+	connection.execute("""CREATE TRIGGER metadata_search_delete AFTER DELETE ON metadata BEGIN
+		INSERT INTO metadata_search (metadata_search, rowid, title, artist, album, path) VALUES ('delete', old.rowid, old.title, old.artist, old.album, old.path);
+	END""")
+	connection.execute("""CREATE TRIGGER metadata_search_update AFTER UPDATE ON metadata BEGIN
+		INSERT INTO metadata_search (metadata_search, rowid, title, artist, album, path) VALUES ('delete', old.rowid, old.title, old.artist, old.album, old.path);
+		INSERT INTO metadata_search (rowid, title, artist, album, path) VALUES (new.rowid, new.title, new.artist, new.album, new.path);
+	END""")
+	connection.execute("INSERT INTO metadata_search (metadata_search) VALUES ('rebuild')")  # Index the metadata that's already there.
+
+
+def add_stream_columns(connection: sqlite3.Connection) -> None:
+	"""
+	Add columns for the technical information about the audio stream, and about the file itself.
+
+	Existing rows get 0 (or an empty codec) for these columns. Since their size and inode don't match the files any
+	more, the files get read again the next time they are checked, which fills in the new columns.
+	:param connection: A connection to the database, in which to add the columns.
+	"""
+	for column, column_type in (("sample_rate", "integer"), ("channels", "integer"), ("bit_depth", "integer"), ("codec", "text"), ("bitrate", "integer"), ("size", "integer"), ("inode", "integer")):
+		default = "''" if column_type == "text" else "0"
+		connection.execute(f"ALTER TABLE metadata ADD COLUMN {column} {column_type} NOT NULL DEFAULT {default}")
+
+
+def recount_directories(connection: sqlite3.Connection) -> None:
+	"""
+	Count the tracks in every directory again.
+
+	Playlist files with an upper case extension used to be counted as tracks in the directory totals, but not in the
+	artist and album totals. Now neither counts them.
+	:param connection: A connection to the database, in which to count the tracks.
+	"""
+	connection.execute("DROP TABLE directories")
+	create_directory_totals(connection)
+
+
+migrations = [
+	create_tables,
+	add_stream_columns,
+	recount_directories,
+]
+"""
+The upgrades to the database, in order.
+
+The version of the database is the number of upgrades that were applied to it. It is stored in the database itself,
+with ``PRAGMA user_version``. To change the database, add a new upgrade to the end of this list. Never change the
+upgrades that are already in it, since existing databases have already applied those.
+"""
+
+
+def create_directory_totals(connection: sqlite3.Connection) -> None:
+	"""
+	Create the table that summarises the tracks in every directory, and fill it with the current metadata.
+
+	The totals of a directory include the tracks in all of its subdirectories. Because of that, a track affects many
+	rows, which can't be updated with triggers. Instead, ``store`` updates this table along with the metadata.
+	:param connection: A connection to the database, in which to create the table.
+	"""
+	connection.execute("""CREATE TABLE directories(
+		directory text PRIMARY KEY,
+		track_count integer NOT NULL,
+		duration real NOT NULL
+	)""")
+	directory_changes = collections.defaultdict(lambda: [0, 0.0])
+	for path, duration in connection.execute("SELECT path, duration FROM metadata"):
+		count_track(directory_changes, path, duration, 1)
+	connection.executemany("INSERT INTO directories (directory, track_count, duration) VALUES (?, ?, ?)",
+		[(directory, count, duration) for directory, (count, duration) in directory_changes.items() if count > 0])
+
+
+def create_aggregates(connection: sqlite3.Connection) -> None:
+	"""
+	Create the tables that summarise the tracks of every artist and album, and fill them with the current metadata.
+
+	Triggers keep these tables up to date whenever the metadata table changes. Playlist files are not counted as tracks.
+	Tracks of which the duration is unknown count as having no duration.
+	:param connection: A connection to the database, in which to create the tables.
+	"""
+	connection.execute("""CREATE TABLE artists(
+		artist text PRIMARY KEY,
+		album_count integer NOT NULL DEFAULT 0,
+		track_count integer NOT NULL,
+		duration real NOT NULL
+	)""")
+	connection.execute("""CREATE TABLE albums(
+		artist text NOT NULL,
+		album text NOT NULL,
+		track_count integer NOT NULL,
+		duration real NOT NULL,
+		PRIMARY KEY (artist, album)
+	)""")
+	connection.execute("CREATE INDEX metadata_album ON metadata (artist, album)")  # To list the tracks of an album.
+
+	# The artist must be counted before the album, because adding the album increments the album count of the artist.
+	add_track = """
+		INSERT INTO artists (artist, track_count, duration) VALUES (new.artist, 1, max(new.duration, 0))
+			ON CONFLICT (artist) DO UPDATE SET track_count = track_count + 1, duration = duration + excluded.duration;
+		INSERT INTO albums (artist, album, track_count, duration) VALUES (new.artist, new.album, 1, max(new.duration, 0))
+			ON CONFLICT (artist, album) DO UPDATE SET track_count = track_count + 1, duration = duration + excluded.duration;"""
+	remove_track = """
+		UPDATE albums SET track_count = track_count - 1, duration = duration - max(old.duration, 0) WHERE artist = old.artist AND album = old.album;
+		DELETE FROM albums WHERE artist = old.artist AND album = old.album AND track_count <= 0;
+		UPDATE artists SET track_count = track_count - 1, duration = duration - max(old.duration, 0) WHERE artist = old.artist;
+		DELETE FROM artists WHERE artist = old.artist AND track_count <= 0;"""
+	connection.execute(f"CREATE TRIGGER metadata_aggregates_insert AFTER INSERT ON metadata WHEN new.path NOT LIKE '%.m3u' BEGIN {add_track} END")
+	connection.execute(f"CREATE TRIGGER metadata_aggregates_delete AFTER DELETE ON metadata WHEN old.path NOT LIKE '%.m3u' BEGIN {remove_track} END")
+	connection.execute(f"CREATE TRIGGER metadata_aggregates_update AFTER UPDATE ON metadata WHEN old.path NOT LIKE '%.m3u' BEGIN {remove_track} {add_track} END")
+	connection.execute("CREATE TRIGGER albums_count_insert AFTER INSERT ON albums BEGIN UPDATE artists SET album_count = album_count + 1 WHERE artist = new.artist; END")
+	connection.execute("CREATE TRIGGER albums_count_delete AFTER DELETE ON albums BEGIN UPDATE artists SET album_count = album_count - 1 WHERE artist = old.artist; END")
+
+	# Summarise the metadata that's already there.
+	connection.execute("""INSERT INTO artists (artist, track_count, duration)
+		SELECT artist, COUNT(*), SUM(max(duration, 0)) FROM metadata WHERE path NOT LIKE '%.m3u' GROUP BY artist""")
+	connection.execute("""INSERT INTO albums (artist, album, track_count, duration)
+		SELECT artist, album, COUNT(*), SUM(max(duration, 0)) FROM metadata WHERE path NOT LIKE '%.m3u' GROUP BY artist, album""")
+
+
+def publish(changes: dict[str, typing.Optional[Entry]]) -> None:
+	"""
+	Replace the metadata with a new snapshot, in which some entries are changed.
+
+	Only the entries of the directories that changed are copied for this. Those directories are marked as recently
+	used. If that makes too many directories loaded, the metadata of the least recently used directories is dropped
+	from memory. The ``metadata_lock`` must be held while calling this function.
+	:param changes: The new metadata entries, by the path of the file that they are about. For paths that map to
+	``None``, the entry is removed.
+	"""
+	global metadata, metadata_version
+	directories = dict(metadata.directories)
+	copied = set()
+	for path, entry in changes.items():
+		directory = os.path.dirname(path)
+		if directory not in copied:
+			directories[directory] = dict(directories.get(directory, {}))
+			copied.add(directory)
+		if entry is None:
+			directories[directory].pop(path, None)
+		else:
+			directories[directory][path] = entry
+	for directory in copied:
+		if not directories[directory]:
+			del directories[directory]
+		loaded_directories.setdefault(directory, False)  # If it wasn't loaded, only some of its entries are in memory now.
+		loaded_directories.move_to_end(directory)
+	excess = len(loaded_directories) - directory_cache_size
+	evicted = [directory for directory in loaded_directories if directory not in copied][:max(excess, 0)]
+	for directory in evicted:
+		del loaded_directories[directory]
+		evict(directories, directory)
+	if not copied and not evicted:
+		return  # Nothing changed.
+	metadata = Snapshot(directories)
+	metadata_version += 1
+
+
+def evict(directories: dict[str, dict[str, Entry]], directory: str) -> None:
+	"""
+	Drop the metadata of a directory from memory.
+
+	Entries that are not stored in the database yet must stay in memory until they are. They are dropped after storing
+	them, if their directory is not loaded again by then. The ``metadata_lock`` must be held while calling this
+	function.
+	:param directories: The metadata entries by directory, for a new snapshot. This is modified in place.
+	:param directory: The directory to drop the metadata of.
+	"""
+	kept = {path: entry for path, entry in directories.get(directory, {}).items() if path in dirty}
+	if kept:
+		directories[directory] = kept
+	else:
+		directories.pop(directory, None)
+
+
+def load_directory(directory: str) -> None:
+	"""
+	Reads the metadata of the files in a directory (not its subdirectories) from the database file into memory.
+
+	The metadata is stored in the ``metadata``. Only the metadata of the most recently used directories is kept in
+	memory. If the directory was already loaded, this only marks it as recently used.
+	:param directory: The directory to read the metadata of.
+	"""
+	if touch_directory(directory):
+		return
+
+	while True:
+		stores_before = store_count
+		rows = []
+		db_file = os.path.join(kek.storage.cache(), "music.db")
+		if os.path.exists(db_file):
+			logging.debug(f"Reading metadata of directory from music database: {directory}")
+			# Select the paths that start with the directory, which uses the index of the primary key, but skip the paths in subdirectories.
+			prefix = directory.rstrip(os.sep) + os.sep
+			after_prefix = prefix[:-1] + chr(ord(os.sep) + 1)  # The first string that doesn't start with the prefix any more.
+			connection = connect()
+			rows = connection.execute("SELECT path, duration, title, artist, album, cover, cachetime, sample_rate, channels, bit_depth, codec, bitrate, size, inode FROM metadata WHERE path >= ? AND path < ? AND instr(substr(path, ?), ?) = 0",
+				(prefix, after_prefix, len(prefix) + 1, os.sep)).fetchall()
+			connection.close()
+
+		with metadata_lock:
+			if store_count != stores_before:
+				continue  # Changes were stored while reading, which may no longer be dirty but not be in what was read either.
+			snapshot = metadata
+			changes = {}
+			for row in rows:
+				path = row[0]
+				if path in snapshot or path in dirty:
+					continue  # Already in memory and possibly newer than what's in the database, or removed but not stored yet.
+				changes[path] = Entry(*row)
+			loaded_directories[directory] = True
+			loaded_directories.move_to_end(directory)
+			publish(changes)
+			return
+
+
+def touch_directory(directory: str) -> bool:
+	"""
+	Mark the metadata of a directory as recently used, so that it's kept in memory longer.
+	:param directory: The directory that was used.
+	:return: ``True`` if all of the metadata of the directory is loaded, or ``False`` if it isn't.
+	"""
+	with metadata_lock:
+		if directory not in loaded_directories:
+			return False
+		loaded_directories.move_to_end(directory)
+		return loaded_directories[directory]
+
+
+store_delay = 0.25
+"""
+How long the writer thread waits after a change before storing the database, in seconds.
+
+If there are multiple changes in short succession, those will be combined into a single write.
+"""
+
+store_retry_delay = 60.0
+"""
+The longest time to wait before trying again, in seconds, when storing the database failed.
+
+After a failure, the writer thread waits before trying again. This wait doubles with every failure in a row, up to this
+maximum.
+"""
+
+store_requested = threading.Event()
+"""
+Set when the metadata changed, to wake up the writer thread.
+"""
+
+store_lock = threading.Lock()
+"""
+Only one thread may write to the database at a time. This lock is held while writing.
+"""
+
+store_count = 0
 """
-Thread that waits a moment, and then stores the database.
+Incremented every time that changes are stored in the database.
 
-The wait is to coalesce more changes into a single write, if many metadata entries change at once.
+This is changed while holding the ``metadata_lock``. It tells whether the database changed while reading from it.
+"""
 
-If this thread is None, no thread is running and a new thread should be started if there is more metadata to write. If
-the thread is still running, the database is not yet saved.
+store_thread: typing.Optional[threading.Thread] = None
+"""
+Thread that writes the changed metadata to the database, whenever the metadata changes.
 
-Note that this is imperfect. If the metadata changes while the database is still writing (after the sleep), the latest
-changes will not be written to disk. As such, it is wise to also save the database at application closing. 
+This thread is started when the metadata first changes, and keeps running until the application closes. When the
+application closes, ``store`` should be called to write the last changes.
 """
 
 
+def store_loop() -> None:
+	"""
+	Main loop of the writer thread.
+
+	Whenever the metadata changes, this waits a moment to combine further changes into the same write, and then stores
+	the metadata. If storing fails, it is tried again later, waiting longer after every failure.
+	"""
+	retry_delay = store_delay
+	while True:
+		store_requested.wait()
+		time.sleep(store_delay)
+		store_requested.clear()  # Clear before storing, so that changes made while storing trigger another write.
+		try:
+			store()
+			retry_delay = store_delay
+		except sqlite3.Error as e:
+			logging.error(f"Unable to store music metadata. Trying again in {retry_delay}s. {e}")
+			time.sleep(retry_delay)
+			retry_delay = min(retry_delay * 2, store_retry_delay)
+
+
 def trigger_store() -> None:
 	"""
 	After a set amount of time, triggers the serialisation of metadata to disk.
 	"""
 	global store_thread
 	if store_thread is None:
-		store_thread = threading.Thread(target=store_after)
-	if not store_thread.is_alive():
+		store_thread = threading.Thread(target=store_loop, daemon=True)
 		store_thread.start()
+	store_requested.set()
 
 
 def store() -> None:
 	"""
-	Serialises the metadata on disk in a database file.
+	Writes the metadata entries that changed or were removed to the database file.
+
+	All changes are written in a single transaction. If there are no changes, the database is not touched. If writing
+	fails, the changes are kept, and the writer thread tries again later.
+
+	The entries stay dirty until they are committed, so that they are not replaced by their old rows in the database if
+	their directory is loaded in the meanwhile. Entries that changed again while storing stay dirty.
+	"""
+	global metadata, metadata_version, store_count
+	with store_lock:
+		with metadata_lock:
+			if not dirty:
+				return
+			snapshot = metadata  # The dirty entries must be taken from the same snapshot as the dirty paths.
+			stored = {path: snapshot.get(path) for path in dirty}
+			rows = []
+			removed = []
+			for path, entry in stored.items():
+				if entry is None:  # The file was removed.
+					removed.append((path, ))
+					continue
+				rows.append((path, entry.duration, entry.title, entry.artist, entry.album, entry.cover, entry.cachetime, entry.sample_rate, entry.channels, entry.bit_depth, entry.codec, entry.bitrate, entry.size, entry.inode))
+
+		logging.debug(f"Storing {len(rows)} changed metadata entries and removing {len(removed)}.")
+		try:
+			connection = connect()
+			try:
+				with connection:  # A single transaction, committed at the end.
+					# The directory totals are updated with the difference between the old and new entries.
+					directory_changes = collections.defaultdict(lambda: [0, 0.0])
+					changed_list = list(stored)
+					for start in range(0, len(changed_list), 500):  # Limit the number of parameters per query.
+						batch = changed_list[start:start + 500]
+						old_rows = connection.execute(f"SELECT path, duration FROM metadata WHERE path IN ({', '.join('?' * len(batch))})", batch)
+						for path, duration in old_rows:
+							count_track(directory_changes, path, duration, -1)
+					for row in rows:
+						count_track(directory_changes, row[0], row[1], 1)
+
+					# Update existing rows in place, rather than replacing them, so that the search index triggers see the change.
+					connection.executemany("""INSERT INTO metadata (path, duration, title, artist, album, cover, cachetime, sample_rate, channels, bit_depth, codec, bitrate, size, inode) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+						ON CONFLICT (path) DO UPDATE SET duration = excluded.duration, title = excluded.title, artist = excluded.artist, album = excluded.album, cover = excluded.cover, cachetime = excluded.cachetime,
+							sample_rate = excluded.sample_rate, channels = excluded.channels, bit_depth = excluded.bit_depth, codec = excluded.codec, bitrate = excluded.bitrate, size = excluded.size, inode = excluded.inode""", rows)
+					connection.executemany("DELETE FROM metadata WHERE path = ?", removed)
+					directory_changes = [(directory, count, duration) for directory, (count, duration) in directory_changes.items() if count != 0 or duration != 0]
+					connection.executemany("""INSERT INTO directories (directory, track_count, duration) VALUES (?, ?, ?)
+						ON CONFLICT (directory) DO UPDATE SET track_count = track_count + excluded.track_count, duration = duration + excluded.duration""", directory_changes)
+					connection.executemany("DELETE FROM directories WHERE directory = ? AND track_count <= 0", [(directory, ) for directory, _, _ in directory_changes])
+			finally:
+				connection.close()
+		except sqlite3.Error:
+			trigger_store()  # Try again later. The entries are still dirty.
+			raise
+
+		with metadata_lock:
+			store_count += 1
+			for path, entry in stored.items():
+				if metadata.get(path) is entry:  # Not changed again while storing.
+					dirty.discard(path)
+			# Directories that were evicted while they had entries that were not stored yet can be dropped completely now.
+			unloaded = {os.path.dirname(path) for path in stored}.difference(loaded_directories).intersection(metadata.directories)
+			if unloaded:
+				directories = dict(metadata.directories)
+				for directory in unloaded:
+					evict(directories, directory)
+				metadata = Snapshot(directories)
+				metadata_version += 1
+
+
+def store_on_exit() -> None:
+	"""
+	Write the last changes to the database, when the application closes.
+
+	Errors are logged, rather than raised, since there is nobody left to handle them.
+	"""
+	try:
+		store()
+	except sqlite3.Error as e:
+		logging.error(f"Unable to store the last changes to the music metadata: {e}")
+
+
+def count_track(directory_changes: dict[str, list], path: str, duration: float, sign: int) -> None:
+	"""
+	Add or subtract a track from the totals of all directories that contain it.
+
+	Playlist files are not counted as tracks. Tracks of which the duration is unknown count as having no duration.
+	:param directory_changes: For each directory, the change in the number of tracks and total duration so far. This is
+	modified in place.
+	:param path: The path to the track.
+	:param duration: The duration of the track.
+	:param sign: 1 to add the track, or -1 to subtract it.
+	"""
+	if is_playlist(path):
+		return
+	duration = max(duration, 0)
+	directory = os.path.dirname(path)
+	while True:
+		change = directory_changes[directory]
+		change[0] += sign
+		change[1] += sign * duration
+		parent = os.path.dirname(directory)
+		if parent == directory:  # Reached the root.
+			break
+		directory = parent
+
+
+def directory_totals(directories: list[str]) -> dict[str, tuple[int, float]]:
+	"""
+	Get the number of tracks and the total duration in some directories, including their subdirectories.
+
+	This only uses the database, so metadata that was changed very recently may not be included yet.
+	:param directories: The paths to the directories.
+	:return: For each directory that contains any tracks, the number of tracks and their total duration in seconds.
 	"""
 	db_file = os.path.join(kek.storage.cache(), "music.db")
+	if not os.path.exists(db_file) or len(directories) == 0:
+		return {}
+	totals = {}
+	connection = connect()
+	try:
+		for start in range(0, len(directories), 500):  # Limit the number of parameters per query.
+			batch = directories[start:start + 500]
+			for directory, track_count, duration in connection.execute(f"SELECT directory, track_count, duration FROM directories WHERE directory IN ({', '.join('?' * len(batch))})", batch):
+				totals[directory] = (track_count, duration)
+	finally:
+		connection.close()
+	return totals
+
+
+search_weights = (10.0, 5.0, 5.0, 1.0)
+"""
+How important matches in each field are when ranking search results.
+
+These are for the title, artist, album and path respectively.
+"""
+
+
+def search(query: str, limit: int=100) -> list["Entry"]:
+	"""
+	Find the music files of which the metadata matches a search query.
+
+	Every word in the query must occur in the title, artist, album or path of the file, or be the start of a word there.
+	This allows searching while the query is being typed. The search only uses the database, so metadata that was
+	changed very recently may not be found yet.
+	:param query: The words to search for.
+	:param limit: The maximum number of results.
+	:return: The metadata entries of the best matching files, best match first.
+	"""
+	words = query.split()
+	if len(words) == 0:
+		return []
+	# Quote every word, so that characters in it don't get interpreted as search syntax, and match it as prefix.
+	match = " ".join("\"" + word.replace("\"", "\"\"") + "\"*" for word in words)
+	db_file = os.path.join(kek.storage.cache(), "music.db")
 	if not os.path.exists(db_file):
-		# Create the database anew.
-		logging.info("Creating music database.")
-		connection = sqlite3.connect(db_file)
-		connection.execute("""CREATE TABLE metadata(
-			path text PRIMARY KEY,
-			duration real,
-			title text,
-			artist text,
-			album text,
-			cover text,
-			cachetime real
-		)""")
-	else:
-		connection = sqlite3.connect(db_file)
+		return []
+	connection = connect()
+	try:
+		rows = connection.execute("""SELECT metadata.path, duration, metadata.title, metadata.artist, metadata.album, cover, cachetime, sample_rate, channels, bit_depth, codec, bitrate, size, inode
+			FROM metadata_search JOIN metadata ON metadata.rowid = metadata_search.rowid
+			WHERE metadata_search MATCH ? ORDER BY bm25(metadata_search, ?, ?, ?, ?) LIMIT ?""", (match, *search_weights, limit)).fetchall()
+	finally:
+		connection.close()
+	return [Entry(*row) for row in rows]
 
-	local_metadata = metadata  # Cache locally for performance.
-	with metadata_lock:
-		for path, entry in local_metadata.items():
-			connection.execute("INSERT OR REPLACE INTO metadata (path, duration, title, artist, album, cover, cachetime) VALUES (?, ?, ?, ?, ?, ?, ?)",
-				(path, entry["duration"], entry["title"], entry["artist"], entry["album"], entry["cover"], entry["cachetime"]))
-	connection.commit()
+
+def artists() -> list[dict[str, typing.Any]]:
+	"""
+	List all artists in the music library, with a summary of their music.
+
+	This only uses the database, so metadata that was changed very recently may not be included yet.
+	:return: For each artist, the name of the artist, the number of albums and tracks, and the total duration of the
+	tracks. Sorted by name.
+	"""
+	db_file = os.path.join(kek.storage.cache(), "music.db")
+	if not os.path.exists(db_file):
+		return []
+	connection = connect()
+	try:
+		rows = connection.execute("SELECT artist, album_count, track_count, duration FROM artists ORDER BY artist COLLATE NOCASE").fetchall()
+	finally:
+		connection.close()
+	return [{
+		"artist": artist,
+		"album_count": album_count,
+		"track_count": track_count,
+		"duration": duration,
+	} for artist, album_count, track_count, duration in rows]
+
+
+def albums(artist: str) -> list[dict[str, typing.Any]]:
+	"""
+	List the albums of an artist, with a summary of each album.
+
+	This only uses the database, so metadata that was changed very recently may not be included yet.
+	:param artist: The artist to list the albums of.
+	:return: For each album, the name of the artist and the album, the number of tracks, and the total duration of the
+	tracks. Sorted by name.
+	"""
+	db_file = os.path.join(kek.storage.cache(), "music.db")
+	if not os.path.exists(db_file):
+		return []
+	connection = connect()
+	try:
+		rows = connection.execute("SELECT album, track_count, duration FROM albums WHERE artist = ? ORDER BY album COLLATE NOCASE", (artist, )).fetchall()
+	finally:
+		connection.close()
+	return [{
+		"artist": artist,
+		"album": album,
+		"track_count": track_count,
+		"duration": duration,
+	} for album, track_count, duration in rows]
+
+
+def album_tracks(artist: str, album: str) -> list["Entry"]:
+	"""
+	List the tracks on an album.
+
+	This only uses the database, so metadata that was changed very recently may not be included yet.
+	:param artist: The artist of the album.
+	:param album: The album to list the tracks of.
+	:return: The metadata entries of the tracks, sorted by their paths.
+	"""
+	db_file = os.path.join(kek.storage.cache(), "music.db")
+	if not os.path.exists(db_file):
+		return []
+	connection = connect()
+	try:
+		rows = connection.execute("""SELECT path, duration, title, artist, album, cover, cachetime, sample_rate, channels, bit_depth, codec, bitrate, size, inode FROM metadata
+			WHERE artist = ? AND album = ? AND path NOT LIKE '%.m3u' ORDER BY path""", (artist, album)).fetchall()
+	finally:
+		connection.close()
+	return [Entry(*row) for row in rows]
 
 
 def has(path: str) -> bool:
@@ -141,6 +897,7 @@ def has(path: str) -> bool:
 	:param path: The path to test for.
 	:return: ``True`` if we have a metadata entry about the file, or ``False`` if we don't.
 	"""
+	load_directory(os.path.dirname(path))
 	return path in metadata
 
 
@@ -152,25 +909,68 @@ def get(path: str, field: typing.Optional[str] = None) -> typing.Any:
 	:return: The value of the metadata entry for that field. Will be ``None`` if there is no cached information about
 	that field.
 	"""
-	if path not in metadata:
-		add_file(path)
+	entry = metadata.get(path)
+	if entry is None:
+		add_file(path)  # Reads it from the database, or from the file if the database doesn't have it.
+		entry = metadata[path]  # A new snapshot, which has the entry now.
+	else:
+		touch_directory(os.path.dirname(path))  # So that directories in active use are not evicted first.
 	if field is None:
-		return metadata[path]
+		return entry
 	else:
-		return metadata[path][field]
+		return entry[field]
 
 
-def add(path: str, entry: typing.Dict[str, typing.Any]) -> None:
+def add(path: str, entry: typing.Union["Entry", dict[str, typing.Any]]) -> None:
 	"""
 	Add or override a metadata entry for a certain file.
 	:param path: The path to the file that the metadata is for.
-	:param entry: A dictionary containing metadata.
+	:param entry: The metadata entry, or a dictionary containing all of its fields.
+	"""
+	if isinstance(entry, dict):
+		entry = Entry(**entry)
+	with metadata_lock:
+		publish({path: entry})
+		dirty.add(path)
+	trigger_store()
+
+
+def remove(path: str) -> None:
+	"""
+	Remove the metadata entry for a file, for instance because the file was deleted.
+	:param path: The path to the file that the metadata was for.
 	"""
 	with metadata_lock:
-		metadata[path] = entry
+		publish({path: None})
+		dirty.add(path)  # The next store removes it from the database too.
 	trigger_store()
 
 
+def remove_directory(directory: str) -> None:
+	"""
+	Remove the metadata entries for all files in a directory and its subdirectories, for instance because the directory
+	was deleted.
+	:param directory: The path to the directory.
+	"""
+	prefix = directory.rstrip(os.sep) + os.sep
+	paths = set()
+	db_file = os.path.join(kek.storage.cache(), "music.db")
+	if os.path.exists(db_file):
+		connection = connect()
+		paths = {path for path, in connection.execute("SELECT path FROM metadata WHERE path >= ? AND path < ?", (prefix, prefix[:-1] + chr(ord(os.sep) + 1)))}
+		connection.close()
+	with metadata_lock:
+		snapshot = metadata
+		for loaded_directory in snapshot.directories:
+			if loaded_directory == prefix[:-1] or loaded_directory.startswith(prefix):
+				paths.update(snapshot.directory(loaded_directory))
+		publish({path: None for path in paths})
+		dirty.update(paths)
+	if len(paths) > 0:
+		logging.info(f"Removing metadata of {len(paths)} files in {directory}.")
+		trigger_store()
+
+
 def add_file(path: str) -> None:
 	"""
 	Read the metadata from a given file and store it in our database.
@@ -180,12 +980,52 @@ def add_file(path: str) -> None:
 	entry respectively.
 	:param path: The path to the file to read the metadata from.
 	"""
-	local_metadata = metadata  # Cache locally for performance.
-	last_modified = os.path.getmtime(path)
-	if path in local_metadata and local_metadata[path]["cachetime"] >= last_modified:
-		return  # Already up to date.
-	if path in local_metadata:
-		logging.debug(f"Updating metadata for {path} because {local_metadata[path]['cachetime']} is earlier than {last_modified}")
+	load_directory(os.path.dirname(path))
+	entries = {}
+	entry = read_file(path, entries)
+	if entry is not None:
+		entries[path] = entry
+	if merge(entries) > 0:
+		trigger_store()
+
+
+def read_file(path: str, member_entries: typing.Optional[dict[str, "Entry"]] = None) -> typing.Optional["Entry"]:
+	"""
+	Read the metadata from a given file, if our metadata about it is not up to date.
+
+	This doesn't change our metadata, so it can be called for many files in parallel. The caller has to merge the
+	results. The metadata of the directory that the file is in should already be loaded. For playlist files, the metadata
+	of the directories of its tracks is loaded from the database by this function.
+
+	The metadata is considered outdated if the file was modified since, or if its size or inode number changed. The
+	latter catch files that were replaced by a different file with an older modification time.
+
+	For playlist files, the duration is the total duration of the tracks in the playlist that still exist, taken from
+	their metadata. Tracks whose metadata is missing or outdated are read too. The playlist is considered modified when
+	any of its tracks is modified or removed.
+	:param path: The path to the file to read the metadata from.
+	:param member_entries: For playlist files, the new metadata entries of the tracks in the playlist that had to be
+	read are added to this, by their path, so that the caller can merge them too.
+	:return: A new metadata entry for the file, or ``None`` if the metadata we have is still up to date.
+	"""
+	local_metadata = metadata  # One snapshot, so that the entry can't change between the checks below.
+	status = kek.stat_cache.stat(path)
+	if status is None:
+		raise FileNotFoundError(f"Music file doesn't exist: {path}")
+	last_modified = status.mtime
+	if is_playlist(path):
+		members = playlist_members(path)
+		for member in members:
+			member_status = kek.stat_cache.stat(member)
+			if member_status is None:  # Removing a track modifies the directory it was in.
+				member_status = kek.stat_cache.stat(os.path.dirname(member))
+			if member_status is not None:
+				last_modified = max(last_modified, member_status.mtime)
+	old_entry = local_metadata.get(path)
+	if old_entry is not None and old_entry.cachetime >= last_modified and old_entry.size == status.size and old_entry.inode == status.inode:
+		return None  # Already up to date.
+	if old_entry is not None:
+		logging.debug(f"Updating metadata for {path} because it changed. Modified at {old_entry.cachetime}, now {last_modified}. Size was {old_entry.size}, now {status.size}. Inode was {old_entry.inode}, now {status.inode}.")
 	else:
 		logging.debug(f"Updating metadata for {path} because we don't have an entry for it yet.")
 
@@ -194,60 +1034,47 @@ def add_file(path: str) -> None:
 	album = ""
 	duration = -1
 	cover = ""
+	stream_info = {}
 	mime_to_extension = {
 		"image/jpeg": ".jpg",
+		"image/jpg": ".jpg",  # Not a real MIME type, but some taggers write it.
 		"image/png": ".png",
 		"image/gif": ".gif",
 	}
-	if path.endswith(".m3u"):
+	if is_playlist(path):
 		total_duration = 0
-		for line in open(path, "r"):
-			line = line.strip()
-			if line.startswith("#"):
-				continue  # Comment line.
-			if os.path.isabs(line):
-				abspath = line
-			else:
-				abspath = os.path.join(os.path.dirname(path), line)
+		for member in members:
+			if is_playlist(member):
+				continue  # Playlists in playlists are not supported, and could refer to each other endlessly.
+			if kek.stat_cache.stat(member) is None:
+				continue  # Tracks that were removed don't contribute to the duration.
 			try:
-				total_duration += mutagen.File(abspath).info.length
+				load_directory(os.path.dirname(member))  # So that tracks of which the database is up to date are not read again.
+				member_entry = read_file(member)  # Only reads the track if our metadata about it is missing or outdated.
 			except Exception as e:
-				logging.warning(f"{type(e)}: Unable to get duration from {path}: {e}")
-			duration = total_duration
+				logging.warning(f"{type(e)}: Unable to get duration of {member} in {path}: {e}")
+				continue
+			if member_entry is None:  # Still up to date.
+				member_entry = metadata.get(member)
+				if member_entry is None:
+					continue  # Was evicted in the meanwhile.
+			elif member_entries is not None:
+				member_entries[member] = member_entry
+			if member_entry.duration > 0:
+				total_duration += member_entry.duration
+		duration = total_duration
 	else:
 		try:
-			f = mutagen.File(path)
-			duration = f.info.length
-			if type(f) in {mutagen.mp3.MP3, mutagen.wave.WAVE}:  # Uses ID3 tags.
-				id3 = mutagen.easyid3.EasyID3(path)
-				title = id3.get("title", [""])[0]
-				artist = id3.get("artist", [""])[0]
-				album = id3.get("album", [""])[0]
-				apic_keys = list(filter(lambda t: t.startswith("APIC:"), f.keys()))
-				apics = list(filter(lambda a: len(a.data) > 0, [f[key] for key in apic_keys]))
-				if len(apics) > 0:
-					mime = apics[0].mime
-					if mime in mime_to_extension:
-						extension = mime_to_extension[mime]
-						cover_fname = os.path.join(kek.storage.cache(), "covers", str(uuid.uuid4()) + extension)
-						with open(cover_fname, "wb") as cover_fstream:
-							cover_fstream.write(apics[0].data)
-							cover = cover_fname
-			elif type(f) == mutagen.flac.FLAC:
-				title = f.get("title", [""])[0]
-				artist = f.get("artist", [""])[0]
-				album = f.get("album", [""])[0]
-				if len(f.pictures) > 0:
-					extension = mime_to_extension[f.pictures[0].mime]
-					cover_fname = os.path.join(kek.storage.cache(), "covers", str(uuid.uuid4()) + extension)
-					with open(cover_fname, "wb") as cover_fstream:
-						cover_fstream.write(f.pictures[0].data)
-						cover = cover_fname
-			elif isinstance(f, mutagen.ogg.OggFileType):  # Vorbis Comment
-				title = f.get("title", [os.path.splitext(os.path.basename(path))[0]])[0]
-				artist = f.get("artist", [""])[0]
-				album = f.get("album", [""])[0]
-				# TODO: Don't know yet how to get album covers from these and have no files to test with.
+			tags = read_tags(path)
+			duration = tags["duration"]
+			title = tags["title"]
+			artist = tags["artist"]
+			album = tags["album"]
+			stream_info = {field: tags[field] for field in ("sample_rate", "channels", "bit_depth", "codec", "bitrate")}
+			if tags["picture"] is not None:
+				data, mime = tags["picture"]
+				if mime in mime_to_extension:
+					cover = store_cover(data, mime_to_extension[mime])
 		except Exception as e:
 			logging.warning(f"{type(e)}: Unable to get metadata from {path}: {e}")
 	if title == "":
@@ -257,19 +1084,163 @@ def add_file(path: str) -> None:
 		dir_name = os.path.basename(os.path.dirname(path))
 		for maybe_cover in {dir_name + ".jpg", dir_name + ".png", dir_name + ".gif"}:
 			maybe_cover = os.path.join(os.path.dirname(path), maybe_cover)
-			if os.path.exists(maybe_cover):
+			if kek.stat_cache.stat(maybe_cover) is not None:
 				cover = maybe_cover
 				break
 
-	add(path, {
-		"path": path,
-		"duration": duration,
-		"title": title,
-		"artist": artist,
-		"album": album,
-		"cover": cover,
-		"cachetime": last_modified,
-	})
+	return Entry(path, duration, title, artist, album, cover, last_modified, size=status.size, inode=status.inode, **stream_info)
+
+
+def read_tags(path: str) -> dict[str, typing.Any]:
+	"""
+	Read the tags, the stream information and the cover image of a music file.
+
+	The file is parsed only once, and everything is taken from the result. Files with ID3 tags (MP3 and WAV) and with
+	Vorbis comments (FLAC, Ogg Vorbis and Opus) are supported. Tags that the file doesn't have are empty strings. Stream
+	information that the format doesn't have is 0.
+	:param path: The path to the music file.
+	:return: The title, artist, album, duration (in seconds), sample rate (in Hz), number of channels, bit depth, codec
+	and bit rate (in bits per second) of the file, and its cover image. The cover image is a tuple of the encoded image
+	and its MIME type, or ``None`` if the file has no cover image. The front cover is preferred over other images.
+	"""
+	f = mutagen.File(path)
+	if f is None:
+		raise mutagen.MutagenError(f"Unknown music file format: {path}")
+	info = f.info
+	result = {
+		"title": "",
+		"artist": "",
+		"album": "",
+		"duration": info.length,
+		"sample_rate": getattr(info, "sample_rate", 0),
+		"channels": getattr(info, "channels", 0),
+		"bit_depth": getattr(info, "bits_per_sample", 0),  # Only lossless formats have a bit depth.
+		"codec": type(f).__name__.lower(),
+		"bitrate": getattr(info, "bitrate", 0),
+		"picture": None,
+	}
+	if isinstance(f, mutagen.oggopus.OggOpus):
+		result["sample_rate"] = 48000  # Opus is always decoded at this sample rate.
+
+	tags = f.tags
+	pictures = list(getattr(f, "pictures", []))  # FLAC files store pictures outside of the tags.
+	if isinstance(tags, mutagen.id3.ID3):
+		for field, frame_id in (("title", "TIT2"), ("artist", "TPE1"), ("album", "TALB")):
+			frame = tags.get(frame_id)
+			if frame is not None and len(frame.text) > 0:
+				result[field] = str(frame.text[0])
+		pictures += tags.getall("APIC")
+	elif tags is not None:  # Vorbis comments.
+		for field in ("title", "artist", "album"):
+			result[field] = tags.get(field, [""])[0]
+		for encoded in tags.get("metadata_block_picture", []):
+			try:
+				pictures.append(mutagen.flac.Picture(base64.b64decode(encoded)))
+			except (ValueError, mutagen.MutagenError) as e:
+				logging.warning(f"Unable to decode cover image in {path}: {e}")
+
+	pictures = [picture for picture in pictures if len(picture.data) > 0]
+	if len(pictures) > 0:
+		front_covers = [picture for picture in pictures if picture.type == mutagen.id3.PictureType.COVER_FRONT]
+		picture = (front_covers + pictures)[0]
+		result["picture"] = (picture.data, picture.mime)
+	return result
+
+
+cover_grace_period = 60 * 60
+"""
+How long a cover image is kept at least after it was last written or reused, in seconds, even if no metadata refers to it.
+
+This prevents the garbage collection from deleting images that a scan just wrote, but that are not in the metadata yet.
+"""
+
+
+def store_cover(data: bytes, extension: str) -> str:
+	"""
+	Store a cover image in the cache.
+
+	The image is named after the hash of its contents, so that tracks with the same cover share the same image file.
+	If the image is already stored, it is not written again.
+	:param data: The encoded image.
+	:param extension: The file extension for the image format, including the period.
+	:return: The path to the stored image.
+	"""
+	cover_path = os.path.join(kek.storage.cache(), "covers", hashlib.sha256(data).hexdigest() + extension)
+	if os.path.exists(cover_path):
+		try:
+			os.utime(cover_path)  # Mark it as used, so that the garbage collection doesn't delete it right now.
+			return cover_path
+		except OSError:
+			pass  # Was just deleted by the garbage collection. Write it again.
+	temp_path = f"{cover_path}.{threading.get_ident()}.tmp"  # Other threads may be writing the same image at the same time.
+	with open(temp_path, "wb") as cover_fstream:
+		cover_fstream.write(data)
+	os.replace(temp_path, cover_path)
+	return cover_path
+
+
+def collect_covers() -> None:
+	"""
+	Delete the cover images in the cache that no metadata refers to any more.
+
+	The number of references to each image is counted from the database and from the metadata that is not stored yet.
+	Images that were used recently are kept anyway, see ``cover_grace_period``.
+	"""
+	covers_dir = os.path.join(kek.storage.cache(), "covers")
+	threshold = time.time() - cover_grace_period
+	references = collections.Counter()
+	db_file = os.path.join(kek.storage.cache(), "music.db")
+	if os.path.exists(db_file):
+		connection = connect()
+		for cover, count in connection.execute("SELECT cover, COUNT(*) FROM metadata GROUP BY cover"):
+			references[cover] += count
+		connection.close()
+	with metadata_lock:
+		snapshot = metadata
+		for path in dirty:
+			if path in snapshot:  # Not if it was removed.
+				references[snapshot[path].cover] += 1
+
+	deleted = 0
+	for entry in os.scandir(covers_dir):
+		if references[entry.path] > 0:
+			continue
+		try:
+			if entry.stat().st_mtime >= threshold:
+				continue
+			os.remove(entry.path)
+			deleted += 1
+		except OSError as e:
+			logging.warning(f"Unable to delete unused cover image {entry.path}: {e}")
+	logging.info(f"Deleted {deleted} unused cover images.")
+
+
+def playlist_members(path: str) -> list[str]:
+	"""
+	Read which tracks are in a playlist file.
+	:param path: The path to the playlist file (m3u).
+	:return: The paths to the tracks in the playlist, in order.
+	"""
+	members = []
+	with open(path, "r") as playlist_file:
+		for line in playlist_file:
+			line = line.strip()
+			if line == "" or line.startswith("#"):
+				continue  # Empty or comment line.
+			member = os.path.join(os.path.dirname(path), line)  # Relative to the playlist. Absolute paths stay as they are.
+			members.append(os.path.normpath(member))  # The same path as the metadata of the track has, without any "..".
+	return members
+
+
+def is_playlist(path: str) -> bool:
+	"""
+	Returns whether the given file is a playlist file (m3u), rather than a track.
+
+	The case of the extension is ignored, like the ``NOT LIKE '%.m3u'`` conditions in the database do.
+	:param path: The file to check.
+	:return: ``True`` if it is a playlist, or ``False`` if it isn't.
+	"""
+	return path.lower().endswith(".m3u")
 
 
 def is_music_file(path: str) -> bool:
@@ -278,20 +1249,88 @@ def is_music_file(path: str) -> bool:
 	:param path: The file to check.
 	:return: ``True`` if it is a music track, or ``False`` if it isn't.
 	"""
-	if not os.path.isfile(path):
+	status = kek.stat_cache.stat(path)
+	if status is None or not status.is_file:
 		return False  # Only read files.
 	ext = os.path.splitext(path)[1]
 	ext = ext.lower()
 	return ext in [".mp3", ".flac", ".ogg", ".opus", ".wav", ".m3u"]  # Supported file formats.
 
 
-def add_directory(path: str) -> None:
+def add_directory(path: str, executor: typing.Optional[concurrent.futures.Executor] = None) -> None:
 	"""
 	Read the metadata from all music files in a directory (not its subdirectories) and store them in our database.
 
 	This will update all metadata in the database about the files in this directory so that it's all up to date again.
+	That includes removing the metadata of files that no longer exist.
 	:param path: The path to the directory to read the files from.
+	:param executor: The threads to read the files with. The files are read with the priority of these threads. By
+	default, the shared ``scan_executor`` is used.
+	"""
+	if executor is None:
+		executor = get_scan_executor()
+	path = os.path.normpath(path)  # The metadata is grouped by os.path.dirname of the files, which has no trailing slash.
+	load_directory(path)
+	files = set(filter(is_music_file, [entry.path for entry in kek.stat_cache.list_directory(path).values()]))
+	changed = 0
+	removed_paths = [filepath for filepath in metadata.directory(path) if filepath not in files]
+	if removed_paths:
+		with metadata_lock:
+			publish({removed_path: None for removed_path in removed_paths})
+			dirty.update(removed_paths)
+		changed += len(removed_paths)
+	batch = {}
+	member_entries = {}  # Tracks in playlists that had to be read. Filled from multiple threads.
+	futures = {executor.submit(read_file, filepath, member_entries): filepath for filepath in files}
+	for future in concurrent.futures.as_completed(futures):
+		try:
+			entry = future.result()
+		except OSError as e:  # The file may have been removed in the meanwhile.
+			logging.warning(f"Unable to read metadata from {futures[future]}: {e}")
+			continue
+		if entry is None:
+			continue  # Already up to date.
+		batch[entry.path] = entry
+		if len(batch) >= scan_batch_size:
+			changed += merge(batch)
+	changed += merge(batch)
+	changed += merge({path: entry for path, entry in member_entries.items() if path not in files})  # Those in this directory were read already.
+	if changed > 0:
+		trigger_store()  # Store all changes at once.
+
+
+def get_scan_executor() -> concurrent.futures.ThreadPoolExecutor:
+	"""
+	Get the shared threads that read the metadata of the files in a directory.
+
+	The threads are started the first time. If the ``scan_concurrency`` changed since, they are replaced by the right
+	number of threads. The old threads still finish the files that they were given.
+	:return: The shared threads to read files with.
 	"""
-	files = set(filter(is_music_file, [os.path.join(path, filename) for filename in os.listdir(path)]))
-	for filepath in files:
-		add_file(filepath)
\ No newline at end of file
+	global scan_executor, scan_executor_concurrency
+	with scan_executor_lock:
+		if scan_executor is None or scan_executor_concurrency != scan_concurrency:
+			if scan_executor is not None:
+				logging.debug(f"Changing the number of threads to read music files with from {scan_executor_concurrency} to {scan_concurrency}.")
+				scan_executor.shutdown(wait=False)
+			scan_executor = concurrent.futures.ThreadPoolExecutor(max_workers=scan_concurrency)
+			scan_executor_concurrency = scan_concurrency
+		return scan_executor
+
+
+def merge(entries: dict[str, "Entry"]) -> int:
+	"""
+	Add a batch of new metadata entries, without storing them yet.
+
+	The whole batch is published in a single new snapshot of the metadata. The batch is emptied afterwards.
+	:param entries: The new metadata entries, by the path of the file that they are about.
+	:return: How many entries were added.
+	"""
+	count = len(entries)
+	if count == 0:
+		return 0
+	with metadata_lock:
+		publish(entries)
+		dirty.update(entries.keys())
+	entries.clear()
+	return count
\ No newline at end of file
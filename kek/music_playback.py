@@ -6,30 +6,84 @@
 
 """
 A collection of functions to actually play audio on the system.
+
+The audio is played by two threads. The playback thread takes the audio from the current track and writes it into a
+ring buffer. The output (normally the audio device) pulls audio from that ring buffer, on its own thread. The other
+threads in the application control the playback thread by sending commands to it through a queue.
+
+The playback thread is started with the first track that gets played, or explicitly with ``start``, which also allows
+choosing a different output.
+
+The next track can be queued with ``enqueue`` while the current track is playing. The playback thread then continues
+with it right after the last frame of the current track, in the same stream, so that there is no gap between them.
 """
 
-import numpy  # To export Sound objects to a playback buffer.
-import pyaudio  # Used to actually play audio through the operating system.
-import time  # To sleep the thread when there is no audio to play.
+import logging
+import math  # To compute how much audio fits in the ring buffer after conversion.
+import queue  # To send commands to the playback thread.
 import threading  # The audio is played on a different thread.
+import time  # To measure how long it takes to produce audio.
 import typing
 
+import kek.audio_output  # To actually play audio through the operating system, or elsewhere.
+import kek.format_conversion  # To convert all audio to the same format, if configured.
+import kek.playback_stats  # To measure the performance of the playback.
+import kek.ring_buffer  # To pass audio from the playback thread to the audio device.
+
 if typing.TYPE_CHECKING:
 	import kek.sound
 
-audio_source: typing.Optional["kek.sound.Sound"] = None
+buffer_duration = 0.5
+"""
+How much audio the ring buffer can hold, in seconds.
+
+The playback thread keeps this buffer filled, so this is how long the playback thread may stall without the audio
+device running out of audio.
+"""
+
+chunk_duration = 0.1
+"""
+The maximum amount of audio that the playback thread writes into the ring buffer at once, in seconds.
+
+If the ring buffer doesn't have room for this much audio, the playback thread waits this long before trying again. If
+the output doesn't consume audio in real time, the playback thread only waits a millisecond.
+"""
+
+output_format: typing.Optional[tuple[int, int, int]] = None
 """
-The audio track that is currently being played.
+The format to convert all audio to before playing it, if any.
+
+This is a tuple of the sample width (in bytes, 2 or 4), the frame rate (in Hz) and the number of channels. If set, the
+audio stream is opened once in this format and stays open for the whole session, which avoids re-opening the audio
+device (and the click that comes with it) when switching between tracks in different formats. If ``None``, every track
+is played in its own format, and the audio stream is re-opened whenever the format changes.
 """
 
-current_position = 0.0
+clock = (0, 0.0, 44100)
 """
-The location in the track where we are currently playing (in seconds).
+The reference point to compute the playhead from.
+
+This holds the position in the ring buffer (in bytes) where the playback thread started writing the current track or
+after the last seek, the time in the track (in seconds) that was written there, and the frame rate of the audio stream.
+The frames that the audio device has read from the ring buffer since then have been played. This is only changed by the
+playback thread, replacing the whole tuple at once so that it's always consistent.
 """
 
-end_position = 0.0
+latency = 0.0
 """
-The location in the track where the song ends (in seconds).
+The latency of the output, in seconds.
+
+This is how long it takes for audio that the output took from the ring buffer to be heard.
+"""
+
+output: typing.Optional[kek.audio_output.AudioOutput] = None
+"""
+Where the audio is sent to. This is set when the playback thread is started.
+"""
+
+play_thread: typing.Optional[threading.Thread] = None
+"""
+A thread that continuously sends audio to the output to play.
 """
 
 is_paused = False
@@ -39,89 +93,344 @@ Whether the playback is ongoing, but paused.
 While paused the playback thread will not play chunks, but keeps the playback position.
 """
 
-def play(new_audio: "kek.sound.Sound") -> None:
+playback_number = 0
+"""
+A number identifying the audio source that was last started.
+
+This is incremented every time a new audio source starts playing, so that notifications about the end of a track can
+be matched with the track that they are about.
+"""
+
+playback_number_lock = threading.Lock()
+"""
+Held while assigning a playback number to an audio source and sending it to the playback thread.
+
+This makes sure that the playback thread receives the audio sources in the order of their numbers, and always gets the
+number together with the audio source it belongs to.
+"""
+
+on_track_ended: typing.Optional[typing.Callable[[int], None]] = None
+"""
+Function to call when the last frame of an audio source has been sent to the audio device.
+
+It gets the playback number of the audio source that ended. It is called from the playback thread. If an audio source
+was queued to play after it, that audio source is already playing by then.
+"""
+
+commands: queue.Queue = queue.Queue()
+"""
+Commands for the playback thread.
+
+Each command is a tuple, starting with the name of the command, followed by its parameters.
+"""
+
+ring: kek.ring_buffer.RingBuffer = kek.ring_buffer.RingBuffer(1)
+"""
+The audio that the playback thread prepared for the audio device, waiting to be played.
+
+This is replaced by the playback thread whenever the output format changes, while the audio device is not running.
+"""
+
+output_frame_size = 1
+"""
+The number of bytes of each frame sent to the output.
+"""
+
+output_paused = False
+"""
+Whether the output should get silence rather than the contents of the ring buffer.
+
+This is only changed by the playback thread.
+"""
+
+producing = False
+"""
+Whether the playback thread is producing audio for the ring buffer.
+
+If the ring buffer runs empty while this is set, the output had an underrun. This is only changed by the playback thread.
+"""
+
+def start(new_output: typing.Optional[kek.audio_output.AudioOutput]=None) -> None:
+	"""
+	Start the playback thread, if it isn't running yet.
+	:param new_output: Where to send the audio to. If not provided, the audio is played on the audio device.
+	"""
+	global output
+	global play_thread
+	if play_thread is not None:
+		return
+	output = new_output if new_output is not None else kek.audio_output.PyAudioOutput()
+	play_thread = threading.Thread(target=play_loop, daemon=True)
+	play_thread.start()
+
+def play(new_audio: "kek.sound.Sound") -> int:
 	"""
 	Start the playback of a new audio source.
 	:param new_audio: The new audio source to play.
+	:return: The playback number assigned to this audio source, to recognise when it ends.
+	"""
+	global playback_number
+	start()
+	new_audio.interleave()  # So that the playback thread can send parts of it to the audio device without copying.
+	with playback_number_lock:
+		playback_number += 1
+		number = playback_number
+		commands.put(("play", new_audio, number))
+	return number
+
+def enqueue(new_audio: "kek.sound.Sound") -> int:
 	"""
-	global audio_source
-	global end_position
-	end_position = new_audio.duration()
-	audio_source = new_audio
+	Queue an audio source to play right after the current one, without a gap in between.
+
+	This replaces the audio source that was queued before, if any. If nothing is playing any more by the time that the
+	playback thread gets this, the audio source starts playing right away.
+	:param new_audio: The audio source to play next.
+	:return: The playback number assigned to this audio source, to recognise when it ends.
+	"""
+	global playback_number
+	start()
+	new_audio.interleave()
+	with playback_number_lock:
+		playback_number += 1
+		number = playback_number
+		commands.put(("enqueue", new_audio, number))
+	return number
+
+def dequeue() -> None:
+	"""
+	Don't play the audio source that was queued to play next, if any.
+
+	If the queued audio source already started playing, it keeps playing.
+	"""
+	commands.put(("enqueue", None, 0))
 
 def toggle_pause() -> None:
+	"""
+	Pause the playback if it is playing, or resume it if it is paused.
+	"""
 	global is_paused
 	is_paused = not is_paused
+	commands.put(("pause", is_paused))
 
 def stop() -> None:
 	"""
 	Stop playing any audio.
 	"""
-	global audio_source
-	audio_source = None
-	global current_position
-	current_position = 0.0
 	global is_paused
 	is_paused = False
+	commands.put(("stop", ))
 
 def seek(new_position: float) -> None:
 	"""
 	Change the current position in the song.
 	:param new_position: The new position, in seconds since the start of the song.
 	"""
-	global current_position
-	current_position = new_position
+	commands.put(("seek", new_position))
+
+def playhead() -> float:
+	"""
+	Get the position in the current track that is being heard right now.
+
+	This is computed from the number of frames that the output took from the ring buffer, minus the latency of the
+	output.
+	:return: The position in the current track, in seconds since the start of the track.
+	"""
+	start_byte, start_time, frame_rate = clock
+	played_frames = max(0, ring.read_position - start_byte) // output_frame_size
+	latency_frames = round(latency * frame_rate)
+	return start_time + max(0, played_frames - latency_frames) / frame_rate
+
+def buffer_fill() -> float:
+	"""
+	Get how much audio is waiting in the ring buffer to be played.
+	:return: The amount of audio in the ring buffer, in seconds.
+	"""
+	return ring.available() / output_frame_size / clock[2]
+
+def pull(frame_count: int, pad: bool) -> bytes:
+	"""
+	Provide the output with the next audio to play.
+
+	This is called by the output on its own thread, whenever it needs more audio. For the audio device, it needs to be
+	fast, so it only takes the audio from the ring buffer.
+	:param frame_count: The number of frames that the output needs.
+	:param pad: Whether to fill up the result with silence if the ring buffer doesn't have enough audio, or if the
+	playback is paused. If ``False``, the result may be shorter.
+	:return: The audio to play.
+	"""
+	length = frame_count * output_frame_size
+	if output_paused:
+		return bytes(length) if pad else b""
+	data = ring.read(length)
+	if pad and len(data) < length:  # The ring buffer ran empty. Fill the rest with silence.
+		if producing:  # The playback thread didn't keep up.
+			kek.playback_stats.record_underrun((length - len(data)) // output_frame_size)
+		data += bytes(length - len(data))
+	return data
+
+def stream_format_for(audio: "kek.sound.Sound") -> tuple[int, int, int]:
+	"""
+	Get the format that the audio stream must have to play an audio source.
+	:param audio: The audio source to play.
+	:return: The sample width, frame rate and number of channels of the stream.
+	"""
+	if output_format is None:  # Play the audio in its own format.
+		return audio.sample_width(), audio.frame_rate, audio.num_channels()
+	return output_format
 
 def play_loop() -> None:
 	"""
 	Main loop of the playback server.
 
 	This function runs indefinitely. It should be ran on a different thread than the main GUI thread.
-	It will continuously look for the current position in the current audio source and play it.
+	It will continuously take audio from the current audio source and write it into the ring buffer for the output, and
+	execute the commands that it receives from other threads.
 	"""
-	global current_position
-	global audio_source
-	audio_server = None
-	stream = None
+	global clock
+	global latency
+	global ring
+	global output_frame_size
+	global output_paused
+	global producing
+	stream_format = None  # Sample width, frame rate and number of channels that the stream was opened with.
+	audio = None  # The audio source we're playing.
+	converter = None  # If converting the audio to the configured output format, the converter for the current audio source.
+	number = 0  # The playback number of the audio source we're playing.
+	position = 0  # The frame in the audio source that will be written to the ring buffer next. Counting in frames avoids rounding errors.
+	draining = False  # Whether the whole audio source is written, and we're waiting for the ring buffer to be played.
+	queued = None  # The audio source to continue with after this one, if any.
+	queued_number = 0  # The playback number of the queued audio source.
+	boundaries = []  # Where previous audio sources end in the ring buffer, their playback numbers and the clock of the audio source after them.
+	pending = None  # A command to execute before taking the next command from the queue.
 
 	try:
-		audio_server = pyaudio.PyAudio()
-		current_sample_width = 0
-		current_channels = 0
-		current_rate = 0
 		while True:
-			if audio_source is None or is_paused:
-				time.sleep(0.2)
+			try:
+				if pending is not None:
+					command = pending
+					pending = None
+				elif audio is None or output_paused:
+					command = commands.get()  # Nothing to play. Wait until we get something to do.
+				elif draining or ring.free() < round(chunk_duration * stream_format[1]) * output_frame_size:
+					wait_time = chunk_duration if output.realtime else 0.001
+					command = commands.get(timeout=wait_time)  # Wait for the output, unless we get a command.
+				else:
+					command = commands.get_nowait()
+			except queue.Empty:
+				command = None
+
+			if command is not None:
+				if command[0] in ("play", "seek", "stop"):  # The rest of the ring buffer is discarded, so the audio sources in there ended.
+					for _, ended_number, clock in boundaries:
+						if on_track_ended is not None:
+							on_track_ended(ended_number)
+					boundaries = []
+				if command[0] == "play":
+					_, audio, number = command  # The number always comes with the audio source it belongs to.
+					position = 0
+					draining = False
+					queued = None
+					new_format = stream_format_for(audio)
+					if output_format is None:
+						converter = None
+					else:
+						converter = kek.format_conversion.FormatConverter(audio.frame_rate, audio.num_channels(), *output_format)
+					if new_format != stream_format:  # Need to re-open the output for the new format.
+						output.close()
+						stream_format = new_format
+						output_frame_size = new_format[0] * new_format[2]
+						ring = kek.ring_buffer.RingBuffer(round(buffer_duration * new_format[1]) * output_frame_size)
+						output.open(new_format[0], new_format[1], new_format[2], pull)
+						latency = output.latency()
+						logging.info(f"Opened audio output with sample width {new_format[0]}, frame rate {new_format[1]} and {new_format[2]} channels. Output latency: {latency}s.")
+					else:
+						ring.discard()
+						output.start()
+					clock = (ring.write_position, 0.0, stream_format[1])
+				elif command[0] == "enqueue":
+					_, queued, queued_number = command
+					if queued is not None and audio is None:  # The previous audio source already ended.
+						pending = ("play", queued, queued_number)
+						queued = None
+					elif queued is not None:
+						draining = False  # Continue with the queued audio source, if it was waiting for the ring buffer to be played.
+				elif command[0] == "pause":
+					output_paused = command[1]
+				elif command[0] == "seek":
+					if audio is not None:
+						position = max(0, min(audio.frame_count(), round(command[1] * audio.frame_rate)))
+						draining = False
+						ring.discard()
+						if converter is not None:
+							converter.reset()
+						clock = (ring.write_position, position / audio.frame_rate, stream_format[1])
+				elif command[0] == "stop":
+					audio = None
+					queued = None
+					output_paused = False
+					clock = (ring.write_position, 0.0, clock[2])
+					if stream_format is not None:
+						ring.discard()
+						if output_format is None:  # When converting, keep the output running for the next track.
+							output.stop()
+				producing = False  # Until the ring buffer has audio again, it running empty is expected.
+				continue  # Handle all commands before producing more audio.
+
+			while boundaries and ring.read_position >= boundaries[0][0]:  # The output started playing the next audio source.
+				_, ended_number, clock = boundaries.pop(0)
+				if on_track_ended is not None:
+					on_track_ended(ended_number)
+
+			if draining:
+				producing = False  # The ring buffer running empty now is expected.
+				if ring.available() == 0 and not boundaries:  # Playback completed.
+					audio = None
+					clock = (ring.write_position, 0.0, clock[2])
+					if queued is not None:  # In a different format, so the output has to be re-opened for it.
+						pending = ("play", queued, queued_number)
+						queued = None
+					elif output_format is None:  # Stop the output and go into stand-by. When converting, keep the output running for the next track.
+						output.stop()
+					if on_track_ended is not None:
+						on_track_ended(number)
 				continue
-			chunk_size = 0.2
-			chunk = audio_source[current_position:current_position + chunk_size]
-			if chunk.channels[0].itemsize != current_sample_width or chunk.frame_rate != current_rate or len(chunk.channels) != current_channels:
-				# New audio source, so re-generate the stream.
-				if stream:
-					stream.stop_stream()
-					stream.close()
-				current_sample_width = chunk.channels[0].itemsize
-				current_rate = chunk.frame_rate
-				current_channels = len(chunk.channels)
-				stream = audio_server.open(format=audio_server.get_format_from_width(current_sample_width), rate=current_rate, channels=current_channels, output=True)
-			if current_position >= end_position:  # Playback completed. Stop taking the GIL and go into stand-by.
-				current_position = 0
-				audio_source = None
+
+			# Write the next chunk of audio into the ring buffer.
+			remaining = audio.frame_count() - position
+			if remaining <= 0:
+				if converter is not None:  # The converter still holds the last frames of the audio.
+					if ring.free() < converter.flush_frame_count() * output_frame_size:
+						continue  # No room for them in the ring buffer yet.
+					ring.write(memoryview(converter.flush()).cast("B"))
+				if queued is not None and stream_format_for(queued) == stream_format:  # Continue with the queued audio source right away, in the same stream.
+					boundaries.append((ring.write_position, number, (ring.write_position, 0.0, stream_format[1])))
+					audio, number = queued, queued_number
+					queued = None
+					position = 0
+					if converter is not None:
+						converter = kek.format_conversion.FormatConverter(audio.frame_rate, audio.num_channels(), *output_format)
+					continue
+				draining = True
 				continue
-			samples = numpy.empty(chunk.channels[0].size * len(chunk.channels), dtype=chunk.channels[0].dtype)
-			for channel_num, channel in enumerate(chunk.channels):
-				samples[channel_num::len(chunk.channels)] = channel
-			stream.write(samples.tobytes())
-			current_position += chunk_size
+			free_frames = ring.free() // output_frame_size
+			if converter is not None:  # Converting the frame rate may produce up to 2 more frames than the ratio suggests.
+				free_frames = math.floor((free_frames - 2) * converter.step)
+			num_frames = min(free_frames, round(chunk_duration * audio.frame_rate), remaining)
+			if num_frames <= 0:
+				continue  # No room in the ring buffer yet.
+			kek.playback_stats.buffer_fill.add(ring.available() / ring.capacity)
+			slice_start = time.perf_counter()
+			if converter is None:
+				chunk = audio.frame_view(position, position + num_frames)
+			else:
+				chunk = memoryview(converter.convert(audio.frame_array(position, position + num_frames))).cast("B")
+			write_start = time.perf_counter()
+			ring.write(chunk)
+			write_end = time.perf_counter()
+			producing = True
+			kek.playback_stats.slice_time.add(write_start - slice_start)
+			kek.playback_stats.write_time.add(write_end - write_start)
+			kek.playback_stats.log_periodically()
+			position += num_frames
 	finally:
-		if stream:
-			stream.stop_stream()
-			stream.close()
-		if audio_server:
-			audio_server.terminate()
-
-play_thread = threading.Thread(target=play_loop, daemon=True)
-"""
-A thread that continuously sends audio to the operating system to play.
-"""
-play_thread.start()  # Start that thread to feed audio to the operating system.
\ No newline at end of file
+		output.close()
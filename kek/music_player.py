@@ -11,12 +11,17 @@ Keeps track and controls the currently playing music.
 import logging
 import math  # For correctly formatting the duration of the track.
 import PySide6.QtCore  # For exposing these controls to QML.
+import threading  # To decode the next track in the background.
 import time  # Tracking the time played.
 import typing
 
+import kek.cover_provider  # To show the cover images of the tracks.
+import kek.music_metadata  # For the metadata of the tracks.
 import kek.music_playback  # To actually play the music.
+import kek.playback_stats  # To diagnose dropouts in the audio.
 import kek.playlist  # To find which songs we have to be playing.
 import kek.sound  # To store the audio we're playing.
+import kek.sound_cache  # To decode the audio we're playing, or get it from the cache if we played it recently.
 
 class MusicPlayer(PySide6.QtCore.QObject):
 	"""
@@ -30,6 +35,15 @@ class MusicPlayer(PySide6.QtCore.QObject):
 	This class is a singleton. This stores the one instance that is allowed to exist.
 	"""
 
+	streaming_threshold = 15 * 60 * 44100 * 2 * 2
+	"""
+	Tracks that take more memory than this (in bytes) when decoded are streamed while playing, rather than decoded
+	entirely before playing.
+
+	Decoding a long track takes a noticeable amount of time before the music starts, and a lot of memory. This is the
+	size of 15 minutes of 44.1kHz stereo audio, which is what most formats are decoded to.
+	"""
+
 	@classmethod
 	def get_instance(cls) -> "MusicPlayer":
 		"""
@@ -50,9 +64,71 @@ class MusicPlayer(PySide6.QtCore.QObject):
 		self.start_time = None  # The start time (float) if any track is playing, or None if not.
 		self.current_sound = None  # If playing, the decoded wave data (Sound object).
 
-		self.song_end_timer = PySide6.QtCore.QTimer()
-		self.song_end_timer.setSingleShot(True)
-		self.song_end_timer.timeout.connect(self.play_next)
+		# While playing, the next track in the playlist gets decoded in the background, so that it can start right away.
+		self.prefetch_path: typing.Optional[str] = None  # The file that is being or has been decoded in advance.
+		self.prefetch_sound: typing.Optional[kek.sound.Sound] = None  # Once decoded, the audio of that file.
+		self.prefetch_cancelled = threading.Event()  # Set when the current prefetch is cancelled, to stop decoding and discard the result.
+		self.prefetch_lock = threading.Lock()  # Protects the prefetched sound, which is written by the prefetch thread.
+
+		self.playback_number = -1  # The number that the playback engine assigned to the track we're playing.
+		self.queued_number = -1  # If the next track was queued to play without a gap, the number that the playback engine assigned to it.
+		# The playback thread reports when a track ended. Going through a signal moves that to the Qt thread.
+		self.track_ended.connect(self.on_track_ended)
+		kek.music_playback.on_track_ended = self.track_ended.emit
+		# The prefetch thread reports when the next track is decoded, so that the Qt thread can queue it.
+		self.prefetch_done.connect(self.enqueue_prefetched)
+
+	track_ended = PySide6.QtCore.Signal(int)
+	"""
+	Triggered when the playback engine sent the last frame of a track to the audio device.
+
+	The parameter is the number that the playback engine assigned to that track when it started playing.
+	"""
+
+	@PySide6.QtCore.Slot(int)
+	def on_track_ended(self, playback_number: int) -> None:
+		"""
+		Called when the playback engine finished playing a track, to continue with the next track.
+		:param playback_number: The number that the playback engine assigned to the track that ended.
+		"""
+		if playback_number != self.playback_number:
+			return  # A track that we already stopped or replaced. Its ending was reported just before that.
+		if self.queued_number < 0:  # The next track was not ready in time.
+			self.play_next()
+			return
+
+		# The playback engine already continued with the next track, without a gap.
+		logging.info("Continued with the next track.")
+		with self.prefetch_lock:
+			self.current_sound = self.prefetch_sound
+			self.prefetch_sound = None  # Taken, so it must not be discarded along with the prefetch.
+			self.prefetch_path = None
+		self.playback_number = self.queued_number
+		self.queued_number = -1
+		playlist = kek.playlist.Playlist.get_instance().music
+		self.current_track = (self.current_track + 1) % len(playlist)
+		self.start_time = time.time()
+		self.current_track_changed.emit()
+		self.prefetch()
+
+	prefetch_done = PySide6.QtCore.Signal()
+	"""
+	Triggered when the next track is decoded in advance.
+	"""
+
+	@PySide6.QtCore.Slot()
+	def enqueue_prefetched(self) -> None:
+		"""
+		Queue the track that was decoded in advance to play right after the current track, if it's decoded already.
+
+		This keeps the audio stream running between the tracks, so that there is no gap between them.
+		"""
+		if self.current_sound is None or self.queued_number >= 0:
+			return  # Not playing, or already queued.
+		with self.prefetch_lock:
+			sound = self.prefetch_sound
+		if sound is not None:
+			self.queued_number = kek.music_playback.enqueue(sound)
 
 	current_track_changed = PySide6.QtCore.Signal()
 
@@ -89,11 +165,6 @@ class MusicPlayer(PySide6.QtCore.QObject):
 		if kek.music_playback.is_paused == new_is_paused:
 			return
 		logging.info(f"Toggling pause to: {new_is_paused}")
-		if new_is_paused:
-			self.song_end_timer.stop()
-		else:
-			self.song_end_timer.setInterval((self.current_duration_float - kek.music_playback.current_position) * 1000)
-			self.song_end_timer.start()
 		kek.music_playback.toggle_pause()
 		self.is_paused_changed.emit()
 
@@ -118,23 +189,153 @@ class MusicPlayer(PySide6.QtCore.QObject):
 
 		next_song = current_playlist[self.current_track]
 		logging.info(f"Starting playback of track: {next_song['path']}")
-		self.current_sound = kek.sound.Sound.decode(next_song["path"])
-		self.song_end_timer.setInterval(round(next_song["duration"] * 1000))
-		self.song_end_timer.start()
+		self.current_sound = self.take_prefetched(next_song["path"])
+		if self.current_sound is None:
+			self.current_sound = self.load_sound(next_song)
 		self.start_time = time.time()
-		kek.music_playback.play(self.current_sound)
+		self.playback_number = kek.music_playback.play(self.current_sound)
 		self.is_playing_changed.emit()
+		self.prefetch()
+
+	def load_sound(self, song: kek.music_metadata.Entry) -> kek.sound.Sound:
+		"""
+		Decode a track, or open it for streaming if it's long.
+		:param song: The metadata entry of the track to load.
+		:return: The audio of that track.
+		"""
+		if self.should_stream(song):
+			sound = kek.sound.StreamingSound(song["path"])
+			sound.frame_array(0, 1)  # Already decode the first window, so that playback can start right away.
+			return sound
+		return kek.sound_cache.get(song["path"])
+
+	def should_stream(self, song: kek.music_metadata.Entry) -> bool:
+		"""
+		Decide whether to stream a track while playing it, or to decode it entirely before playing it.
+
+		This is decided from the size that the track would have when decoded, before anything is decoded. The decoders
+		output a fixed format, regardless of the quality of the file: 16-bit samples, at 44.1kHz in stereo, or for Opus
+		at 48kHz with the channels of the file.
+		:param song: The metadata entry of the track.
+		:return: ``True`` if the track should be streamed, or ``False`` if it should be decoded entirely.
+		"""
+		if song.path.lower().endswith(".opus"):
+			frame_rate = 48000
+			channels = song.channels if song.channels > 0 else 2  # Unknown for metadata from before it was stored.
+		else:
+			frame_rate = 44100
+			channels = 2
+		return song.duration * frame_rate * channels * 2 > self.streaming_threshold
+
+	def prefetch(self) -> None:
+		"""
+		Start decoding the next track in the playlist in the background, and preparing its cover image.
+
+		If that track is already being decoded or has been decoded, this does nothing. If a different track was decoded
+		in advance, for instance because the playlist was changed, that result is discarded.
+		"""
+		playlist = kek.playlist.Playlist.get_instance().music
+		if self.current_sound is None or len(playlist) == 0:
+			self.cancel_prefetch()
+			return
+		next_song = playlist[(self.current_track + 1) % len(playlist)]
+		kek.cover_provider.prepare(next_song["cover"])
+		if next_song["path"] == self.prefetch_path:
+			self.enqueue_prefetched()  # Already prefetching this one. It may already be decoded.
+			return
+		self.cancel_prefetch()
+		logging.debug(f"Decoding next track in the background: {next_song['path']}")
+		self.prefetch_path = next_song["path"]
+		self.prefetch_cancelled = threading.Event()
+		threading.Thread(target=self.prefetch_run, args=(next_song, self.prefetch_cancelled), daemon=True).start()
+
+	def prefetch_run(self, song: kek.music_metadata.Entry, cancelled: threading.Event) -> None:
+		"""
+		Decode a track in advance.
+
+		The track is decoded outside of the sound cache, so that a cancelled prefetch doesn't take up space in it. Only
+		if the prefetch is still wanted when decoding completes, the result is added to the cache.
+
+		This should be run on a background thread.
+		:param song: The metadata entry of the track to decode.
+		:param cancelled: Set when this prefetch is cancelled. Decoding then stops, and the result is discarded.
+		"""
+		try:
+			if self.should_stream(song):
+				sound = self.load_sound(song)  # Only decodes the first window.
+				if cancelled.is_set():
+					sound.close()
+					return
+			else:
+				key = kek.sound_cache.cache_key(song.path)
+				sound = kek.sound_cache.find(key)
+				if sound is None:
+					sound = kek.sound.Sound.decode(song.path, cancelled)
+					if sound is None:
+						return  # Cancelled.
+					with self.prefetch_lock:
+						if cancelled.is_set():
+							return
+						kek.sound_cache.add(key, sound)
+		except Exception as e:
+			logging.warning(f"Unable to decode {song['path']} in advance: {e}")
+			return
+		with self.prefetch_lock:
+			if cancelled.is_set():
+				if isinstance(sound, kek.sound.StreamingSound):
+					sound.close()
+				return
+			self.prefetch_sound = sound
+		self.prefetch_done.emit()
+
+	def cancel_prefetch(self) -> None:
+		"""
+		Discard the track that was decoded in advance, if any.
+
+		If it is still being decoded, decoding stops and the result is discarded. If it was queued to play next, it is
+		taken out of the queue.
+		"""
+		if self.queued_number >= 0:
+			kek.music_playback.dequeue()
+			self.queued_number = -1
+		with self.prefetch_lock:
+			self.prefetch_cancelled.set()
+			self.prefetch_path = None
+			sound = self.prefetch_sound
+			self.prefetch_sound = None
+		if isinstance(sound, kek.sound.StreamingSound):  # Release its decoder. Decoded sounds are kept in the sound cache.
+			sound.close()
+
+	def take_prefetched(self, path: str) -> typing.Optional[kek.sound.Sound]:
+		"""
+		Get the audio of a track that was decoded in advance.
+
+		If that track is still being decoded, this doesn't wait for it. The prefetch is cancelled then, and the track
+		should be loaded normally instead.
+		:param path: The track to get the audio of.
+		:return: The audio of the track, or ``None`` if that track was not decoded in advance (yet).
+		"""
+		if path != self.prefetch_path:
+			return None
+		with self.prefetch_lock:
+			sound = self.prefetch_sound
+			self.prefetch_sound = None  # Taken, so it must not be discarded along with the prefetch.
+		self.cancel_prefetch()
+		if sound is None:
+			logging.debug(f"The next track was not decoded in advance yet. Decoding it now: {path}")
+		return sound
 
 	def stop(self) -> None:
 		"""
 		Stop playing any music.
 		"""
 		logging.info("Stopping playback.")
-		kek.music_playback.stop()
+		kek.music_playback.stop()  # This also takes the queued track out of the queue.
 		self.current_sound = None
 		self.start_time = None
+		self.playback_number = -1  # So that the end of the track that was playing is not reported any more.
+		self.queued_number = -1
 		self.is_playing_changed.emit()
-		self.song_end_timer.stop()
 
 	@PySide6.QtCore.Slot()
 	def play_next(self) -> None:
@@ -169,10 +370,6 @@ class MusicPlayer(PySide6.QtCore.QObject):
 		if not self.is_playing:
 			return
 		kek.music_playback.seek(fraction * self.current_duration_float)
-		if not self.is_paused:
-			self.song_end_timer.stop()
-			self.song_end_timer.setInterval((self.current_duration_float - kek.music_playback.current_position) * 1000)
-			self.song_end_timer.start()
 
 	def current_track_nr_set(self, new_current_track: int) -> None:
 		"""
@@ -207,18 +404,29 @@ class MusicPlayer(PySide6.QtCore.QObject):
 			return ""
 		return current_playlist[self.current_track]["title"]
 
+	@PySide6.QtCore.Property(int, constant=True)
+	def cover_size(self) -> int:
+		"""
+		Gives the size that cover images are shown at, in pixels.
+
+		The cover image provider prepares thumbnails at this size in advance, so the cover has to be shown at this size
+		to use them.
+		:return: The width and height of the cover image.
+		"""
+		return kek.cover_provider.thumbnail_size
+
 	@PySide6.QtCore.Property(str, notify=current_track_changed)
 	def current_cover(self) -> str:
 		"""
-		Gives the path to the cover image of the currently playing song.
+		Gives the URL to the cover image of the currently playing song.
 
 		If no song is currently playing, gives an empty string.
-		:return: A path to an image file.
+		:return: A URL to the cover image, scaled down by the cover image provider.
 		"""
 		current_playlist = kek.playlist.Playlist.get_instance().music
 		if self.current_track < 0 or self.current_track >= len(current_playlist):
 			return ""
-		return current_playlist[self.current_track]["cover"]
+		return kek.cover_provider.url(current_playlist[self.current_track]["cover"])
 
 	@PySide6.QtCore.Property(str, notify=current_track_changed)
 	def current_duration(self) -> str:
@@ -257,7 +465,7 @@ class MusicPlayer(PySide6.QtCore.QObject):
 		This does not have an automatic update mechanism since it continuously updates.
 		:return: The position in the current track where we are playing.
 		"""
-		seconds = round(kek.music_playback.current_position)
+		seconds = round(kek.music_playback.playhead())
 		return str(math.floor(seconds / 60)) + ":" + ("0" if (seconds % 60 < 10) else "") + str(seconds % 60)
 
 	@PySide6.QtCore.Slot(result=float)
@@ -268,4 +476,34 @@ class MusicPlayer(PySide6.QtCore.QObject):
 		This version does not format it. It returns a number for use of seeking.
 		:return: The position in the current track where we are playing.
 		"""
-		return kek.music_playback.current_position
\ No newline at end of file
+		return kek.music_playback.playhead()
+
+	@PySide6.QtCore.Slot(result=float)
+	def buffer_fill(self) -> float:
+		"""
+		Read how much audio is buffered for the audio device, in seconds.
+
+		This is for diagnosing dropouts in the audio.
+		:return: The amount of audio that is waiting to be played.
+		"""
+		return kek.music_playback.buffer_fill()
+
+	@PySide6.QtCore.Slot(result=float)
+	def output_latency(self) -> float:
+		"""
+		Read the latency of the audio device, in seconds.
+
+		This is for diagnosing dropouts in the audio.
+		:return: The time between audio being sent to the audio device and being heard.
+		"""
+		return kek.music_playback.latency
+
+	@PySide6.QtCore.Slot(result="QVariantMap")
+	def playback_stats(self) -> dict[str, typing.Any]:
+		"""
+		Read the statistics about the performance of the playback, such as the number of underruns.
+
+		This is for diagnosing dropouts in the audio.
+		:return: A dictionary of statistics, as given by ``kek.playback_stats.snapshot``.
+		"""
+		return kek.playback_stats.snapshot()
\ No newline at end of file
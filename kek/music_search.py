@@ -0,0 +1,192 @@
+# Desktop environment for a domotics hub.
+# Copyright (C) 2026 Ghostkeeper
+# This application is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# This application is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for details.
+# You should have received a copy of the GNU Affero General Public License along with this application. If not, see <https://gnu.org/licenses/>.
+
+"""
+Defines a Qt model that lists the music files matching a search query.
+"""
+
+import logging
+import math  # To format track duration.
+import PySide6.QtCore  # To expose this list to QML.
+import sqlite3  # To handle errors from the database.
+import threading  # To search in the background.
+import typing
+
+import kek.music_metadata  # To search through the metadata.
+
+
+class MusicSearch(PySide6.QtCore.QAbstractListModel):
+	"""
+	A list of the tracks of which the metadata matches a search query, best match first.
+
+	The search is performed on a background thread, so that typing the query doesn't get interrupted. If the query
+	changes while searching, only the results of the latest query are shown.
+	"""
+
+	limit = 100
+	"""
+	The maximum number of results to show.
+	"""
+
+	def __init__(self, parent: typing.Optional[PySide6.QtCore.QObject]=None) -> None:
+		"""
+		Construct a new search model.
+		:param parent: The parent element to this QML element, if any.
+		"""
+		super().__init__(parent)
+
+		user_role = PySide6.QtCore.Qt.UserRole
+		self.role_to_field = {
+			user_role + 1: "path",
+			user_role + 2: "title",
+			user_role + 3: "artist",
+			user_role + 4: "album",
+			user_role + 5: "duration",
+			user_role + 6: "cover",
+		}
+
+		self.music: list[kek.music_metadata.Entry] = []  # The search results currently shown.
+		self._query = ""
+		self.generation = 0  # Incremented for every new query, to recognise results of older queries.
+		self.pending: typing.Optional[tuple[int, str]] = None  # The query that the search thread should run next, with its generation.
+		self.pending_lock = threading.Lock()
+		self.search_requested = threading.Event()
+		self.search_thread: typing.Optional[threading.Thread] = None
+		self.results_ready.connect(self.on_results_ready)
+
+	results_ready = PySide6.QtCore.Signal(int, object)
+	"""
+	Emitted by the search thread when it found the results for a query.
+
+	It gets the generation of the query and the results.
+	"""
+
+	count_changed = PySide6.QtCore.Signal()
+
+	@PySide6.QtCore.Property(int, notify=count_changed)
+	def count(self) -> int:
+		"""
+		Returns the number of search results.
+		:return: The number of tracks that match the query.
+		"""
+		return len(self.music)
+
+	def rowCount(self, parent: typing.Optional[PySide6.QtCore.QModelIndex]=PySide6.QtCore.QModelIndex()) -> int:
+		"""
+		Returns the number of search results.
+		:param parent: The parent element to display the child entries under. This is a plain list, so no parent should
+		be provided.
+		:return: The number of tracks that match the query.
+		"""
+		if parent.isValid():
+			return 0
+		return len(self.music)
+
+	def columnCount(self, parent: typing.Optional[PySide6.QtCore.QModelIndex]=PySide6.QtCore.QModelIndex()) -> int:
+		"""
+		Returns the number of columns in this list, which is always 1.
+		:param parent: The parent element to display the child entries under. This is a plain list, so no parent should
+		be provided.
+		:return: The number of columns in the list.
+		"""
+		if parent.isValid():
+			return 0
+		return 1
+
+	def roleNames(self) -> dict[int, bytes]:
+		"""
+		Gets the names of the roles as exposed to QML.
+
+		This function is called internally by Qt to match a model field in the QML code with the roles in this model.
+		:return: A mapping of roles to field names. The field names are bytes.
+		"""
+		return {role: field.encode("utf-8") for role, field in self.role_to_field.items()}
+
+	def data(self, index: PySide6.QtCore.QModelIndex, role: int=PySide6.QtCore.Qt.DisplayRole) -> typing.Any:
+		"""
+		Returns one field of the data in the list.
+		:param index: The row and column index of the cell to give the data from.
+		:param role: Which data to return for this cell. Defaults to the data displayed, which is the only data we
+		store for a cell.
+		:return: The data contained in that cell, as a string.
+		"""
+		if not index.isValid():
+			return None  # Only valid indices return data.
+		if role not in self.role_to_field:
+			return None
+		field = self.role_to_field[role]
+		value = self.music[index.row()][field]
+		if field == "duration":
+			if value < 0:
+				return ""
+			seconds = round(value)
+			return str(math.floor(seconds / 60)) + ":" + ("0" if (seconds % 60 < 10) else "") + str(seconds % 60)
+		return str(value)  # Default, just convert to string.
+
+	def query_set(self, new_query: str) -> None:
+		"""
+		Change the search query, and start searching for it.
+		:param new_query: The words to search for.
+		"""
+		if new_query == self._query:  # Didn't actually change.
+			return
+		self._query = new_query
+		self.generation += 1
+		with self.pending_lock:
+			self.pending = (self.generation, new_query)
+		if self.search_thread is None:
+			self.search_thread = threading.Thread(target=self.search_loop, daemon=True)
+			self.search_thread.start()
+		self.search_requested.set()
+
+	@PySide6.QtCore.Property(str, fset=query_set)
+	def query(self) -> str:
+		"""
+		The words to search for.
+
+		Every word must occur in the title, artist, album or path of a track, or be the start of a word there.
+		:return: The current search query.
+		"""
+		return self._query
+
+	def search_loop(self) -> None:
+		"""
+		Main loop of the search thread.
+
+		Whenever the query changes, this runs the latest query and sends the results to the GUI thread. Queries that
+		were replaced before the thread got to them are skipped.
+		"""
+		while True:
+			self.search_requested.wait()
+			self.search_requested.clear()
+			with self.pending_lock:
+				pending = self.pending
+				self.pending = None
+			if pending is None:
+				continue
+			generation, query = pending
+			try:
+				results = kek.music_metadata.search(query, self.limit)
+			except sqlite3.Error as e:
+				logging.error(f"Unable to search for {query}: {e}")
+				results = []
+			self.results_ready.emit(generation, results)
+
+	@PySide6.QtCore.Slot(int, object)
+	def on_results_ready(self, generation: int, results: list[kek.music_metadata.Entry]) -> None:
+		"""
+		Show the results of a query.
+
+		This is called on the GUI thread. If the query has changed since, the results are discarded.
+		:param generation: The generation of the query that these are the results of.
+		:param results: The metadata entries of the matching tracks.
+		"""
+		if generation != self.generation:
+			return  # Outdated.
+		self.beginResetModel()
+		self.music = results
+		self.endResetModel()
+		self.count_changed.emit()
@@ -0,0 +1,79 @@
+# Desktop environment for a domotics hub.
+# Copyright (C) 2026 Ghostkeeper
+# This application is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# This application is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for details.
+# You should have received a copy of the GNU Affero General Public License along with this application. If not, see <https://gnu.org/licenses/>.
+
+"""
+Measures the performance of the playback engine, without needing an audio device.
+
+This decodes and plays music files through the whole playback pipeline, sending the audio to a null output or a WAV
+file. Run it from the root of the repository, for instance:
+
+```
+python -m kek.playback_benchmark --repeat 10 ~/Music/some_track.flac
+```
+"""
+
+import argparse  # To parse the command-line arguments.
+import logging
+import threading  # To wait for tracks to end.
+import time  # To measure how long things take.
+
+import kek.audio_output  # To send the audio somewhere without an audio device.
+import kek.music_playback  # The playback engine being measured.
+import kek.playback_stats  # To report the detailed measurements.
+import kek.sound  # To decode the music files.
+
+
+def main() -> None:
+	"""
+	Run the benchmark with the command-line arguments of the process.
+	"""
+	parser = argparse.ArgumentParser(description="Measure the performance of the playback engine without an audio device.")
+	parser.add_argument("files", nargs="+", help="The music files to play.")
+	parser.add_argument("--wav", help="Write the audio to this WAV file, instead of discarding it.")
+	parser.add_argument("--realtime", action="store_true", help="Consume the audio at the speed it would be played at, instead of as fast as possible.")
+	parser.add_argument("--stream", action="store_true", help="Decode the files while playing them, instead of decoding them completely first.")
+	parser.add_argument("--repeat", type=int, default=1, help="How many times to play all files, for soak testing.")
+	parser.add_argument("--format", nargs=3, type=int, metavar=("WIDTH", "RATE", "CHANNELS"), help="Convert all audio to this sample width, frame rate and number of channels.")
+	args = parser.parse_args()
+	logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(asctime)s | %(message)s")
+
+	if args.wav:
+		output = kek.audio_output.WaveFileOutput(args.wav, realtime=args.realtime)
+	else:
+		output = kek.audio_output.NullOutput(realtime=args.realtime)
+	if args.format:
+		kek.music_playback.output_format = tuple(args.format)
+	kek.music_playback.start(output)
+	ended = threading.Event()
+	kek.music_playback.on_track_ended = lambda number: ended.set()
+
+	total_audio = 0.0
+	total_time = 0.0
+	for _ in range(args.repeat):
+		for filepath in args.files:
+			decode_start = time.perf_counter()
+			if args.stream:
+				sound = kek.sound.StreamingSound(filepath)
+			else:
+				sound = kek.sound.Sound.decode(filepath)
+			decode_time = time.perf_counter() - decode_start
+
+			ended.clear()
+			play_start = time.perf_counter()
+			kek.music_playback.play(sound)
+			ended.wait()
+			play_time = time.perf_counter() - play_start
+
+			logging.info(f"{filepath}: Decoded in {decode_time:.3f}s. Played {sound.duration():.1f}s of audio in {play_time:.3f}s ({sound.duration() / play_time:.1f}x real time).")
+			total_audio += sound.duration()
+			total_time += decode_time + play_time
+	logging.info(f"Processed {total_audio:.1f}s of audio in {total_time:.3f}s ({total_audio / total_time:.1f}x real time).")
+	kek.playback_stats.log_summary()
+	output.close()  # The playback engine is idle now. Closing finishes the WAV file, if any.
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,244 @@
+# Desktop environment for a domotics hub.
+# Copyright (C) 2026 Ghostkeeper
+# This application is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# This application is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for details.
+# You should have received a copy of the GNU Affero General Public License along with this application. If not, see <https://gnu.org/licenses/>.
+
+"""
+Collects statistics about the performance of the playback engine, to diagnose dropouts in the audio.
+
+The playback engine records how long it takes to prepare and write every chunk of audio, how full the ring buffer is,
+how often the output ran out of audio, how often the audio device itself reported an underflow, and how long it takes
+to decode tracks. These can be queried with ``snapshot``, and are logged periodically while playing, so that dropouts
+can be correlated with other activity in the application.
+"""
+
+import bisect  # To find the bucket of a measurement in a histogram.
+import logging
+import threading  # Measurements may be recorded from multiple threads.
+import time  # To log the statistics periodically.
+import typing
+
+log_interval = 60.0
+"""
+How often to log a summary of the statistics while playing, in seconds.
+
+Set to 0 to disable logging the summary.
+"""
+
+
+class Histogram:
+	"""
+	The distribution of a series of measurements.
+
+	The measurements are counted in buckets, so that the memory use and the cost of recording a measurement don't grow
+	with the number of measurements. The percentiles are therefore approximations: the upper bound of the bucket that the
+	percentile falls in.
+	"""
+
+	def __init__(self, bounds: list[float]) -> None:
+		"""
+		Create an empty histogram.
+		:param bounds: The upper bounds of the buckets, in increasing order. Measurements beyond the last bound are counted
+		in an extra bucket.
+		"""
+		self.bounds = bounds
+		self.lock = threading.RLock()  # Re-entrant, so that the summary can compute percentiles while holding it.
+		self.reset()
+
+	def reset(self) -> None:
+		"""
+		Forget all measurements.
+		"""
+		with self.lock:
+			self.counts = [0] * (len(self.bounds) + 1)
+			self.count = 0
+			self.total = 0.0
+			self.maximum = 0.0
+
+	def add(self, value: float) -> None:
+		"""
+		Record a measurement.
+		:param value: The measured value.
+		"""
+		with self.lock:
+			self.counts[bisect.bisect_left(self.bounds, value)] += 1
+			self.count += 1
+			self.total += value
+			self.maximum = max(self.maximum, value)
+
+	def percentile(self, fraction: float) -> float:
+		"""
+		Get the value below which a certain fraction of the measurements fall.
+		:param fraction: The fraction of the measurements, between 0 and 1. For instance, 0.99 gives the 99th percentile.
+		:return: The upper bound of the bucket that the percentile falls in. For the last bucket, which has no upper bound,
+		this is the maximum measurement. If there are no measurements, this is 0.
+		"""
+		with self.lock:
+			if self.count == 0:
+				return 0.0
+			threshold = fraction * self.count
+			cumulative = 0
+			for bucket, count in enumerate(self.counts):
+				cumulative += count
+				if cumulative >= threshold and count > 0:
+					if bucket >= len(self.bounds):
+						return self.maximum
+					return min(self.bounds[bucket], self.maximum)
+			return self.maximum
+
+	def summary(self) -> dict[str, float]:
+		"""
+		Summarise the measurements.
+		:return: A dictionary with the number of measurements, and their mean, median, 99th percentile and maximum.
+		"""
+		with self.lock:  # So that all numbers are about the same measurements.
+			return {
+				"count": self.count,
+				"mean": self.total / self.count if self.count > 0 else 0.0,
+				"p50": self.percentile(0.5),
+				"p99": self.percentile(0.99),
+				"max": self.maximum,
+			}
+
+
+time_buckets = [0.00001 * 2 ** power for power in range(20)]
+"""
+The buckets for histograms of durations, in seconds.
+
+These double in size for every bucket, from 10µs up to about 5 seconds.
+"""
+
+slice_time = Histogram(time_buckets)
+"""
+How long it took to take every chunk of audio from the track, in seconds.
+
+This includes decoding the chunk for tracks that are streamed, and converting it if all audio is converted to the same
+format.
+"""
+
+write_time = Histogram(time_buckets)
+"""
+How long it took to write every chunk of audio into the ring buffer, in seconds.
+"""
+
+buffer_fill = Histogram([step / 10 for step in range(1, 11)])
+"""
+How full the ring buffer was before writing every chunk of audio, as a fraction of its capacity.
+"""
+
+decode_time = Histogram(time_buckets)
+"""
+How long it took to completely decode every track, in seconds.
+"""
+
+underruns = 0
+"""
+The number of times that the output needed audio while the ring buffer didn't have enough of it.
+
+Each of these is heard as a dropout in the audio. This is only counted while a track is playing, not when the ring
+buffer runs empty at the end of the track. It is only changed by the thread of the output.
+"""
+
+underrun_frames = 0
+"""
+The total number of frames of silence that the output got due to underruns.
+"""
+
+device_xruns = 0
+"""
+The number of times that the audio device reported that it ran out of audio, or got it too late.
+
+This can happen even if the ring buffer had enough audio, for instance if the thread of the audio device didn't get to
+run in time. It is only changed by the thread of the output.
+"""
+
+next_log_time = 0.0
+"""
+When the statistics should be logged next, according to the monotonic clock.
+"""
+
+
+def record_underrun(missing_frames: int) -> None:
+	"""
+	Record that the output needed more audio than the ring buffer had.
+	:param missing_frames: The number of frames that had to be filled with silence.
+	"""
+	global underruns
+	global underrun_frames
+	underruns += 1
+	underrun_frames += missing_frames
+
+
+def record_device_xrun() -> None:
+	"""
+	Record that the audio device reported an underflow or overflow of its own buffer.
+	"""
+	global device_xruns
+	device_xruns += 1
+
+
+def snapshot() -> dict[str, typing.Any]:
+	"""
+	Get the current statistics.
+	:return: A dictionary with a summary of each histogram, and the underrun and xrun counters.
+	"""
+	return {
+		"slice_time": slice_time.summary(),
+		"write_time": write_time.summary(),
+		"buffer_fill": buffer_fill.summary(),
+		"decode_time": decode_time.summary(),
+		"underruns": underruns,
+		"underrun_frames": underrun_frames,
+		"device_xruns": device_xruns,
+	}
+
+
+def reset() -> None:
+	"""
+	Forget all statistics recorded so far.
+	"""
+	global underruns
+	global underrun_frames
+	global device_xruns
+	slice_time.reset()
+	write_time.reset()
+	buffer_fill.reset()
+	decode_time.reset()
+	underruns = 0
+	underrun_frames = 0
+	device_xruns = 0
+
+
+def log_summary() -> None:
+	"""
+	Write a summary of the statistics to the log.
+	"""
+	stats = snapshot()
+	slice_stats = stats["slice_time"]
+	write_stats = stats["write_time"]
+	fill_stats = stats["buffer_fill"]
+	decode_stats = stats["decode_time"]
+	logging.info(
+		f"Playback statistics: {stats['underruns']} underruns ({stats['underrun_frames']} frames), {stats['device_xruns']} device xruns. "
+		f"Chunk slice time: mean {slice_stats['mean'] * 1000:.2f}ms, p99 {slice_stats['p99'] * 1000:.2f}ms, max {slice_stats['max'] * 1000:.2f}ms. "
+		f"Chunk write time: mean {write_stats['mean'] * 1000:.2f}ms, p99 {write_stats['p99'] * 1000:.2f}ms, max {write_stats['max'] * 1000:.2f}ms. "
+		f"Buffer fill: mean {fill_stats['mean']:.0%}, median {fill_stats['p50']:.0%}. "
+		f"Decoded {decode_stats['count']} tracks: mean {decode_stats['mean']:.3f}s, max {decode_stats['max']:.3f}s.")
+
+
+def log_periodically() -> None:
+	"""
+	Write a summary of the statistics to the log, if it's been long enough since the last summary.
+
+	This is called regularly by the playback thread while playing.
+	"""
+	global next_log_time
+	if log_interval <= 0:
+		return
+	now = time.monotonic()
+	if now < next_log_time:
+		return
+	if next_log_time > 0:  # Don't log right when starting to play, when there is nothing to report yet.
+		log_summary()
+	next_log_time = now + log_interval
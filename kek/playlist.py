@@ -17,6 +17,7 @@ import typing
 import kek.music_directory  # To add directories of music to the playlist.
 import kek.music_metadata  # To get metadata of music to add.
 import kek.music_player  # To notify the player if its current track changes.
+import kek.stat_cache  # To list directories quickly.
 
 
 class Playlist(PySide6.QtCore.QAbstractListModel):
@@ -56,7 +57,7 @@ class Playlist(PySide6.QtCore.QAbstractListModel):
 			user_role + 6: "cover",
 		}
 
-		self.music: list[dict[str, typing.Any]] = []  # The actual playlist, in order.
+		self.music: list[kek.music_metadata.Entry] = []  # The actual playlist, in order.
 
 	count_changed = PySide6.QtCore.Signal()
 
@@ -136,25 +137,20 @@ class Playlist(PySide6.QtCore.QAbstractListModel):
 		start of the playlist, and index len(self.music) means that it will get added to the end.
 		"""
 		logging.info(f"Adding {path} to the playlist at index {index}.")
-		if os.path.isdir(path):
-			entries = os.listdir(path)
-			entries = [os.path.join(path, entry) for entry in entries if not entry.endswith(".m3u")]
+		status = kek.stat_cache.stat(path)
+		if status is not None and status.is_dir:
+			entries = kek.stat_cache.list_directory(path)
+			entries = [entry.path for name, entry in entries.items() if not kek.music_metadata.is_playlist(name)]
 			entries = kek.music_directory.sort_directory(entries)
 			for entry in entries:
 				self.add(entry, index)
 				index += 1
-		elif path.endswith(".m3u"):
-			for line in open(path, "r").readlines():
-				line = line.strip()
-				if line.startswith("#"):
-					continue  # Comment line.
-				if os.path.isabs(line):
-					self.add(line, index)
-				else:
-					self.add(os.path.join(os.path.dirname(path), line), index)
+		elif kek.music_metadata.is_playlist(path):
+			for member in kek.music_metadata.playlist_members(path):
+				self.add(member, index)
 				index += 1
 		else:
-			extension = os.path.splitext(path)[-1]
+			extension = os.path.splitext(path)[-1].lower()
 			if extension not in kek.music_directory.supported_extensions:
 				return
 			meta = kek.music_metadata.get(path)
@@ -171,6 +167,7 @@ class Playlist(PySide6.QtCore.QAbstractListModel):
 			if index < player.current_track:  # Inserted before the current track.
 				player.current_track += 1
 				player.current_track_changed.emit()  # To update the highlighter in the playlist.
+			player.prefetch()  # The next track may have changed.
 
 	@PySide6.QtCore.Slot(int)
 	def remove(self, index: int) -> None:
@@ -191,6 +188,7 @@ class Playlist(PySide6.QtCore.QAbstractListModel):
 			player.stop()
 			player.play()
 			player.current_track_changed.emit()
+		player.prefetch()  # The next track may have changed.
 
 	@PySide6.QtCore.Slot()
 	def clear(self) -> None:
@@ -203,5 +201,6 @@ class Playlist(PySide6.QtCore.QAbstractListModel):
 		self.endRemoveRows()
 		player = kek.music_player.MusicPlayer.get_instance()
 		player.stop()
+		player.cancel_prefetch()
 		player.current_track = 0
 		player.current_track_changed.emit()
\ No newline at end of file
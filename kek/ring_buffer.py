@@ -0,0 +1,93 @@
+# Desktop environment for a domotics hub.
+# Copyright (C) 2026 Ghostkeeper
+# This application is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# This application is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for details.
+# You should have received a copy of the GNU Affero General Public License along with this application. If not, see <https://gnu.org/licenses/>.
+
+"""
+Defines a ring buffer to pass audio data from one thread to another without locking.
+"""
+
+import numpy  # To store the data in a preallocated buffer.
+
+
+class RingBuffer:
+	"""
+	A fixed-size buffer of bytes, which one thread writes into and another thread reads from.
+
+	This is safe without locking, as long as there is only one thread writing and only one thread reading. Each of the
+	positions is only ever changed by one of the threads, and only after the data itself has been written or read. The
+	positions count the total number of bytes ever written or read, so they only ever increase.
+	"""
+
+	def __init__(self, capacity: int) -> None:
+		"""
+		Allocate a new ring buffer.
+		:param capacity: The maximum number of bytes that can be in the buffer at once.
+		"""
+		self.buffer = numpy.zeros(capacity, dtype=numpy.uint8)
+		self.capacity = capacity
+		self.write_position = 0  # Total number of bytes written. Only changed by the writing thread.
+		self.read_position = 0  # Total number of bytes read. Only changed by the reading thread.
+		self.discard_position = 0  # The reader should skip everything before this position. Only changed by the writing thread.
+
+	def available(self) -> int:
+		"""
+		Get how many bytes are in the buffer, waiting to be read.
+		:return: The number of bytes that can be read.
+		"""
+		return max(0, self.write_position - max(self.read_position, self.discard_position))
+
+	def free(self) -> int:
+		"""
+		Get how many bytes can be written to the buffer.
+
+		If the reader hasn't caught up with data that was discarded yet, that data still takes up space.
+		:return: The number of bytes that can be written.
+		"""
+		return self.capacity - (self.write_position - self.read_position)
+
+	def write(self, data: memoryview) -> int:
+		"""
+		Write data to the buffer, as much as fits.
+
+		This must only be called from the writing thread.
+		:param data: The bytes to write.
+		:return: How many of those bytes were written.
+		"""
+		source = numpy.frombuffer(data, dtype=numpy.uint8)
+		length = min(len(source), self.free())
+		start = self.write_position % self.capacity
+		first_part = min(length, self.capacity - start)
+		self.buffer[start:start + first_part] = source[:first_part]
+		self.buffer[:length - first_part] = source[first_part:length]
+		self.write_position += length  # Only publish the new position after the data is in place.
+		return length
+
+	def discard(self) -> None:
+		"""
+		Discard everything in the buffer that hasn't been read yet.
+
+		This must only be called from the writing thread. The reader will skip the discarded data the next time it reads.
+		"""
+		self.discard_position = self.write_position
+
+	def read(self, length: int) -> bytes:
+		"""
+		Read data from the buffer, as much as is available up to a certain length.
+
+		This must only be called from the reading thread.
+		:param length: The maximum number of bytes to read.
+		:return: The bytes that were read.
+		"""
+		discard_position = self.discard_position
+		if discard_position > self.read_position:
+			self.read_position = discard_position
+		length = min(length, self.write_position - self.read_position)
+		start = self.read_position % self.capacity
+		first_part = min(length, self.capacity - start)
+		result = self.buffer[start:start + first_part].tobytes()
+		if first_part < length:  # Wrapped around the end of the buffer.
+			result += self.buffer[:length - first_part].tobytes()
+		self.read_position += length  # Only publish the new position after the data has been copied out.
+		return result
@@ -14,42 +14,82 @@ import miniaudio  # To decode wav, mp3, flac and ogg audio files.
 import numpy  # For fast operations on wave data.
 import os.path  # To decode audio files depending on file extension.
 import pyogg  # To decode opus audio files.
+import threading  # To protect the decoding window of streaming sounds.
+import time  # To measure how long decoding takes.
 import typing
 
+import kek.playback_stats  # To record how long decoding takes.
+
 class Sound:
 	"""
 	This class represents an audio segment.
 
 	It contains the raw audio data (samples), as well as some metadata on how to interpret it, such as frame rate.
+
+	The samples can optionally be stored interleaved, in one contiguous buffer of frames. In that case the channels are
+	views on that buffer. This allows sending parts of the sound to the audio device without re-arranging the samples.
 	"""
 
 	@classmethod
-	def decode(clscls, filepath: str) -> "Sound":
+	def decode(clscls, filepath: str, cancelled: typing.Optional[threading.Event]=None) -> typing.Optional["Sound"]:
 		"""
 		Decode an encoded sound file, loading it as a Sound instance.
 		:param filepath: The path to the file to load.
-		:return: A Sound containing the audio data from that file.
+		:param cancelled: If given, the file is decoded block by block, and decoding stops as soon as this event is set.
+		:return: A Sound containing the audio data from that file, or ``None`` if decoding was cancelled.
 		"""
 		logging.debug(f"Decoding file: {filepath}")
+		decode_start = time.perf_counter()
 		_, extension = os.path.splitext(filepath)
 		extension = extension.lower()
-		if extension in {".flac", ".mp3", ".ogg", ".wav"}:
+		if cancelled is not None:
+			stream = StreamingSound(filepath)  # Decodes to the same format as decoding the whole file at once.
+			stream.open(0)
+			blocks = []
+			try:
+				while not cancelled.is_set():
+					block = stream.read_block()
+					if block is None:
+						break
+					blocks.append(block)
+			finally:
+				stream.close()
+			if cancelled.is_set():
+				logging.debug(f"Decoding cancelled: {filepath}")
+				return None
+			frames = numpy.concatenate([stream.window] + blocks)
+			sample_rate = stream.frame_rate
+		elif extension in {".flac", ".mp3", ".ogg", ".wav"}:
 			decoded = miniaudio.decode_file(filepath)
 			samples = numpy.asarray(decoded.samples)
-			channels = [samples[channel_num::decoded.nchannels] for channel_num in range(decoded.nchannels)]
+			frames = samples.reshape(-1, decoded.nchannels)  # Miniaudio already gives us interleaved samples.
 			sample_rate = decoded.sample_rate
 		elif extension in {".opus"}:
 			opus_file = pyogg.OpusFile(filepath)
 			# PyOgg has an as_array method but it seems to have been removed from the latest release.
 			# So we re-implement it ourselves.
 			bytes_per_sample = ctypes.sizeof(pyogg.opus.opus_int16)
-			channels = numpy.ctypeslib.as_array(opus_file.buffer, (opus_file.buffer_length // bytes_per_sample // opus_file.channels, opus_file.channels))
-			channels = channels.transpose()
+			frames = numpy.ctypeslib.as_array(opus_file.buffer, (opus_file.buffer_length // bytes_per_sample // opus_file.channels, opus_file.channels))
 			sample_rate = opus_file.frequency
 		else:
 			raise ValueError(f"Trying to decode unsupported file extension {extension}.")
-		logging.debug(f"Decode complete! Channels: {len(channels)}, sample rate: {sample_rate}, num samples: {len(channels[0])}")
-		return Sound(channels, frame_rate=sample_rate)
+		decode_time = time.perf_counter() - decode_start
+		kek.playback_stats.decode_time.add(decode_time)
+		logging.debug(f"Decode complete in {decode_time:.3f}s! Channels: {frames.shape[1]}, sample rate: {sample_rate}, num samples: {frames.shape[0]}")
+		return Sound.from_frames(frames, frame_rate=sample_rate)
+
+	@classmethod
+	def from_frames(cls, frames: numpy.array, frame_rate: int=44100) -> "Sound":
+		"""
+		Construct a new audio clip from interleaved sample data.
+		:param frames: A two-dimensional array of audio samples. Each row is a frame, containing one sample for each
+		channel. The array must be contiguous.
+		:param frame_rate: The number of frames to play per second (Hz).
+		:return: A Sound that uses the given array as its sample data, without copying it.
+		"""
+		sound = Sound([frames[:, channel_num] for channel_num in range(frames.shape[1])], frame_rate=frame_rate)
+		sound.frames = frames
+		return sound
 
 	def __init__(self, channels: list[numpy.array], frame_rate: int=44100) -> None:
 		"""
@@ -61,6 +101,7 @@ class Sound:
 		"""
 		self.channels = channels
 		self.frame_rate = frame_rate
+		self.frames: typing.Optional[numpy.array] = None  # If the samples are stored interleaved, the contiguous array of frames.
 
 	def __getitem__(self, index: typing.Union[int, float, slice]) -> "Sound":
 		"""
@@ -99,6 +140,8 @@ class Sound:
 		# Convert to positions in the sample array.
 		start = round(start * self.frame_rate)
 		end = round(end * self.frame_rate)
+		if self.frames is not None:
+			return Sound.from_frames(self.frames[start:end], self.frame_rate)
 		clipped = [channel[start:end] for channel in self.channels]
 		return Sound(clipped, self.frame_rate)
 
@@ -107,4 +150,309 @@ class Sound:
 		Get the length of the sound, in seconds.
 		:return: How long it takes to play this sound.
 		"""
-		return len(self.channels[0]) / self.frame_rate
\ No newline at end of file
+		return len(self.channels[0]) / self.frame_rate
+
+	def frame_count(self) -> int:
+		"""
+		Get the length of the sound, in frames.
+		:return: The number of frames in this sound.
+		"""
+		return len(self.channels[0])
+
+	def num_channels(self) -> int:
+		"""
+		Get the number of channels in the sound.
+		:return: The number of channels.
+		"""
+		return len(self.channels)
+
+	def sample_width(self) -> int:
+		"""
+		Get the size of each sample in the sound.
+		:return: The number of bytes per sample.
+		"""
+		return self.channels[0].itemsize
+
+	def interleave(self) -> None:
+		"""
+		Make sure that the samples of this sound are stored interleaved, in one contiguous buffer of frames.
+
+		If they are not yet stored that way, this copies the samples once into such a buffer.
+		"""
+		if self.frames is not None:
+			return
+		self.frames = numpy.stack(self.channels, axis=1)
+		self.channels = [self.frames[:, channel_num] for channel_num in range(self.frames.shape[1])]
+
+	def frame_view(self, start: int, end: int) -> memoryview:
+		"""
+		Get the raw bytes of a range of frames, as they should be sent to the audio device.
+
+		The sound must be interleaved for this. The result refers to the sample data of this sound, without copying it.
+		:param start: The first frame to get.
+		:param end: The frame after the last frame to get.
+		:return: A view on the interleaved bytes of those frames.
+		"""
+		return memoryview(self.frame_array(start, end)).cast("B")
+
+	def frame_array(self, start: int, end: int) -> numpy.array:
+		"""
+		Get a range of frames, as a two-dimensional array.
+
+		The sound must be interleaved for this. The result refers to the sample data of this sound, without copying it.
+		:param start: The first frame to get.
+		:param end: The frame after the last frame to get.
+		:return: A view on those frames.
+		"""
+		return self.frames[start:end]
+
+class StreamingSound(Sound):
+	"""
+	An audio segment that gets decoded incrementally while it is being played, rather than all at once.
+
+	Only a window of audio around the part that was last requested is kept in memory. When a later part is requested,
+	the window moves along, decoding a bit ahead of the requested part and discarding what has already been played. This
+	keeps the time until the first audio can be played and the memory usage constant, regardless of the length of the
+	track.
+	"""
+
+	lookahead = 5.0
+	"""
+	How much audio to decode ahead of the requested part of the sound, in seconds.
+	"""
+
+	lookbehind = 1.0
+	"""
+	How much audio to keep in memory behind the requested part of the sound, in seconds.
+	"""
+
+	def __init__(self, filepath: str) -> None:
+		"""
+		Open an encoded sound file for streaming.
+
+		This doesn't decode any audio yet. The audio is decoded when parts of the sound are requested.
+		:param filepath: The path to the file to stream.
+		"""
+		logging.debug(f"Opening file for streaming: {filepath}")
+		self.filepath = filepath
+		_, extension = os.path.splitext(filepath)
+		self.extension = extension.lower()
+		if self.extension in {".flac", ".mp3", ".ogg", ".wav"}:
+			info = miniaudio.get_file_info(filepath)
+			# Miniaudio converts to 44.1kHz stereo by default, the same as when decoding the whole file.
+			num_channels = 2
+			frame_rate = 44100
+			self.total_frames = info.num_frames * frame_rate // info.sample_rate
+		elif self.extension in {".opus"}:
+			opus_file = pyogg.OpusFileStream(filepath)
+			num_channels = opus_file.channels
+			frame_rate = opus_file.frequency
+			self.total_frames = opus_file.pcm_size
+			opus_file.clean_up()
+		else:
+			raise ValueError(f"Trying to stream unsupported file extension {self.extension}.")
+		self.frame_rate = frame_rate
+
+		self.window = numpy.empty((0, num_channels), dtype=numpy.int16)  # The decoded frames currently in memory.
+		self.window_start = 0  # The frame number of the first frame in the window.
+		self.decoder = None  # The stream that decodes the file, positioned at the end of the window.
+		self.decoder_position = 0  # The frame number that the decoder will produce next.
+		self.lock = threading.Lock()  # Protects the window and decoder, in case they get requested from multiple threads.
+
+	@property
+	def channels(self) -> list[numpy.array]:
+		"""
+		Get the audio data of the part of the sound that is currently decoded, one array for each channel.
+		:return: The audio signal waveforms in the current decoding window.
+		"""
+		return [self.window[:, channel_num] for channel_num in range(self.window.shape[1])]
+
+	@property
+	def frames(self) -> numpy.array:
+		"""
+		Get the interleaved audio data of the part of the sound that is currently decoded.
+		:return: The frames in the current decoding window.
+		"""
+		return self.window
+
+	def __getitem__(self, index: typing.Union[int, float, slice]) -> Sound:
+		"""
+		Get a sub-segment of this sound.
+
+		This decodes that part of the sound, and a bit ahead of it, if it hasn't been decoded yet. The same rules apply
+		to the index as for regular sounds.
+		:param index: Either a single number to indicate a timestamp you want to access, or a slice to indicate a
+		range of time.
+		:return: A part of this sound, fully decoded.
+		"""
+		duration = self.duration()
+		start = 0.0
+		end = duration
+		if isinstance(index, slice):
+			if index.start:
+				start = index.start
+			if index.stop:
+				end = index.stop
+		else:
+			start = index
+			end = index + 1
+
+		# Negative indices indicate a duration from the end of the sound.
+		if start < 0:
+			start += duration
+		if end < 0:
+			end += duration
+		# Clamp to the range of duration of the sound.
+		start = max(0.0, min(duration, start))
+		end = max(0.0, min(duration, end))
+		# Convert to positions in the sample array.
+		start = round(start * self.frame_rate)
+		end = round(end * self.frame_rate)
+
+		return Sound.from_frames(self.frame_array(start, end), self.frame_rate)
+
+	def duration(self) -> float:
+		"""
+		Get the length of the sound, in seconds.
+
+		This is derived from the file header, so it is known before the sound is decoded.
+		:return: How long it takes to play this sound.
+		"""
+		return self.total_frames / self.frame_rate
+
+	def frame_count(self) -> int:
+		"""
+		Get the length of the sound, in frames.
+
+		This is derived from the file header, so it is known before the sound is decoded.
+		:return: The number of frames in this sound.
+		"""
+		return self.total_frames
+
+	def num_channels(self) -> int:
+		"""
+		Get the number of channels in the sound.
+		:return: The number of channels.
+		"""
+		return self.window.shape[1]
+
+	def sample_width(self) -> int:
+		"""
+		Get the size of each sample in the sound.
+		:return: The number of bytes per sample.
+		"""
+		return self.window.itemsize
+
+	def interleave(self) -> None:
+		"""
+		Streaming sounds are always stored interleaved, so this does nothing.
+		"""
+		pass
+
+	def frame_array(self, start: int, end: int) -> numpy.array:
+		"""
+		Get a range of frames from the decoding window.
+
+		This decodes that range, and a bit ahead of it, if it hasn't been decoded yet.
+		:param start: The first frame to get.
+		:param end: The frame after the last frame to get.
+		:return: A view on those frames in the decoding window.
+		"""
+		with self.lock:
+			self.fill(start, end)
+			end = min(end, self.total_frames)  # Decoding may have found that the sound is shorter than expected.
+			start = min(start, end)
+			return self.window[start - self.window_start:end - self.window_start]
+
+	def fill(self, start: int, end: int) -> None:
+		"""
+		Make sure that the frames in a certain range are in the decoding window.
+
+		If the range is outside of the current window, the decoder seeks to the start of the range. Then the decoder
+		decodes up to a bit beyond the end of the range, and the part of the window that has already been played is
+		dropped.
+
+		The lock must be held while calling this function.
+		:param start: The first frame that must be decoded.
+		:param end: The frame after the last frame that must be decoded.
+		"""
+		lookahead_frames = round(self.lookahead * self.frame_rate)
+		if self.decoder is None or start < self.window_start or start > self.decoder_position + lookahead_frames:
+			self.open(start)  # Seeking, or starting to play.
+		if self.decoder_position >= min(end + lookahead_frames // 2, self.total_frames):
+			return  # Still have enough audio decoded ahead. Don't need to decode more yet.
+
+		target = min(end + lookahead_frames, self.total_frames)
+		blocks = []
+		while self.decoder_position < target:
+			block = self.read_block()
+			if block is None:  # The file turned out to be shorter than the header indicated.
+				self.total_frames = self.decoder_position
+				break
+			blocks.append(block)
+			self.decoder_position += len(block)
+		keep_from = max(self.window_start, start - round(self.lookbehind * self.frame_rate))
+		self.window = numpy.concatenate([self.window] + blocks)[keep_from - self.window_start:]
+		self.window_start = keep_from
+
+	def open(self, start: int) -> None:
+		"""
+		(Re)open the decoder for this sound, starting at a certain frame.
+
+		This clears the decoding window. The lock must be held while calling this function.
+		:param start: The frame to start decoding from.
+		"""
+		self.release()
+		if self.extension in {".flac", ".mp3", ".ogg", ".wav"}:
+			self.decoder = miniaudio.stream_file(self.filepath, frames_to_read=16384, seek_frame=start)
+		else:  # Opus.
+			self.decoder = pyogg.OpusFileStream(self.filepath)
+			pyogg.opus.op_pcm_seek(self.decoder.of, start)
+		self.window = self.window[0:0]
+		self.window_start = start
+		self.decoder_position = start
+
+	def read_block(self) -> typing.Optional[numpy.array]:
+		"""
+		Decode the next block of audio from the decoder.
+		:return: An array of frames, each containing one sample per channel, or ``None`` if the decoder reached the end
+		of the file.
+		"""
+		num_channels = self.window.shape[1]
+		if self.extension in {".flac", ".mp3", ".ogg", ".wav"}:
+			samples = next(self.decoder, None)
+			if samples is None or len(samples) == 0:
+				return None
+			return numpy.asarray(samples).reshape(-1, num_channels)
+		else:  # Opus.
+			buffer = self.decoder.get_buffer()
+			if buffer is None:
+				return None
+			buffer, buffer_length = buffer
+			bytes_per_sample = ctypes.sizeof(pyogg.opus.opus_int16)
+			samples = numpy.ctypeslib.as_array(buffer.contents)[:buffer_length // bytes_per_sample]
+			return samples.reshape(-1, num_channels).copy()  # Copy, so that we don't keep referencing the ctypes buffer.
+
+	def close(self) -> None:
+		"""
+		Release the decoder, if any.
+
+		This may be called while another thread is reading from this sound. If the sound is read again afterwards, the
+		decoder is opened again.
+		"""
+		with self.lock:
+			self.release()
+
+	def release(self) -> None:
+		"""
+		Release the decoder, if any.
+
+		The lock must be held while calling this function.
+		"""
+		if self.decoder is None:
+			return
+		if self.extension in {".flac", ".mp3", ".ogg", ".wav"}:
+			self.decoder.close()
+		elif hasattr(self.decoder, "ptr"):  # PyOgg cleans up by itself when it reaches the end of the file.
+			self.decoder.clean_up()
+		self.decoder = None
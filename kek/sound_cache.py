@@ -0,0 +1,289 @@
+# Desktop environment for a domotics hub.
+# Copyright (C) 2026 Ghostkeeper
+# This application is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# This application is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for details.
+# You should have received a copy of the GNU Affero General Public License along with this application. If not, see <https://gnu.org/licenses/>.
+
+"""
+A cache of decoded audio, so that tracks that were played recently don't need to be decoded again.
+
+The cache has two tiers. The most recently used sounds are kept in memory. When those exceed the memory budget, the
+least recently used ones are spilled to disk as raw sample arrays, which can be memory-mapped again quickly. Spilling
+happens on a background thread, so that it doesn't delay playing the next track. When the files on disk exceed the disk
+budget, the least recently used files are deleted.
+"""
+
+import collections  # For the least-recently-used ordering of the cache.
+import concurrent.futures  # To spill sounds to disk in the background.
+import hashlib  # To create file names for the cache files.
+import logging
+import numpy  # To store and memory-map the sample data.
+import os  # To find and delete cache files.
+import os.path  # To find the cache files.
+import threading  # The cache may be accessed from multiple threads.
+import typing
+
+import kek.sound  # To decode sounds that are not in the cache.
+import kek.storage  # To find where to store the cache files.
+
+memory_budget = 512 * 1024 * 1024
+"""
+The maximum number of bytes of sample data to keep in memory.
+"""
+
+memory_cache_size = 64
+"""
+The maximum number of sounds to keep in the memory cache.
+
+Sounds that are memory-mapped from the disk cache don't count towards the memory budget, but each of them still keeps
+a file open and a mapping in the address space. This limits how many of those there can be.
+"""
+
+disk_budget = 4 * 1024 * 1024 * 1024
+"""
+The maximum number of bytes of sample data to keep on disk.
+"""
+
+memory_cache: collections.OrderedDict[str, "kek.sound.Sound"] = collections.OrderedDict()
+"""
+The sounds kept in memory, by their cache key. The least recently used sound is at the start.
+"""
+
+memory_size = 0
+"""
+The total number of bytes of sample data in the memory cache.
+
+Sounds that are memory-mapped from the disk cache are not counted, since their samples are not kept in memory.
+"""
+
+spilling: dict[str, "kek.sound.Sound"] = {}
+"""
+The sounds that were evicted from the memory cache, but are not written to the disk cache yet, by their cache key.
+
+Until they are written, they can still be taken from here.
+"""
+
+spill_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+"""
+Writes evicted sounds to the disk cache in the background, one at a time.
+"""
+
+disk_cache: collections.OrderedDict[str, tuple[str, int]] = collections.OrderedDict()
+"""
+The sounds stored on disk, by their cache key. Each entry holds the path to the cache file and its size in bytes. The
+least recently used file is at the start.
+"""
+
+disk_size = 0
+"""
+The total number of bytes of the cache files on disk.
+"""
+
+disk_cache_loaded = False
+"""
+Whether the index of cache files on disk has been read yet.
+"""
+
+cache_lock = threading.Lock()
+"""
+While the cache is modified or iterated over, this lock has to be obtained.
+"""
+
+
+def cache_directory() -> str:
+	"""
+	Get the directory where the decoded sounds are stored on disk.
+	:return: A path to a directory.
+	"""
+	return os.path.join(kek.storage.cache(), "sounds")
+
+
+def cache_key(path: str) -> str:
+	"""
+	Get the key under which the decoded audio of a file would be cached.
+
+	The key changes when the file is modified, so that outdated audio is never used.
+	:param path: The path to the encoded audio file.
+	:return: A key that identifies this version of the file.
+	"""
+	stat = os.stat(path)
+	return hashlib.sha1(f"{path}\0{stat.st_mtime}\0{stat.st_size}".encode("utf-8")).hexdigest()
+
+
+def sound_size(sound: "kek.sound.Sound") -> int:
+	"""
+	Get the number of bytes of sample data that a sound keeps in memory.
+	:param sound: The sound to measure.
+	:return: The size of the sample data in bytes. For sounds that are memory-mapped from a file, this is 0.
+	"""
+	return sum(channel.nbytes for channel in sound.channels if not isinstance(channel, numpy.memmap))
+
+
+def load_disk_cache() -> None:
+	"""
+	Read which sounds are stored in the cache directory on disk.
+
+	The order of use is restored from the modification times of the files, which get updated whenever a file is used.
+	Temporary files of sounds that were not completely spilled to disk, for instance because the application was closed
+	meanwhile, are deleted.
+
+	The cache lock must be held while calling this function.
+	"""
+	global disk_cache_loaded
+	global disk_size
+	if disk_cache_loaded:
+		return
+	disk_cache_loaded = True
+	directory = cache_directory()
+	if not os.path.exists(directory):
+		return
+	files = []
+	for filename in os.listdir(directory):
+		filepath = os.path.join(directory, filename)
+		if filename.endswith(".npy.tmp") and filename.split("-")[0] not in spilling:  # Not being written right now.
+			logging.debug(f"Removing incomplete file from disk cache: {filepath}")
+			try:
+				os.remove(filepath)
+			except OSError as e:
+				logging.warning(f"Unable to remove {filepath} from disk cache: {e}")
+			continue
+		if not filename.endswith(".npy"):
+			continue
+		stat = os.stat(filepath)
+		files.append((stat.st_mtime, filename.split("-")[0], filepath, stat.st_size))
+	for _, key, filepath, size in sorted(files):
+		disk_cache[key] = (filepath, size)
+		disk_size += size
+	logging.debug(f"Found {len(disk_cache)} decoded sounds in the disk cache, totalling {disk_size} bytes.")
+
+
+def get(path: str) -> "kek.sound.Sound":
+	"""
+	Get the decoded audio of a file.
+
+	If the audio is in the cache, it is taken from there. Otherwise the file is decoded and the result is stored in the
+	cache.
+	:param path: The path to the encoded audio file.
+	:return: A Sound containing the audio data from that file.
+	"""
+	key = cache_key(path)
+	sound = find(key)
+	if sound is None:
+		sound = kek.sound.Sound.decode(path)
+		add(key, sound)
+	return sound
+
+
+def find(key: str) -> typing.Optional["kek.sound.Sound"]:
+	"""
+	Get decoded audio from the cache, without decoding it if it's not there.
+
+	Audio taken from the disk cache is added to the memory cache again.
+	:param key: The cache key of the sound, see ``cache_key``.
+	:return: The decoded audio, or ``None`` if it's not in the cache.
+	"""
+	with cache_lock:
+		if key in memory_cache:
+			logging.debug(f"Taking decoded audio {key} from memory cache.")
+			memory_cache.move_to_end(key)
+			return memory_cache[key]
+		sound = spilling.get(key)
+	if sound is not None:
+		logging.debug(f"Taking decoded audio {key} from the sounds being spilled to disk.")
+		add(key, sound)
+		return sound
+
+	with cache_lock:
+		load_disk_cache()
+		disk_entry = disk_cache.get(key)
+		if disk_entry is None:
+			return None
+		disk_cache.move_to_end(key)
+	logging.debug(f"Taking decoded audio {key} from disk cache.")
+	try:
+		sound = load(disk_entry[0])
+	except (OSError, ValueError) as e:
+		logging.warning(f"Unable to read decoded audio from {disk_entry[0]}: {e}")
+		return None
+	add(key, sound)
+	return sound
+
+
+def add(key: str, sound: "kek.sound.Sound") -> None:
+	"""
+	Add a sound to the memory cache.
+
+	If this makes the memory cache exceed its budget or its maximum number of sounds, the least recently used sounds are
+	spilled to disk in the background.
+	:param key: The cache key of the sound.
+	:param sound: The decoded audio to store.
+	"""
+	global memory_size
+	with cache_lock:
+		if key in memory_cache:
+			return
+		memory_cache[key] = sound
+		memory_size += sound_size(sound)
+		while (memory_size > memory_budget or len(memory_cache) > memory_cache_size) and len(memory_cache) > 1:
+			old_key, old_sound = memory_cache.popitem(last=False)
+			memory_size -= sound_size(old_sound)
+			if old_key not in disk_cache and old_key not in spilling:
+				spilling[old_key] = old_sound
+				spill_executor.submit(spill, old_key, old_sound)
+
+
+def spill(key: str, sound: "kek.sound.Sound") -> None:
+	"""
+	Store a sound in the disk cache.
+
+	If this makes the disk cache exceed its budget, the least recently used files are deleted.
+
+	This is called on the spilling thread. The sound may still be playing meanwhile, so it is not modified.
+	:param key: The cache key of the sound.
+	:param sound: The decoded audio to store.
+	"""
+	global disk_size
+	filepath = os.path.join(cache_directory(), f"{key}-{sound.frame_rate}.npy")
+	logging.debug(f"Spilling decoded audio to disk cache: {filepath}")
+	frames = sound.frames if sound.frames is not None else numpy.stack(sound.channels, axis=1)
+	try:
+		with open(filepath + ".tmp", "wb") as f:
+			numpy.save(f, frames)
+		os.replace(filepath + ".tmp", filepath)
+	except OSError as e:
+		logging.warning(f"Unable to store decoded audio in {filepath}: {e}")
+		try:
+			os.remove(filepath + ".tmp")
+		except OSError:
+			pass  # Was never created.
+		with cache_lock:
+			spilling.pop(key, None)
+		return
+
+	deleted = []
+	with cache_lock:
+		spilling.pop(key, None)
+		disk_cache[key] = (filepath, frames.nbytes)
+		disk_size += frames.nbytes
+		while disk_size > disk_budget and len(disk_cache) > 1:
+			_, (old_filepath, old_size) = disk_cache.popitem(last=False)
+			disk_size -= old_size
+			deleted.append(old_filepath)
+	for old_filepath in deleted:
+		logging.debug(f"Removing decoded audio from disk cache: {old_filepath}")
+		try:
+			os.remove(old_filepath)
+		except OSError as e:
+			logging.warning(f"Unable to remove {old_filepath} from disk cache: {e}")
+
+
+def load(filepath: str) -> "kek.sound.Sound":
+	"""
+	Memory-map a sound from the disk cache.
+	:param filepath: The path to the cache file.
+	:return: The sound stored in that file.
+	"""
+	frames = numpy.load(filepath, mmap_mode="r")
+	os.utime(filepath)  # Mark this file as recently used, for when the index is read again in a next session.
+	frame_rate = int(os.path.splitext(os.path.basename(filepath))[0].split("-")[1])
+	return kek.sound.Sound.from_frames(frames, frame_rate=frame_rate)
@@ -0,0 +1,180 @@
+# Desktop environment for a domotics hub.
+# Copyright (C) 2026 Ghostkeeper
+# This application is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# This application is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for details.
+# You should have received a copy of the GNU Affero General Public License along with this application. If not, see <https://gnu.org/licenses/>.
+
+"""
+Lists directories and caches the status of the files in them, so that each file only needs to be inspected once.
+
+Each directory is listed completely at once, inspecting every entry once. The listing is kept until the directory is
+modified (which happens when files are added, removed or renamed in it), or until it gets too old. Files that are
+modified in place don't modify the directory, so the status of a single file is checked again when it's looked up after
+a while. If the file was modified, the directory is listed anew.
+"""
+
+import collections  # For the least-recently-used ordering of the cache.
+import os  # To list directories.
+import os.path  # To find the directory that a file is in.
+import threading  # The cache may be accessed from multiple threads.
+import time  # To expire old listings.
+import typing
+
+
+class Entry(typing.NamedTuple):
+	"""
+	The status of a file or directory, at the time its directory was listed.
+	"""
+
+	path: str
+	"""
+	The path to the file or directory.
+	"""
+
+	is_dir: bool
+	"""
+	Whether this is a directory (or a link to one).
+	"""
+
+	is_file: bool
+	"""
+	Whether this is a regular file (or a link to one).
+	"""
+
+	size: int
+	"""
+	The size of the file, in bytes.
+	"""
+
+	mtime: float
+	"""
+	The time when the file was last modified, in seconds since the epoch.
+	"""
+
+	inode: int
+	"""
+	The inode number of the file, which identifies it on its file system.
+	"""
+
+
+check_interval = 1.0
+"""
+How long a listing is used without checking whether the directory was modified, in seconds.
+
+This prevents inspecting the directory again for every file that is looked up in it.
+"""
+
+max_age = 60.0
+"""
+How long a listing may be used at most, in seconds, even if the directory was not modified.
+"""
+
+cache_size = 1000
+"""
+The maximum number of directory listings to keep in memory.
+"""
+
+listings: collections.OrderedDict[str, list] = collections.OrderedDict()
+"""
+The cached directory listings, by the path to the directory.
+
+Each listing holds the modification time of the directory when it was listed (in nanoseconds), the time when it was
+listed and the time when it was last checked to be up to date (both according to the monotonic clock), the entries in
+the directory by their file name, and the times when single entries were last checked to be up to date by their file
+name. The least recently used listings come first.
+"""
+
+cache_lock = threading.Lock()
+"""
+While the cache is modified, this lock has to be obtained.
+"""
+
+
+def list_directory(directory: str) -> dict[str, Entry]:
+	"""
+	Get the entries in a directory.
+
+	If the directory was listed before and hasn't been modified since, this only inspects the directory itself. If it
+	was listed or checked very recently, it isn't even inspected.
+	:param directory: The path to the directory to list.
+	:return: The entries in the directory, by their file names, in arbitrary order. This must not be modified.
+	"""
+	now = time.monotonic()
+	with cache_lock:
+		listing = listings.get(directory)
+		if listing is not None and now - listing[2] < check_interval:
+			listings.move_to_end(directory)
+			return listing[3]
+	directory_mtime = os.stat(directory).st_mtime_ns
+	with cache_lock:
+		listing = listings.get(directory)
+		if listing is not None and listing[0] == directory_mtime and now - listing[1] < max_age:
+			listing[2] = now
+			listings.move_to_end(directory)
+			return listing[3]
+
+	entries = {}
+	with os.scandir(directory) as scanner:
+		for dir_entry in scanner:
+			try:
+				status = dir_entry.stat()  # Follows links, like os.path.isfile and os.path.getmtime do.
+			except OSError:
+				continue  # Removed in the meanwhile, or a broken link.
+			is_dir = dir_entry.is_dir()
+			entries[dir_entry.name] = Entry(dir_entry.path, is_dir, not is_dir and dir_entry.is_file(), status.st_size, status.st_mtime, status.st_ino)
+
+	with cache_lock:
+		listings[directory] = [directory_mtime, now, now, entries, {}]
+		listings.move_to_end(directory)
+		while len(listings) > cache_size:
+			listings.popitem(last=False)
+	return entries
+
+
+def stat(path: str) -> typing.Optional[Entry]:
+	"""
+	Get the status of a file or directory.
+
+	This lists the directory that it's in, so that the other files in the same directory are cached too. If the status
+	was not checked recently, the file itself is inspected, to find out whether it was modified in place.
+	:param path: The path to the file or directory.
+	:return: The status of the file or directory, or ``None`` if it doesn't exist.
+	"""
+	path = os.path.normpath(path)  # Otherwise a trailing slash or a double separator would give the wrong directory.
+	directory, name = os.path.split(path)
+	if directory == "":
+		directory = "."
+	try:
+		entry = list_directory(directory).get(name)
+	except OSError:  # The directory doesn't exist (any more).
+		return None
+	if entry is None:
+		return None
+
+	now = time.monotonic()
+	with cache_lock:
+		listing = listings.get(directory)
+		if listing is None or now - listing[4].get(name, listing[1]) < check_interval:
+			return entry  # Listed or checked recently.
+		listing[4][name] = now
+	try:
+		status = os.stat(path)
+	except OSError:  # Removed in the meanwhile.
+		invalidate(directory)
+		return None
+	if status.st_mtime == entry.mtime and status.st_size == entry.size and status.st_ino == entry.inode:
+		return entry
+	invalidate(directory)  # Modified in place.
+	try:
+		return list_directory(directory).get(name)
+	except OSError:
+		return None
+
+
+def invalidate(directory: str) -> None:
+	"""
+	Forget the listing of a directory, so that it gets listed anew the next time it's needed.
+	:param directory: The path to the directory that changed.
+	"""
+	with cache_lock:
+		listings.pop(directory, None)
@@ -53,4 +53,8 @@ def ensure_exists() -> None:
 		os.makedirs(cache_path)
 		covers_dir = os.path.join(cache_path, "covers")
 		if not os.path.exists(covers_dir):
-			os.makedirs(covers_dir)
\ No newline at end of file
+			os.makedirs(covers_dir)
+	sounds_dir = os.path.join(cache_path, "sounds")
+	if not os.path.exists(sounds_dir):
+		logging.info(f"Creating decoded sound cache directory in {sounds_dir}")
+		os.makedirs(sounds_dir)
\ No newline at end of file
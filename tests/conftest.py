@@ -0,0 +1,14 @@
+# Desktop environment for a domotics hub.
+# Copyright (C) 2026 Ghostkeeper
+# This application is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# This application is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for details.
+# You should have received a copy of the GNU Affero General Public License along with this application. If not, see <https://gnu.org/licenses/>.
+
+"""
+Makes the application importable from the tests, wherever pytest is started from.
+"""
+
+import os.path  # To find the source code of the application.
+import sys  # To add the source code of the application to the import path.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
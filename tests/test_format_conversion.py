@@ -0,0 +1,157 @@
+# Desktop environment for a domotics hub.
+# Copyright (C) 2026 Ghostkeeper
+# This application is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# This application is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for details.
+# You should have received a copy of the GNU Affero General Public License along with this application. If not, see <https://gnu.org/licenses/>.
+
+"""
+Tests the conversion of audio to the format that the audio device wants.
+"""
+
+import math  # To calculate the expected number of output frames.
+import numpy  # To create audio to convert.
+import pytest  # To test with multiple formats.
+
+import kek.format_conversion  # The module being tested.
+
+
+def sine(frame_count: int, frame_rate: int, channels: int) -> numpy.array:
+	"""
+	Create a 16-bit sine wave of 440Hz to convert.
+	:param frame_count: The number of frames to create.
+	:param frame_rate: The frame rate of the audio (Hz).
+	:param channels: The number of channels, which all get the same wave.
+	:return: A two-dimensional array of frames.
+	"""
+	wave = numpy.sin(numpy.arange(frame_count) * 2 * math.pi * 440 / frame_rate) * 20000
+	return numpy.repeat(wave.astype(numpy.int16)[:, numpy.newaxis], channels, axis=1)
+
+
+def test_same_format() -> None:
+	"""
+	Tests that audio that is already in the right format comes out unchanged.
+	"""
+	frames = sine(1000, 44100, 2)
+	converter = kek.format_conversion.FormatConverter(44100, 2, 2, 44100, 2)
+	result = numpy.concatenate((converter.convert(frames), converter.flush()))
+	assert result.dtype == numpy.int16
+	numpy.testing.assert_array_equal(result, frames)
+
+
+def test_sample_width() -> None:
+	"""
+	Tests converting 16-bit samples to 32-bit samples.
+	"""
+	frames = numpy.array([[0, 1], [-32768, 32767]], dtype=numpy.int16)
+	converter = kek.format_conversion.FormatConverter(44100, 2, 4, 44100, 2)
+	result = converter.convert(frames)
+	assert result.dtype == numpy.int32
+	numpy.testing.assert_array_equal(result, frames.astype(numpy.int64) * 65536)
+
+
+def test_channel_mix() -> None:
+	"""
+	Tests that stereo becomes mono by averaging, and mono becomes stereo by repeating.
+	"""
+	stereo = numpy.array([[1000, 3000], [-2000, 2000]], dtype=numpy.int16)
+	to_mono = kek.format_conversion.FormatConverter(44100, 2, 2, 44100, 1)
+	numpy.testing.assert_array_equal(to_mono.convert(stereo), [[2000], [0]])
+
+	mono = numpy.array([[1000], [-2000]], dtype=numpy.int16)
+	to_stereo = kek.format_conversion.FormatConverter(44100, 1, 2, 44100, 2)
+	numpy.testing.assert_array_equal(to_stereo.convert(mono), [[1000, 1000], [-2000, -2000]])
+
+
+@pytest.mark.parametrize("in_rate, out_rate", [(44100, 48000), (48000, 44100), (22050, 44100), (44100, 32000)])
+@pytest.mark.parametrize("chunk_size", [3, 441, 1000, 44100])
+def test_resample_length(in_rate: int, out_rate: int, chunk_size: int) -> None:
+	"""
+	Tests that after flushing, the output has exactly as many frames as fit in the duration of the input.
+	:param in_rate: The frame rate of the input audio.
+	:param out_rate: The frame rate of the output audio.
+	:param chunk_size: How many frames to convert at a time.
+	"""
+	frame_count = 44100
+	frames = sine(frame_count, in_rate, 2)
+	converter = kek.format_conversion.FormatConverter(in_rate, 2, 2, out_rate, 2)
+	chunks = [converter.convert(frames[start:start + chunk_size]) for start in range(0, frame_count, chunk_size)]
+	chunks.append(converter.flush())
+	assert sum(len(chunk) for chunk in chunks) == math.ceil(frame_count * out_rate / in_rate)
+
+
+def test_resample_chunks_connect() -> None:
+	"""
+	Tests that converting in chunks gives the same result as converting everything at once.
+	"""
+	frames = sine(10000, 44100, 2)
+	whole = kek.format_conversion.FormatConverter(44100, 2, 2, 48000, 2)
+	expected = numpy.concatenate((whole.convert(frames), whole.flush()))
+	chunked = kek.format_conversion.FormatConverter(44100, 2, 2, 48000, 2)
+	result = numpy.concatenate([chunked.convert(frames[start:start + 123]) for start in range(0, len(frames), 123)] + [chunked.flush()])
+	numpy.testing.assert_allclose(result, expected, atol=1)  # Rounding errors in the phase may shift a sample slightly.
+
+
+def test_resample_wave() -> None:
+	"""
+	Tests that a resampled sine wave is still the same sine wave, at the new frame rate.
+	"""
+	frames = sine(4410, 44100, 1)
+	converter = kek.format_conversion.FormatConverter(44100, 1, 2, 48000, 1)
+	result = converter.convert(frames)
+	expected = sine(len(result), 48000, 1)
+	numpy.testing.assert_allclose(result, expected, atol=300)  # Linear interpolation isn't exact.
+
+
+def test_reset() -> None:
+	"""
+	Tests that after a reset, the converter doesn't interpolate with audio from before the reset.
+	"""
+	converter = kek.format_conversion.FormatConverter(44100, 1, 2, 48000, 1)
+	converter.convert(numpy.full((100, 1), 10000, dtype=numpy.int16))
+	converter.reset()
+	assert len(converter.flush()) == 0
+	result = converter.convert(numpy.zeros((100, 1), dtype=numpy.int16))
+	assert numpy.all(result == 0)
+
+
+def tone(frequency: float, frame_count: int, frame_rate: int) -> numpy.array:
+	"""
+	Create a mono 16-bit sine wave.
+	:param frequency: The frequency of the wave (Hz).
+	:param frame_count: The number of frames to create.
+	:param frame_rate: The frame rate of the audio (Hz).
+	:return: A two-dimensional array of frames.
+	"""
+	wave = numpy.sin(numpy.arange(frame_count) * 2 * math.pi * frequency / frame_rate) * 20000
+	return wave.astype(numpy.int16)[:, numpy.newaxis]
+
+
+@pytest.mark.parametrize("in_rate, out_rate", [(96000, 48000), (88200, 44100), (96000, 44100)])
+def test_downsample_anti_alias(in_rate: int, out_rate: int) -> None:
+	"""
+	Tests that frequencies above the Nyquist frequency of the output are removed when downsampling, rather than aliased
+	into the audible band, while audible frequencies are kept.
+	:param in_rate: The frame rate of the input audio.
+	:param out_rate: The frame rate of the output audio.
+	"""
+	converter = kek.format_conversion.FormatConverter(in_rate, 1, 2, out_rate, 1)
+	ultrasonic = numpy.concatenate((converter.convert(tone(30000, in_rate // 10, in_rate)), converter.flush()))
+	assert numpy.abs(ultrasonic[200:-200].astype(numpy.float32)).max() < 200  # Less than 1% of the amplitude of the input.
+
+	audible = numpy.concatenate((converter.convert(tone(1000, in_rate // 10, in_rate)), converter.flush()))
+	assert numpy.abs(audible[200:-200].astype(numpy.float32)).max() == pytest.approx(20000, rel=0.02)
+	expected = tone(1000, len(audible), out_rate)
+	numpy.testing.assert_allclose(audible[200:-200], expected[200:-200], atol=600)  # Not delayed by the filter.
+
+
+@pytest.mark.parametrize("in_rate, out_rate", [(44100, 48000), (96000, 44100), (44100, 32000)])
+def test_flush_frame_count(in_rate: int, out_rate: int) -> None:
+	"""
+	Tests that flushing never gives more frames than the converter says it can.
+	:param in_rate: The frame rate of the input audio.
+	:param out_rate: The frame rate of the output audio.
+	"""
+	for frame_count in (1, 2, 10, 999, 1000):
+		converter = kek.format_conversion.FormatConverter(in_rate, 2, 2, out_rate, 2)
+		converter.convert(sine(frame_count, in_rate, 2))
+		assert len(converter.flush()) <= converter.flush_frame_count()
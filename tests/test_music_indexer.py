@@ -0,0 +1,44 @@
+# Desktop environment for a domotics hub.
+# Copyright (C) 2026 Ghostkeeper
+# This application is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# This application is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for details.
+# You should have received a copy of the GNU Affero General Public License along with this application. If not, see <https://gnu.org/licenses/>.
+
+"""
+Tests watching the music library for changes.
+"""
+
+import os  # To move directories.
+import pathlib  # For the temporary directories of pytest.
+import pytest  # To skip the tests if inotify is not available.
+
+import kek.music_indexer  # The module being tested.
+
+
+@pytest.fixture
+def watcher(monkeypatch: pytest.MonkeyPatch) -> kek.music_indexer.Watcher:
+	"""
+	Create a watcher that doesn't wait long for changes to settle.
+	:param monkeypatch: To wait shorter for changes to settle.
+	:return: A watcher that doesn't watch anything yet.
+	"""
+	monkeypatch.setattr(kek.music_indexer, "settle_time", 0.1)
+	try:
+		return kek.music_indexer.Watcher()
+	except (AttributeError, OSError) as e:
+		pytest.skip(f"Inotify is not available: {e}")
+
+
+def test_move_directory(tmp_path: pathlib.Path, watcher: kek.music_indexer.Watcher) -> None:
+	"""
+	Tests that a moved directory, and its subdirectories, are no longer watched under their old path.
+	:param tmp_path: A temporary directory for this test.
+	:param watcher: The watcher to test with.
+	"""
+	(tmp_path / "old" / "sub").mkdir(parents=True)
+	for directory in (tmp_path, tmp_path / "old", tmp_path / "old" / "sub"):
+		watcher.watch(str(directory))
+
+	os.rename(tmp_path / "old", tmp_path / "new")
+	assert watcher.wait(5) == ({str(tmp_path / "old")}, {str(tmp_path / "new")}, {str(tmp_path)})
+	assert list(watcher.directories.values()) == [str(tmp_path)]
@@ -0,0 +1,424 @@
+# Desktop environment for a domotics hub.
+# Copyright (C) 2026 Ghostkeeper
+# This application is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# This application is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for details.
+# You should have received a copy of the GNU Affero General Public License along with this application. If not, see <https://gnu.org/licenses/>.
+
+"""
+Tests storing the music metadata in the database, and reading it from music files.
+"""
+
+import collections  # To reset the directories that are loaded.
+import mutagen.id3  # To write tags to a test file.
+import mutagen.wave  # To write tags to a test file.
+import pathlib  # For the temporary directories of pytest.
+import pytest  # To give each test its own database.
+import sqlite3  # To change the metadata while storing.
+import threading  # To upgrade the database from multiple threads.
+import wave  # To create a test file.
+
+import kek.music_metadata  # The module being tested.
+import kek.storage  # To put the database in a temporary directory.
+
+
+@pytest.fixture(autouse=True)
+def database(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> pathlib.Path:
+	"""
+	Give each test an empty database and empty metadata in memory.
+
+	The metadata is never stored in the background. Tests store it explicitly.
+	:param tmp_path: A temporary directory for this test.
+	:param monkeypatch: To replace the state of the module.
+	:return: The directory containing the database.
+	"""
+	monkeypatch.setattr(kek.storage, "cache", lambda: str(tmp_path))
+	monkeypatch.setattr(kek.music_metadata, "metadata", kek.music_metadata.Snapshot({}))
+	monkeypatch.setattr(kek.music_metadata, "dirty", set())
+	monkeypatch.setattr(kek.music_metadata, "loaded_directories", collections.OrderedDict())
+	monkeypatch.setattr(kek.music_metadata, "trigger_store", lambda: None)
+	kek.music_metadata.migrate()
+	return tmp_path
+
+
+def forget() -> None:
+	"""
+	Drop all metadata from memory, so that it has to be read from the database again.
+	"""
+	kek.music_metadata.metadata = kek.music_metadata.Snapshot({})
+	kek.music_metadata.loaded_directories.clear()
+
+
+def track(path: str, duration: float=60.0, artist: str="Artist", album: str="Album") -> kek.music_metadata.Entry:
+	"""
+	Create the metadata of a track.
+	:param path: The path to the track.
+	:param duration: The duration of the track.
+	:param artist: The artist of the track.
+	:param album: The album of the track.
+	:return: A metadata entry.
+	"""
+	return kek.music_metadata.Entry(path, duration, "Title", artist, album, "", 123.0, 44100, 2, 16, "flac", 1000000, 4567, 89)
+
+
+def version() -> int:
+	"""
+	Get the version of the database.
+	:return: The version number stored in the database.
+	"""
+	connection = kek.music_metadata.connect()
+	try:
+		return connection.execute("PRAGMA user_version").fetchone()[0]
+	finally:
+		connection.close()
+
+
+def write_wave(path: pathlib.Path, frame_rate: int=22050, channels: int=1, frame_count: int=11025) -> None:
+	"""
+	Create a silent WAV file.
+	:param path: Where to create the file.
+	:param frame_rate: The frame rate of the audio (Hz).
+	:param channels: The number of channels of the audio.
+	:param frame_count: The number of frames in the file.
+	"""
+	with wave.open(str(path), "wb") as wave_file:
+		wave_file.setnchannels(channels)
+		wave_file.setsampwidth(2)
+		wave_file.setframerate(frame_rate)
+		wave_file.writeframes(bytes(frame_count * channels * 2))
+
+
+def test_migrate() -> None:
+	"""
+	Tests that a new database is upgraded to the current version, and that upgrading again changes nothing.
+	"""
+	assert version() == len(kek.music_metadata.migrations)
+	kek.music_metadata.migrate()
+	assert version() == len(kek.music_metadata.migrations)
+
+
+def test_migrate_concurrently(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+	"""
+	Tests that upgrading the same database from many threads at once applies every upgrade once.
+	:param tmp_path: A temporary directory for this test.
+	:param monkeypatch: To use a different database.
+	"""
+	new_directory = tmp_path / "concurrent"
+	new_directory.mkdir()
+	monkeypatch.setattr(kek.storage, "cache", lambda: str(new_directory))
+	errors = []
+
+	def run() -> None:
+		try:
+			kek.music_metadata.migrate()
+		except Exception as e:
+			errors.append(e)
+
+	threads = [threading.Thread(target=run) for _ in range(8)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	assert errors == []
+	assert version() == len(kek.music_metadata.migrations)
+
+
+def test_migrate_newer() -> None:
+	"""
+	Tests that a database from a newer version of the application is not downgraded.
+	"""
+	connection = kek.music_metadata.connect()
+	connection.execute("PRAGMA user_version = 1000")
+	connection.close()
+	kek.music_metadata.migrate()
+	assert version() == 1000
+
+
+def test_store_round_trip() -> None:
+	"""
+	Tests that metadata that is stored is read back the same.
+	"""
+	entry = track("/music/album/track.flac")
+	kek.music_metadata.add(entry.path, entry)
+	kek.music_metadata.store()
+	forget()
+
+	kek.music_metadata.load_directory("/music/album")
+	loaded = kek.music_metadata.metadata[entry.path]
+	for field in kek.music_metadata.Entry.__slots__:
+		assert loaded[field] == entry[field]
+
+
+def test_store_update() -> None:
+	"""
+	Tests that storing changed metadata replaces what was stored before.
+	"""
+	kek.music_metadata.add("/music/track.flac", track("/music/track.flac", duration=60))
+	kek.music_metadata.store()
+	kek.music_metadata.add("/music/track.flac", track("/music/track.flac", duration=90))
+	kek.music_metadata.store()
+	forget()
+
+	kek.music_metadata.load_directory("/music")
+	assert kek.music_metadata.metadata["/music/track.flac"].duration == 90
+
+
+def test_store_remove() -> None:
+	"""
+	Tests that removed metadata is removed from the database too.
+	"""
+	kek.music_metadata.add("/music/track.flac", track("/music/track.flac"))
+	kek.music_metadata.store()
+	kek.music_metadata.remove("/music/track.flac")
+	kek.music_metadata.store()
+	forget()
+
+	kek.music_metadata.load_directory("/music")
+	assert "/music/track.flac" not in kek.music_metadata.metadata
+
+
+def test_directory_eviction(monkeypatch: pytest.MonkeyPatch) -> None:
+	"""
+	Tests that the metadata of the least recently used directory is dropped from memory.
+	:param monkeypatch: To keep fewer directories in memory.
+	"""
+	monkeypatch.setattr(kek.music_metadata, "directory_cache_size", 2)
+	for directory in ("/music/a", "/music/b", "/music/c"):
+		kek.music_metadata.add(directory + "/track.flac", track(directory + "/track.flac"))
+	kek.music_metadata.store()
+	forget()
+
+	kek.music_metadata.load_directory("/music/a")
+	kek.music_metadata.load_directory("/music/b")
+	kek.music_metadata.get("/music/a/track.flac")  # Now /music/b is the least recently used.
+	kek.music_metadata.load_directory("/music/c")
+	assert list(kek.music_metadata.loaded_directories) == ["/music/a", "/music/c"]
+	assert "/music/b/track.flac" not in kek.music_metadata.metadata
+	assert "/music/a/track.flac" in kek.music_metadata.metadata
+
+
+def test_directory_eviction_dirty(monkeypatch: pytest.MonkeyPatch) -> None:
+	"""
+	Tests that entries which are not stored yet stay in memory when their directory is evicted, until they are stored.
+	:param monkeypatch: To keep fewer directories in memory.
+	"""
+	monkeypatch.setattr(kek.music_metadata, "directory_cache_size", 2)
+	for directory in ("/music/a", "/music/b", "/music/c"):
+		kek.music_metadata.add(directory + "/track.flac", track(directory + "/track.flac"))
+	assert list(kek.music_metadata.loaded_directories) == ["/music/b", "/music/c"]
+	assert "/music/a/track.flac" in kek.music_metadata.metadata
+
+	kek.music_metadata.store()
+	assert kek.music_metadata.dirty == set()
+	assert "/music/a/track.flac" not in kek.music_metadata.metadata
+	assert "/music/b/track.flac" in kek.music_metadata.metadata
+
+
+def test_partially_loaded_directory() -> None:
+	"""
+	Tests that a directory is still read from the database if only some new entries were added to it.
+	"""
+	kek.music_metadata.add("/music/one.flac", track("/music/one.flac"))
+	kek.music_metadata.store()
+	forget()
+
+	kek.music_metadata.add("/music/two.flac", track("/music/two.flac"))
+	kek.music_metadata.load_directory("/music")
+	assert sorted(kek.music_metadata.metadata.directory("/music")) == ["/music/one.flac", "/music/two.flac"]
+
+
+def test_store_while_changing(monkeypatch: pytest.MonkeyPatch) -> None:
+	"""
+	Tests that entries stay dirty while they are being stored, and entries that change meanwhile stay dirty after.
+	:param monkeypatch: To change the metadata while storing.
+	"""
+	kek.music_metadata.add("/music/one.flac", track("/music/one.flac"))
+	kek.music_metadata.add("/music/two.flac", track("/music/two.flac"))
+	connect = kek.music_metadata.connect
+	dirty_while_storing = []
+
+	def change_and_connect() -> sqlite3.Connection:
+		dirty_while_storing.extend(sorted(kek.music_metadata.dirty))
+		kek.music_metadata.add("/music/two.flac", track("/music/two.flac", duration=30))
+		return connect()
+
+	monkeypatch.setattr(kek.music_metadata, "connect", change_and_connect)
+	kek.music_metadata.store()
+	assert dirty_while_storing == ["/music/one.flac", "/music/two.flac"]
+	assert kek.music_metadata.dirty == {"/music/two.flac"}
+
+	monkeypatch.setattr(kek.music_metadata, "connect", connect)
+	kek.music_metadata.store()
+	forget()
+	kek.music_metadata.load_directory("/music")
+	assert kek.music_metadata.metadata["/music/two.flac"].duration == 30
+
+
+def test_scan_concurrency(monkeypatch: pytest.MonkeyPatch) -> None:
+	"""
+	Tests that the threads to read files with are replaced when the number of threads to use changes.
+	:param monkeypatch: To change the number of threads.
+	"""
+	monkeypatch.setattr(kek.music_metadata, "scan_executor", None)
+	monkeypatch.setattr(kek.music_metadata, "scan_executor_concurrency", 0)
+	monkeypatch.setattr(kek.music_metadata, "scan_concurrency", 2)
+	first = kek.music_metadata.get_scan_executor()
+	assert kek.music_metadata.get_scan_executor() is first
+
+	monkeypatch.setattr(kek.music_metadata, "scan_concurrency", 3)
+	second = kek.music_metadata.get_scan_executor()
+	assert second is not first
+	assert kek.music_metadata.scan_executor_concurrency == 3
+	with pytest.raises(RuntimeError):  # The old threads were shut down.
+		first.submit(lambda: None)
+	second.shutdown()
+
+
+def test_store_cover(database: pathlib.Path) -> None:
+	"""
+	Tests that the same cover image is stored only once, and different images separately.
+	:param database: The directory containing the database, and the cover images.
+	"""
+	(database / "covers").mkdir()
+	first = kek.music_metadata.store_cover(b"image", ".png")
+	second = kek.music_metadata.store_cover(b"image", ".png")
+	other = kek.music_metadata.store_cover(b"other image", ".png")
+	assert first == second
+	assert first != other
+	assert sorted(path.name for path in (database / "covers").iterdir()) == sorted([pathlib.Path(first).name, pathlib.Path(other).name])
+	assert pathlib.Path(first).read_bytes() == b"image"
+
+
+def test_search() -> None:
+	"""
+	Tests that stored metadata can be found, through the search index triggers.
+	"""
+	kek.music_metadata.add("/music/one.flac", track("/music/one.flac", artist="Somebody"))
+	kek.music_metadata.add("/music/two.flac", track("/music/two.flac", artist="Nobody"))
+	kek.music_metadata.store()
+	assert [entry.path for entry in kek.music_metadata.search("some")] == ["/music/one.flac"]
+
+	kek.music_metadata.add("/music/one.flac", track("/music/one.flac", artist="Anybody"))
+	kek.music_metadata.store()
+	assert kek.music_metadata.search("some") == []
+
+
+def test_aggregates() -> None:
+	"""
+	Tests that the artist and album totals follow the tracks that are stored, but not playlists.
+	"""
+	kek.music_metadata.add("/music/a/one.flac", track("/music/a/one.flac", duration=60))
+	kek.music_metadata.add("/music/a/two.flac", track("/music/a/two.flac", duration=30))
+	kek.music_metadata.add("/music/b/three.flac", track("/music/b/three.flac", duration=10, album="Other"))
+	kek.music_metadata.add("/music/a/list.m3u", track("/music/a/list.m3u", duration=90))
+	kek.music_metadata.add("/music/a/LIST.M3U", track("/music/a/LIST.M3U", duration=90))  # The case of the extension doesn't matter.
+	kek.music_metadata.store()
+	assert kek.music_metadata.artists() == [{"artist": "Artist", "album_count": 2, "track_count": 3, "duration": 100}]
+	assert kek.music_metadata.albums("Artist") == [
+		{"artist": "Artist", "album": "Album", "track_count": 2, "duration": 90},
+		{"artist": "Artist", "album": "Other", "track_count": 1, "duration": 10},
+	]
+
+	kek.music_metadata.add("/music/a/one.flac", track("/music/a/one.flac", duration=20, album="Other"))
+	kek.music_metadata.remove("/music/b/three.flac")
+	kek.music_metadata.store()
+	assert kek.music_metadata.artists() == [{"artist": "Artist", "album_count": 2, "track_count": 2, "duration": 50}]
+	assert kek.music_metadata.albums("Artist") == [
+		{"artist": "Artist", "album": "Album", "track_count": 1, "duration": 30},
+		{"artist": "Artist", "album": "Other", "track_count": 1, "duration": 20},
+	]
+
+
+def test_is_playlist() -> None:
+	"""
+	Tests recognising playlist files, regardless of the case of their extension.
+	"""
+	assert kek.music_metadata.is_playlist("/music/list.m3u")
+	assert kek.music_metadata.is_playlist("/music/LIST.M3U")
+	assert not kek.music_metadata.is_playlist("/music/track.mp3")
+	assert not kek.music_metadata.is_playlist("/music/m3u")
+
+
+def test_directory_totals() -> None:
+	"""
+	Tests that the totals of every directory include the tracks in its subdirectories, but not playlists.
+	"""
+	kek.music_metadata.add("/music/a/one.flac", track("/music/a/one.flac", duration=60))
+	kek.music_metadata.add("/music/a/two.flac", track("/music/a/two.flac", duration=30))
+	kek.music_metadata.add("/music/b/three.flac", track("/music/b/three.flac", duration=10))
+	kek.music_metadata.add("/music/a/list.m3u", track("/music/a/list.m3u", duration=90))
+	kek.music_metadata.store()
+	assert kek.music_metadata.directory_totals(["/music", "/music/a", "/music/b"]) == {
+		"/music": (3, 100),
+		"/music/a": (2, 90),
+		"/music/b": (1, 10),
+	}
+
+	kek.music_metadata.add("/music/a/one.flac", track("/music/a/one.flac", duration=20))
+	kek.music_metadata.remove("/music/b/three.flac")
+	kek.music_metadata.store()
+	assert kek.music_metadata.directory_totals(["/music", "/music/a", "/music/b"]) == {
+		"/music": (2, 50),
+		"/music/a": (2, 50),
+	}
+
+
+def test_read_tags_stream_info(tmp_path: pathlib.Path) -> None:
+	"""
+	Tests reading the stream information of a file without tags.
+	:param tmp_path: A temporary directory for this test.
+	"""
+	path = tmp_path / "track.wav"
+	write_wave(path, frame_rate=22050, channels=1, frame_count=11025)
+	tags = kek.music_metadata.read_tags(str(path))
+	assert tags["duration"] == pytest.approx(0.5)
+	assert tags["sample_rate"] == 22050
+	assert tags["channels"] == 1
+	assert tags["bit_depth"] == 16
+	assert tags["codec"] == "wave"
+	assert tags["title"] == ""
+	assert tags["picture"] is None
+
+
+def test_read_tags_id3(tmp_path: pathlib.Path) -> None:
+	"""
+	Tests reading ID3 tags and the front cover from a file.
+	:param tmp_path: A temporary directory for this test.
+	"""
+	path = tmp_path / "track.wav"
+	write_wave(path)
+	tagged = mutagen.wave.WAVE(str(path))
+	tagged.add_tags()
+	tagged.tags.add(mutagen.id3.TIT2(encoding=3, text=["The Title"]))
+	tagged.tags.add(mutagen.id3.TPE1(encoding=3, text=["The Artist"]))
+	tagged.tags.add(mutagen.id3.TALB(encoding=3, text=["The Album"]))
+	tagged.tags.add(mutagen.id3.APIC(encoding=3, mime="image/png", type=mutagen.id3.PictureType.COVER_BACK, desc="back", data=b"back"))
+	tagged.tags.add(mutagen.id3.APIC(encoding=3, mime="image/jpeg", type=mutagen.id3.PictureType.COVER_FRONT, desc="front", data=b"front"))
+	tagged.save()
+
+	tags = kek.music_metadata.read_tags(str(path))
+	assert tags["title"] == "The Title"
+	assert tags["artist"] == "The Artist"
+	assert tags["album"] == "The Album"
+	assert tags["picture"] == (b"front", "image/jpeg")
+
+
+def test_playlist_relative_members(tmp_path: pathlib.Path) -> None:
+	"""
+	Tests that tracks in a playlist, referred to with a relative path, are not stored twice.
+	:param tmp_path: A temporary directory for this test.
+	"""
+	(tmp_path / "a").mkdir()
+	(tmp_path / "b").mkdir()
+	write_wave(tmp_path / "a" / "one.wav")
+	write_wave(tmp_path / "a" / "two.wav")
+	(tmp_path / "b" / "list.m3u").write_text("# Comment\n../a/one.wav\n../a/two.wav\n")
+	kek.music_metadata.add_directory(str(tmp_path / "a"))
+	kek.music_metadata.store()
+	forget()  # The tracks must be found in the database, not read again.
+
+	kek.music_metadata.add_directory(str(tmp_path / "b"))
+	assert kek.music_metadata.dirty == {str(tmp_path / "b" / "list.m3u")}
+	kek.music_metadata.store()
+	assert kek.music_metadata.get(str(tmp_path / "b" / "list.m3u")).duration == pytest.approx(1.0)
+	assert kek.music_metadata.directory_totals([str(tmp_path / "a"), str(tmp_path / "b")]) == {str(tmp_path / "a"): (2, pytest.approx(1.0))}
+	assert [artist["track_count"] for artist in kek.music_metadata.artists()] == [2]
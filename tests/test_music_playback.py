@@ -0,0 +1,108 @@
+# Desktop environment for a domotics hub.
+# Copyright (C) 2026 Ghostkeeper
+# This application is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# This application is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for details.
+# You should have received a copy of the GNU Affero General Public License along with this application. If not, see <https://gnu.org/licenses/>.
+
+"""
+Tests playing audio on the playback thread.
+"""
+
+import numpy  # To create sounds to play.
+import pytest  # To give each test its own playback thread.
+import queue  # To give each test its own commands.
+import threading  # To wait until the tracks ended.
+
+import kek.audio_output  # To record what is played.
+import kek.music_playback  # The module being tested.
+import kek.sound  # To create sounds to play.
+
+
+class RecordingOutput(kek.audio_output.NullOutput):
+	"""
+	Consumes audio in real time, like an audio device, and keeps everything that it consumed.
+	"""
+
+	def __init__(self) -> None:
+		"""
+		Prepare to record audio.
+		"""
+		super().__init__(realtime=True)
+		self.recording = bytearray()
+
+	def consume(self, data: bytes) -> None:
+		"""
+		Keep the audio that was pulled from the playback engine.
+		:param data: The interleaved bytes of the audio.
+		"""
+		self.recording += data
+
+
+@pytest.fixture
+def output(monkeypatch: pytest.MonkeyPatch) -> RecordingOutput:
+	"""
+	Start a new playback thread, which plays to a recording output.
+	:param monkeypatch: To replace the state of the module.
+	:return: The output that the audio is played to.
+	"""
+	monkeypatch.setattr(kek.music_playback, "play_thread", None)
+	monkeypatch.setattr(kek.music_playback, "commands", queue.Queue())
+	monkeypatch.setattr(kek.music_playback, "output_format", None)
+	monkeypatch.setattr(kek.music_playback, "is_paused", False)
+	recording_output = RecordingOutput()
+	kek.music_playback.start(recording_output)
+	return recording_output
+
+
+def sound(value: int, frame_count: int) -> kek.sound.Sound:
+	"""
+	Create a stereo sound in which every sample has the same value.
+	:param value: The value of the samples.
+	:param frame_count: The length of the sound, in frames.
+	:return: A sound at 44.1kHz.
+	"""
+	return kek.sound.Sound.from_frames(numpy.full((frame_count, 2), value, dtype=numpy.int16))
+
+
+def test_enqueue_gapless(output: RecordingOutput, monkeypatch: pytest.MonkeyPatch) -> None:
+	"""
+	Tests that a queued sound is played right after the current sound, without any silence in between.
+	:param output: The output that the audio is played to.
+	:param monkeypatch: To be notified when the sounds end.
+	"""
+	ended = []
+	all_ended = threading.Event()
+
+	def on_track_ended(number: int) -> None:
+		ended.append(number)
+		if len(ended) == 2:
+			all_ended.set()
+
+	monkeypatch.setattr(kek.music_playback, "on_track_ended", on_track_ended)
+	first = sound(1000, 8820)
+	second = sound(2000, 4410)
+	first_number = kek.music_playback.play(first)
+	second_number = kek.music_playback.enqueue(second)
+	assert all_ended.wait(5)
+	assert ended == [first_number, second_number]
+
+	samples = numpy.frombuffer(bytes(output.recording), dtype=numpy.int16)
+	played = numpy.trim_zeros(samples)  # Silence before the first sound started and after the second sound ended.
+	numpy.testing.assert_array_equal(played, numpy.concatenate((first.frames.ravel(), second.frames.ravel())))
+
+
+def test_enqueue_after_end(output: RecordingOutput, monkeypatch: pytest.MonkeyPatch) -> None:
+	"""
+	Tests that a sound that is queued after the current sound already ended starts playing right away.
+	:param output: The output that the audio is played to.
+	:param monkeypatch: To be notified when the sounds end.
+	"""
+	ended = queue.Queue()
+	monkeypatch.setattr(kek.music_playback, "on_track_ended", ended.put)
+	first_number = kek.music_playback.play(sound(1000, 2205))
+	assert ended.get(timeout=5) == first_number
+
+	second_number = kek.music_playback.enqueue(sound(2000, 2205))
+	assert ended.get(timeout=5) == second_number
+	samples = numpy.frombuffer(bytes(output.recording), dtype=numpy.int16)
+	assert numpy.count_nonzero(samples == 2000) == 2205 * 2
@@ -0,0 +1,89 @@
+# Desktop environment for a domotics hub.
+# Copyright (C) 2026 Ghostkeeper
+# This application is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# This application is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for details.
+# You should have received a copy of the GNU Affero General Public License along with this application. If not, see <https://gnu.org/licenses/>.
+
+"""
+Tests the ring buffer that passes audio from the playback thread to the audio device.
+"""
+
+import threading  # To test with a writing and a reading thread.
+
+import kek.ring_buffer  # The module being tested.
+
+
+def test_write_read() -> None:
+	"""
+	Tests that data comes out of the buffer in the same order as it went in.
+	"""
+	buffer = kek.ring_buffer.RingBuffer(16)
+	assert buffer.write(b"abcdef") == 6
+	assert buffer.available() == 6
+	assert buffer.free() == 10
+	assert buffer.read(4) == b"abcd"
+	assert buffer.read(100) == b"ef"  # Only as much as is available.
+	assert buffer.available() == 0
+	assert buffer.free() == 16
+
+
+def test_write_full() -> None:
+	"""
+	Tests that only as much is written as fits in the buffer.
+	"""
+	buffer = kek.ring_buffer.RingBuffer(8)
+	assert buffer.write(b"0123456789") == 8
+	assert buffer.free() == 0
+	assert buffer.write(b"x") == 0
+	assert buffer.read(10) == b"01234567"
+
+
+def test_wrap_around() -> None:
+	"""
+	Tests writing and reading across the end of the buffer.
+	"""
+	buffer = kek.ring_buffer.RingBuffer(8)
+	buffer.write(b"012345")
+	assert buffer.read(5) == b"01234"
+	assert buffer.write(b"abcdef") == 6  # Wraps around the end.
+	assert buffer.available() == 7
+	assert buffer.read(7) == b"5abcdef"
+
+
+def test_discard() -> None:
+	"""
+	Tests that the reader skips data that was discarded, and continues with what was written after that.
+	"""
+	buffer = kek.ring_buffer.RingBuffer(8)
+	buffer.write(b"0123")
+	assert buffer.read(1) == b"0"
+	buffer.discard()
+	assert buffer.available() == 0
+	assert buffer.free() == 5  # The discarded data takes space until the reader skips it.
+	buffer.write(b"ab")
+	assert buffer.read(8) == b"ab"
+	assert buffer.free() == 8
+
+
+def test_threads() -> None:
+	"""
+	Tests that a stream written by one thread arrives intact at another thread.
+	"""
+	data = bytes(range(256)) * 200
+	buffer = kek.ring_buffer.RingBuffer(1000)
+	received = []
+
+	def reader() -> None:
+		total = 0
+		while total < len(data):
+			chunk = buffer.read(333)
+			received.append(chunk)
+			total += len(chunk)
+
+	thread = threading.Thread(target=reader)
+	thread.start()
+	position = 0
+	while position < len(data):
+		position += buffer.write(data[position:position + 777])
+	thread.join(timeout=10)
+	assert b"".join(received) == data
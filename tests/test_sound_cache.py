@@ -0,0 +1,156 @@
+# Desktop environment for a domotics hub.
+# Copyright (C) 2026 Ghostkeeper
+# This application is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# This application is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for details.
+# You should have received a copy of the GNU Affero General Public License along with this application. If not, see <https://gnu.org/licenses/>.
+
+"""
+Tests the memory and disk budgets of the cache of decoded audio.
+"""
+
+import collections  # To reset the cache.
+import numpy  # To create sounds to cache.
+import os.path  # To check the files in the disk cache.
+import pathlib  # For the temporary directories of pytest.
+import pytest  # To give each test its own cache.
+import typing
+
+import kek.sound  # To create sounds to cache.
+import kek.sound_cache  # The module being tested.
+import kek.storage  # To put the disk cache in a temporary directory.
+
+sound_bytes = 1000 * 2 * 2
+"""
+The size of each of the sounds in these tests, in bytes.
+"""
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> typing.Iterator[pathlib.Path]:
+	"""
+	Give each test an empty cache, with room for two sounds in memory and two sounds on disk.
+	:param tmp_path: A temporary directory for this test.
+	:param monkeypatch: To replace the state of the module.
+	:return: The directory of the disk cache.
+	"""
+	monkeypatch.setattr(kek.storage, "cache", lambda: str(tmp_path))
+	(tmp_path / "sounds").mkdir()
+	monkeypatch.setattr(kek.sound_cache, "memory_budget", sound_bytes * 2)
+	monkeypatch.setattr(kek.sound_cache, "disk_budget", sound_bytes * 2)
+	monkeypatch.setattr(kek.sound_cache, "memory_cache", collections.OrderedDict())
+	monkeypatch.setattr(kek.sound_cache, "memory_size", 0)
+	monkeypatch.setattr(kek.sound_cache, "spilling", {})
+	monkeypatch.setattr(kek.sound_cache, "disk_cache", collections.OrderedDict())
+	monkeypatch.setattr(kek.sound_cache, "disk_size", 0)
+	monkeypatch.setattr(kek.sound_cache, "disk_cache_loaded", False)
+	yield tmp_path / "sounds"
+	wait_for_spilling()  # Don't let sounds of this test be spilled to the cache of the next test.
+
+
+def sound(value: int) -> kek.sound.Sound:
+	"""
+	Create a stereo sound of 1000 frames, in which every sample has the same value.
+	:param value: The value of the samples.
+	:return: A sound of ``sound_bytes`` bytes.
+	"""
+	return kek.sound.Sound.from_frames(numpy.full((1000, 2), value, dtype=numpy.int16))
+
+
+def wait_for_spilling() -> None:
+	"""
+	Wait until all sounds that were evicted from memory are written to disk.
+	"""
+	kek.sound_cache.spill_executor.submit(lambda: None).result(timeout=10)
+
+
+def test_memory_hit() -> None:
+	"""
+	Tests that a sound that was added can be found again, without copying it.
+	"""
+	original = sound(1)
+	kek.sound_cache.add("one", original)
+	assert kek.sound_cache.find("one") is original
+	assert kek.sound_cache.find("two") is None
+	assert kek.sound_cache.memory_size == sound_bytes
+
+
+def test_memory_budget(cache: pathlib.Path) -> None:
+	"""
+	Tests that the least recently used sound is spilled to disk when the memory budget is exceeded.
+	:param cache: The directory of the disk cache.
+	"""
+	kek.sound_cache.add("one", sound(1))
+	kek.sound_cache.add("two", sound(2))
+	kek.sound_cache.find("one")  # Now "two" is the least recently used.
+	kek.sound_cache.add("three", sound(3))
+	assert list(kek.sound_cache.memory_cache) == ["one", "three"]
+	assert kek.sound_cache.memory_size == sound_bytes * 2
+
+	wait_for_spilling()
+	assert list(kek.sound_cache.disk_cache) == ["two"]
+	assert os.path.exists(cache / "two-44100.npy")
+	assert kek.sound_cache.spilling == {}
+
+
+def test_disk_hit() -> None:
+	"""
+	Tests that a sound that was spilled to disk is memory-mapped again, and doesn't count towards the memory budget.
+	"""
+	kek.sound_cache.add("one", sound(1))
+	kek.sound_cache.add("two", sound(2))
+	kek.sound_cache.add("three", sound(3))
+	wait_for_spilling()
+
+	found = kek.sound_cache.find("one")
+	assert found is not None
+	assert found.frame_rate == 44100
+	assert isinstance(found.channels[0], numpy.memmap)
+	numpy.testing.assert_array_equal(found.frames, sound(1).frames)
+	assert kek.sound_cache.sound_size(found) == 0
+	assert kek.sound_cache.memory_size == sound_bytes * 2  # Only "two" and "three" take memory.
+
+
+def test_disk_budget(cache: pathlib.Path) -> None:
+	"""
+	Tests that the least recently used files are deleted when the disk budget is exceeded.
+	:param cache: The directory of the disk cache.
+	"""
+	for key, value in (("one", 1), ("two", 2), ("three", 3), ("four", 4), ("five", 5)):
+		kek.sound_cache.add(key, sound(value))
+	wait_for_spilling()
+
+	assert list(kek.sound_cache.disk_cache) == ["two", "three"]
+	assert kek.sound_cache.disk_size == sound_bytes * 2
+	assert sorted(os.listdir(cache)) == ["three-44100.npy", "two-44100.npy"]
+
+
+def test_memory_cache_size(monkeypatch: pytest.MonkeyPatch) -> None:
+	"""
+	Tests that memory-mapped sounds are evicted when there are too many, even though they take no memory.
+	:param monkeypatch: To keep fewer sounds in memory.
+	"""
+	for key, value in (("one", 1), ("two", 2), ("three", 3), ("four", 4), ("five", 5)):
+		kek.sound_cache.add(key, sound(value))
+	wait_for_spilling()
+	monkeypatch.setattr(kek.sound_cache, "memory_budget", sound_bytes * 100)
+	monkeypatch.setattr(kek.sound_cache, "memory_cache_size", 3)
+
+	kek.sound_cache.find("two")  # Memory-mapped from the disk cache.
+	kek.sound_cache.find("three")
+	assert list(kek.sound_cache.memory_cache) == ["five", "two", "three"]
+	assert kek.sound_cache.memory_size == sound_bytes  # Only "five" takes memory.
+
+
+def test_incomplete_files(cache: pathlib.Path) -> None:
+	"""
+	Tests that files which were not completely written to the disk cache are deleted when the disk cache is read.
+	:param cache: The directory of the disk cache.
+	"""
+	(cache / "incomplete-44100.npy.tmp").write_bytes(b"half a sound")
+	kek.sound_cache.add("one", sound(1))
+	kek.sound_cache.add("two", sound(2))
+	kek.sound_cache.add("three", sound(3))
+	wait_for_spilling()
+
+	assert kek.sound_cache.find("one") is not None  # Reads the disk cache.
+	assert sorted(os.listdir(cache)) == ["one-44100.npy"]